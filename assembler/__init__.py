@@ -1,8 +1,16 @@
 import re
+import sys
+import struct
+from array import array
+from . import lang, isa, listing, schedule, wcet
 from .state import State
+from .pending import Pending, word_typecode
 from .expression import ConstantExpression
+from .exceptions import AssemblerError, AssemblyFailedError, ForwardReferenceError
 
-__all__ = ["assemble"]
+__all__ = ["assemble", "initialize", "load_isa", "Assembler", "AssemblerError", "AssemblyFailedError"]
+
+__version__ = "0.1"
 
 _const_parser = None
 
@@ -13,306 +21,596 @@ def _evaluate_d(expression : str, state : State) -> int:
     if not value:
         value = _const_parser.Evaluate(expression)
 
-    return "{:0>9b}".format(value)
+    if value < 0 or value > 0x1FF:
+        raise AssemblerError(state.LineNumber, "d-field expression evaluated to a value outside of $000-$1FF.")
 
-def _evaluate_s(expression : str, state : State) -> str:
+    return value
 
-    value = _get_register(expression) or state.GetLabelAddress(expression)
+def _evaluate_s(expression : str, state : State) -> int:
 
-    if not value:
+    value = _get_register(expression)
+
+    if value is None:
+        value = state.GetLabelAddress(expression)
+
+    if expression.startswith(_literal_prefix):
+        # a literal is only ever a label, and may be at cog address 0
+        if value is None:
+            raise state.Unresolved("Could not resolve literal: {}".format(expression))
+
+    elif not value:
         value = _const_parser.Evaluate(expression)
 
     if value > 0x1FF:
         raise AssemblerError(state.LineNumber, "s-field expression evaluated to a value greater than $1FF.")
 
-    return "{:0>9b}".format(value)
+    if value < 0:
+        raise AssemblerError(state.LineNumber, "s-field expression evaluated to a negative value.")
+
+    return value
 
 def _get_register(name : str) -> int:
     return None if name not in lang.registers else lang.registers[name]
 
-def assemble(source, binary_format="binary", hub_offset=0, syntax_version=1):
+def _prepare_parser(state : State, expression_parser : str):
     global _const_parser
 
-    state = State()
-    pending = []
-    output = []
-
-    if binary_format != "raw":
-        state.HubAddress = 0x10
+    # The parser (grammar and parsed-expression cache) only depends on the symbol
+    # table through its state, so it is kept warm between calls.
+    if _const_parser is None or expression_parser not in (None, _const_parser.Parser):
+        _const_parser = ConstantExpression(state, parser=expression_parser)
     else:
-        state.HubAddress = int(hub_offset)
+        _const_parser.SetState(state)
 
-    _const_parser = ConstantExpression(state)
+def initialize(expression_parser=None):
+    '''Builds the constant expression parser ahead of the first call to assemble()'''
 
-    # PASS 1
-    for line in source:
-        state.LineNumber += 1
-        
-        if "'" in line:
-            line = line[:line.index("'")]     # remove comments
-        
-        if line == "" or str.isspace(line):     # ignore empty lines
-            continue
-        
-        line = line.upper()
+    _prepare_parser(State(), expression_parser)
 
-        parts = line.split(maxsplit=1)
+def load_isa(path : str = None):
+    '''Switches to the ISA definition file at path, or back to the built-in ISA if path is None
+        Raises OSError or ValueError if the file cannot be used.'''
 
-        label = ""
-        directive = ""
-        cond = ""
-        opcode = ""
-        parameters = ""
+    global _const_parser
 
-        try:
-            if parts[0] not in lang.reserved_words:
-                label = parts[0]
-                parts = parts[1].split(maxsplit=1) if len(parts) == 2 else []
-
-            if parts and parts[0] in lang.directives:
-                directive = parts[0]
-                parameters = parts[1] if len(parts) == 2 else ""
-                parts = []
-
-            if parts and parts[0] in lang.conditions:
-                cond = parts[0]
-                parts = parts[1].split(maxsplit=1) if len(parts) == 2 else []
-
-            if parts and parts[0] in lang.instructions:
-                opcode = parts[0]
-                parameters = parts[1] if len(parts) == 2 else ""
-                parts = []
-
-            if parts and parts[0] in lang.datatypes:
-                opcode = parts[0]
-                parameters = parts[1] if len(parts) == 2 else ""
-                parts = []
-
-            if label != "":
-                if directive in ("ORG", "FIT"):
-                    raise AssemblerError(state.LineNumber, "Labels are not allowed for ORG or FIT.")
-         
-                if not state.AddLabel(label):
-                    raise AssemblerError(state.LineNumber, "Could not add label '{}'".format(label))
-
-            if directive != "":
-                if directive == "ORG":
-                    if parameters == "":
-                        state.ORG()
-                    else:
-                        state.ORG(_const_parser.Evaluate(parameteters))
+    if isa.load(path):
+        _const_parser = None        # cached parses have names classified as registers or constants
 
-                elif directive == "FIT":
-                    fit = (parameters == "") and state.FIT() or state.FIT(_const_parser.Evaluate(parameters))
+# The first three words of a line, then the rest of it, up to any comment.  A
+# line needs at most three words (label, condition, opcode) to be classified.
+_line_pattern = re.compile(r"\s*([^\s']+)(?:\s+([^\s']+))?(?:\s+([^\s']+))?\s*([^']*)")
 
-                    if not fit:
-                        raise AssemblerError(state.LineNumber, "It doesn't FIT!")
+_not_keyword = (None, None)
 
-                elif directive == "RES":
-                    state.FixLabelAddresses()
+def _remainder(match, index : int) -> str:
+    # the text following word index (0-2) of a _line_pattern match
+    if index == 2:
+        return match.group(4)
 
-                    if parameters == "":
-                        state.RES()
-                    else:
-                        state.RES(_const_parser.Evaluate(parameters))
+    if match.group(index + 2) is None:
+        return ""
 
-                else:
-                    raise AssemblerError(state.LineNumber, "Unrecognized directive!")
-        
-            if opcode != "":
-                state.FixLabelAddresses()
+    return match.string[match.start(index + 2):match.end(4)]
 
-                pending.append((cond, opcode, parameters.strip(), state.LineNumber, state.CogAddress, state.HubAddress, line))
+# Literal pool mode: an immediate source operand that does not fit in 9 bits is
+# replaced with a register holding its value.  The registers are the pool, a
+# LONG for each different value, placed at the next LITPOOL, RES, ORG or FIT
+# (before the directive, so FIT counts the pool), or at the end of the source.
+# Only immediates that can be evaluated when their line is read are pooled.
+_literal_prefix = "LITERAL$"        # not a valid label, so it never clashes with one
+_literal_pattern = re.compile(r"([^,]+,\s*)#(.+?)((?:[\s,]+(?:WZ|WC|WR|NR))*)\s*$")
+_literal_branches = ("JMPRET", "DJNZ", "TJZ", "TJNZ")     # the source operand is a jump target
 
-                state.CogAddress += 1
-                state.HubAddress += 1
+def _pool_literal(opcode : str, parameters : str, state : State) -> str:
+    # returns parameters, with an oversized immediate source operand replaced by its literal
+    match = _literal_pattern.match(parameters)
 
+    if match is None or opcode in _literal_branches or not lang.instructions[opcode][4]:
+        return parameters
 
-            if directive == "" and opcode == "" and label == "":
-                raise AssemblerError(state.LineNumber, "unrecognized text: {}".format(line))
+    state.Deferring = True
 
-            # print("> {0}".format(line.rstrip()))
+    try:
+        value = _const_parser.Evaluate(match.group(2))
+    except (AssemblerError, ForwardReferenceError):
+        return parameters           # reported, if it is an error, by pass 2
+    finally:
+        state.Deferring = False
 
-        except AssemblerError as e:
-            state.AddError(e)
+    if not isinstance(value, int) or 0 <= value <= 0x1FF:
+        return parameters
 
-    # print("Pass 2...")
+    value &= 0xFFFFFFFF
+    name = state.Literals.get(value)
 
-    # PASS 2
-    for line in pending:
-        state.SetLineNumber(line[3])
+    if name is None:
+        name = state.Literals[value] = "{}{}".format(_literal_prefix, state.LiteralLongs + len(state.Literals))
 
-        parameters = line[2]
+    state.LiteralUses += 1
 
-        try:
-            if line[1] in lang.datatypes:
-                value = _const_parser.Evaluate(parameters)
-
-                if line[1] == "BYTE":
-                    if isinstance(value, list):
-                        temp = value[0]
-                        count = 8
-                        for b in (value + [0,0,0])[1:]:
-                            if b < 0: b += 0x100
-                            temp += (b << count)
-                            count += 8
-                            if count == 32: break
-                        value = temp
-                    elif value < 0:
-                        value += 0x100
-                
-                elif line[1] == "WORD":
-                    if isinstance(value, list):
-                        temp = value[0]
-                        count = 16
-                        for b in (value + [0])[1:]:
-                            if b < 0: b += 0x10000
-                            temp += (b << count)
-                            count += 16
-                            if count == 32: break
-                        value = temp
-                    elif value < 0:
-                        value += 0x10000
+    return match.group(1) + name + match.group(3)
+
+def _place_literals(state : State, pending : Pending):
+    '''Appends the literals waiting to be placed as LONGs at the current address'''
+
+    for (value, name) in state.Literals.items():
+        state.PlaceSymbol(name)
+
+        pending.Append("", "LONG", "${:X}".format(value), state.LineNumber, state.CogAddress, state.HubAddress, state.CurrentLabel)
+
+        state.CogAddress += 1
+        state.HubAddress += 1
+
+    state.LiteralLongs += len(state.Literals)
+    state.Literals.clear()
+
+def _pass1(line : str, state : State, pending : Pending):
+    '''Processes one source line, appending any instruction or data to pending'''
+
+    state.LineNumber += 1
+
+    match = _line_pattern.match(line.upper())
+
+    if match is None:     # ignore empty lines and comments
+        return
+
+    words = match.group(1, 2, 3)
+    keywords = lang.keywords
+
+    label = ""
+    directive = ""
+    cond = ""
+    opcode = ""
+    parameters = ""
+
+    try:
+        index = 0
+        kind = keywords.get(words[0], _not_keyword)[0]
+
+        if kind is None:
+            label = words[0]
+            index = 1
+            kind = keywords.get(words[1], _not_keyword)[0]
+
+        if kind == "directive":
+            directive = words[index]
+            parameters = _remainder(match, index)
+
+        elif kind == "condition":
+            cond = words[index]
+            index += 1
+            kind = keywords.get(words[index], _not_keyword)[0]
+
+        if kind in ("instruction", "datatype"):
+            opcode = words[index]
+            parameters = _remainder(match, index)
+
+        if directive in ("ORG", "FIT", "RES") and state.Literals:
+            _place_literals(state, pending)
+
+        if label != "":
+            if directive in ("ORG", "FIT"):
+                raise AssemblerError(state.LineNumber, "Labels are not allowed for ORG or FIT.")
+     
+            if not state.AddLabel(label):
+                raise AssemblerError(state.LineNumber, "Could not add label '{}'".format(label))
+
+        if directive != "":
+            if directive == "ORG":
+                if parameters == "":
+                    state.ORG()
+                else:
+                    state.ORG(_const_parser.Evaluate(parameters))
+
+            elif directive == "FIT":
+                fit = (parameters == "") and state.FIT() or state.FIT(_const_parser.Evaluate(parameters))
+
+                if not fit:
+                    raise AssemblerError(state.LineNumber, "It doesn't FIT!")
+
+            elif directive == "RES":
+                state.FixLabelAddresses()
+
+                if parameters == "":
+                    state.RES()
                 else:
-                    if isinstance(value, list):
-                        value = value[0]
-                
-                    if value < 0:
-                        value += 0x100000000
+                    state.RES(_const_parser.Evaluate(parameters))
+
+            elif directive == "LITPOOL":
+                if parameters.strip() != "":
+                    raise AssemblerError(state.LineNumber, "LITPOOL does not take a value.")
+
+                state.FixLabelAddresses()
+
+                if state.Literals:
+                    _place_literals(state, pending)
 
-                bits = "{:0>32b}".format(value)
             else:
-                rules = lang.instructions[line[1]]
-
-                bits = rules[0]
-
-                if rules[5] and line[0]:
-                    cond = lang.conditions[line[0]]
-                    bits = bits[:10] + cond + bits[14:]
-
-                if parameters:
-
-                    wr_nr = False
-                    effect = re.split("[\s\t\n,]+", parameters)[-1]
-
-                    while effect in lang.effects:
-                        if effect == "WZ":
-                            if not line[1]:
-                                raise AssemblerError(state.LineNumber, "WZ Not allowed!")
-
-                            bits = bits[:6] + "1" + bits[7:]
-                
-                        elif effect == "WC":
-                            if not line[2]:
-                                raise AssemblerError(state.LineNumber, "WC Not allowed!")
-
-                            bits = bits[:7] + "1" + bits[8:]
-                
-                        elif effect in ("WR", "NR"):
-                            if not line[3]:
-                                raise AssemblerError(state.LineNumber, "WR Not allowed!")
-                            if wr_nr:
-                                raise AssemblerError(state.LineNumber, "Cannot use NR and WR at the same time.")
-
-                            bits = bits[:8] + ("1" if effect == "WR" else "0") + bits[9:]
-                            wr_nr = True
-
-                        parameters = parameters[:-3]
-
-                        effect = parameters and re.split("[\s\t\n,]+", parameters)[-1] or ""
-
-                    if parameters:
-                        if "d" in bits and "s" in bits:
-                            (d, s) = parameters.split(",")
-                        elif "d" in bits:
-                            d = parameters
-                        elif "s" in bits:
-                            s = parameters
-                        else:
-                            raise AssemblerError(state.LineNumber, "Unrecognized parameters: {}".format(parameters))
-                
-                        if "d" in bits:
-                            d = d.strip()
-                            d = _evaluate_d(d, state)
-                            d_start = bits.index("d")
-                            d_stop = bits.rindex("d")
-                            bits = bits[:d_start] + d + bits[d_stop+1:]
-
-                        if "s" in bits:
-                            s = s.strip()
-                            if s[0] == "#":
-                                if not rules[4]:
-                                    raise AssemblerError(state.LineNumber, "Source cannot have an immediate value.")
-
-                                bits = bits[:9] + "1" + bits[10:]
-                                s = s[1:]
-
-                            s = _evaluate_s(s, state)
-                            s_start = bits.index("s")
-                            s_stop = bits.rindex("s")
-                            bits = bits[:s_start] + s + bits[s_stop+1:]
-
-                    if len(rules) == 7:
-                        bits = rules[6](bits, line[2], state)
-
-                bits = re.sub("[^01]", "0", bits)
-
-            output.append(int(bits[24:32] + bits[16:24] + bits[8:16] + bits[0:8], 2))
-
-            # hex = format(output[-1], "0>8x").upper()
-            # print("[{}][{}] {}".format(bits, hex, line[5].rstrip()))
+                raise AssemblerError(state.LineNumber, "Unrecognized directive!")
+    
+        if opcode != "":
+            state.FixLabelAddresses()
+
+            parameters = parameters.strip()
+
+            if state.Literals is not None and opcode not in lang.datatypes:
+                parameters = _pool_literal(opcode, parameters, state)
+
+            pending.Append(cond, opcode, parameters, state.LineNumber, state.CogAddress, state.HubAddress, state.CurrentLabel)
+
+            state.CogAddress += 1
+            state.HubAddress += 1
+
+
+        if directive == "" and opcode == "" and label == "":
+            raise AssemblerError(state.LineNumber, "unrecognized text: {}".format(match.string[:match.end(4)]))
+
+        # print("> {0}".format(line.rstrip()))
+
+    except AssemblerError as e:
+        state.AddError(e)
+
+def _encode(line : tuple, state : State) -> int:
+    '''Encodes one pending entry.  Raises AssemblerError on failure.'''
+
+    state.SetLineNumber(line[3], line[6])
+
+    parameters = line[2]
+
+    if line[1] in lang.datatypes:
+        value = _const_parser.Evaluate(parameters)
+
+        if line[1] == "BYTE":
+            if isinstance(value, list):
+                temp = value[0]
+                count = 8
+                for b in (value + [0,0,0])[1:]:
+                    if b < 0: b += 0x100
+                    temp += (b << count)
+                    count += 8
+                    if count == 32: break
+                value = temp
+            elif value < 0:
+                value += 0x100
         
-        except AssemblerError as e:
-            state.AddError(e)
+        elif line[1] == "WORD":
+            if isinstance(value, list):
+                temp = value[0]
+                count = 16
+                for b in (value + [0])[1:]:
+                    if b < 0: b += 0x10000
+                    temp += (b << count)
+                    count += 16
+                    if count == 32: break
+                value = temp
+            elif value < 0:
+                value += 0x10000
+        else:
+            if isinstance(value, list):
+                value = value[0]
+        
+            if value < 0:
+                value += 0x100000000
 
+        word = value & 0xFFFFFFFF
+    else:
+        rules = lang.instructions[line[1]]
+        (word, d_shift, d_mask, s_shift, s_mask) = lang.encodings[line[1]]
 
-    if state.Errors:
-        print("Errors Encountered:\n")
+        if rules[5] and line[0]:
+            word = (word & ~lang.condition_mask) | (lang.condition_codes[line[0]] << lang.condition_shift)
 
-        for error in state.Errors:
-            print("{: >3} : {}\n".format(error.LineNumber, error.Message))
-    
-        exit()
+        if parameters:
+
+            wr_nr = False
+            effect = re.split("[\s\t\n,]+", parameters)[-1]
 
+            while effect in lang.effects:
+                if effect == "WZ":
+                    if not line[1]:
+                        raise AssemblerError(state.LineNumber, "WZ Not allowed!")
 
-    data = bytearray()
+                    word |= lang.z_flag
         
-    checksum = 0
+                elif effect == "WC":
+                    if not line[2]:
+                        raise AssemblerError(state.LineNumber, "WC Not allowed!")
 
-    for v in output:
-        data += bytearray.fromhex(format(v, "0>8x"))
+                    word |= lang.c_flag
+        
+                elif effect in ("WR", "NR"):
+                    if not line[3]:
+                        raise AssemblerError(state.LineNumber, "WR Not allowed!")
+                    if wr_nr:
+                        raise AssemblerError(state.LineNumber, "Cannot use NR and WR at the same time.")
+
+                    if effect == "WR":
+                        word |= lang.r_flag
+                    else:
+                        word &= ~lang.r_flag
 
-    # Note: for "raw" format, all you get is the data.  So there is no additional processing.
+                    wr_nr = True
+
+                parameters = parameters[:-3]
 
-    if binary_format in ("binary", "eeprom"):        
-        spin_code = bytearray.fromhex("35 37 03 35   2C 00 00 00")
+                effect = parameters and re.split("[\s\t\n,]+", parameters)[-1] or ""
+
+            if parameters:
+                if d_mask and s_mask:
+                    (d, s) = parameters.split(",")
+                elif d_mask:
+                    d = parameters
+                elif s_mask:
+                    s = parameters
+                else:
+                    raise AssemblerError(state.LineNumber, "Unrecognized parameters: {}".format(parameters))
         
-        pbase = 0x0010
-        pcurr = pbase + len(data)
-        vbase = pcurr + len(spin_code)
-        dbase = vbase + 0x08
-        dcurr = dbase + 0x04
-
-        # Header (16 bytes)
-        header  = bytearray(reversed(bytearray.fromhex(format(80000000, "0>8x"))))     # clkfreq   (4)
-        header += bytearray([0x6F])                                                    # clkmode   (1)
-        header += bytearray([0x00])                                                    # checksum  (1)
-        header += bytearray(reversed(bytearray.fromhex(format(pbase, "0>4x"))))        # pbase     (2)
-        header += bytearray(reversed(bytearray.fromhex(format(vbase, "0>4x"))))        # vbase     (2)
-        header += bytearray(reversed(bytearray.fromhex(format(dbase, "0>4x"))))        # dbase     (2)
-        header += bytearray(reversed(bytearray.fromhex(format(pcurr, "0>4x"))))        # pcurr     (2)
-        header += bytearray(reversed(bytearray.fromhex(format(dcurr, "0>4x"))))        # dcurr     (2)
-    
-        data = header + data + spin_code
+                if d_mask:
+                    d = d.strip()
+                    word |= (_evaluate_d(d, state) << d_shift) & d_mask
+
+                if s_mask:
+                    s = s.strip()
+                    if s[0] == "#":
+                        if not rules[4]:
+                            raise AssemblerError(state.LineNumber, "Source cannot have an immediate value.")
+
+                        word |= lang.i_flag
+                        s = s[1:]
+
+                    word |= (_evaluate_s(s, state) << s_shift) & s_mask
+
+            if len(rules) == 7:
+                word = rules[6](word, line[2], state)
+
+    # hex = format(word, "0>8x").upper()
+    # print("[{:0>32b}][{}] {} {} {}".format(word, hex, line[0], line[1], line[2]))
+
+    return word
+
+# Image layout for the "binary" and "eeprom" formats:
+#
+#   $0000   header (clkfreq, clkmode, checksum, pbase, vbase, dbase, pcurr, dcurr)
+#   pbase   assembled longs
+#   pcurr   spin code that launches the assembled code into cog 0
+#   vbase   initial spin stack frame (eeprom only; the loader supplies it otherwise)
+#   dbase   zero padding up to _eeprom_size (eeprom only)
+
+_header = struct.Struct("<IBBHHHHH")
+_spin_code = bytes.fromhex("35 37 03 35   2C 00 00 00")
+_stack_frame = bytes([0xff, 0xff, 0xf9, 0xff] * 2)
+_eeprom_size = 0x8000
+
+def _pack_words(view : memoryview, output : array):
+    if sys.byteorder == "little":
+        view.cast(word_typecode)[:] = output
+    else:
+        struct.pack_into("<{}I".format(len(output)), view, 0, *output)
+
+def _build_image(output : array, binary_format : str) -> bytearray:
+    code_size = len(output) * 4
+
+    # Note: for "raw" format, all you get is the data.  So there is no additional processing.
+
+    if binary_format not in ("binary", "eeprom"):
+        data = bytearray(code_size)
+        _pack_words(memoryview(data), output)
+        return data
+
+    pbase = 0x0010
+    pcurr = pbase + code_size
+    vbase = pcurr + len(_spin_code)
+    dbase = vbase + len(_stack_frame)
+    dcurr = dbase + 0x04
 
-        # the modulus operators are due to Python's lack of a signed char type.
-        # Same as "checksum = 0x14 - sum(data)".
-        checksum = (sum(data) + 0xEC) % 256
-        checksum = (256 - checksum) % 256
-        data[0x05] = checksum
+    if binary_format == "eeprom":
+        if dbase > _eeprom_size:
+            raise AssemblyFailedError([AssemblerError(0, "Image too large for EEPROM (max {} bytes of code).".format(_eeprom_size - (dbase - code_size)))])
+
+        data = bytearray(_eeprom_size)
+    else:
+        data = bytearray(vbase)
+
+    with memoryview(data) as view:
+        _header.pack_into(data, 0, 80000000, 0x6F, 0x00, pbase, vbase, dbase, pcurr, dcurr)
+        _pack_words(view[pbase:pcurr], output)
+        view[pcurr:vbase] = _spin_code
+
+        # The checksum covers the stack frame too, whether it is stored here or
+        # sent by the loader.  Same as "checksum = 0x14 - sum(data)".
+        data[0x05] = -(sum(view[:vbase]) + sum(_stack_frame)) & 0xFF
 
         if binary_format == "eeprom":
-            data += bytearray([0xff, 0xff, 0xf9, 0xff] * 2)
-            data += bytearray([0x00] * int(self.eepromSize - len(code)))
+            view[vbase:dbase] = _stack_frame
 
     return data
+
+class Assembler:
+    """An assembly session that reassembles edited source incrementally
+
+        Pass 1 keeps a snapshot of the state before every line, so after an edit it
+        resumes from the first changed line.  Pass 2 keeps every encoded word along
+        with the symbols its operands resolved to, and only re-encodes an entry if
+        its text changed or one of those symbols moved.
+
+        With single_pass, each entry is encoded as soon as pass 1 reads it instead.
+        Entries that refer to labels not defined yet are recorded as fixups and
+        encoded once at the end.
+
+        With hub_schedule, instructions are reordered to space out hub instructions
+        (see schedule.py) and ScheduleReport lists the blocks that changed.
+
+        With literal_pool, immediates too large for the s field are placed in a
+        pool of LONGs, one for each different value, and refer to them instead."""
+
+    def __init__(self, binary_format="binary", hub_offset=0, syntax_version=1, expression_parser=None, single_pass=False,
+                 hub_schedule=False, literal_pool=False):
+        self.BinaryFormat = binary_format
+        self.HubOffset = hub_offset
+        self.SyntaxVersion = syntax_version
+        self.ExpressionParser = expression_parser
+        self.SinglePass = single_pass
+        self.HubSchedule = hub_schedule
+        self.LiteralPool = literal_pool
+        self.ScheduleReport = []
+
+        self._lines = []
+        self._snapshots = []        # (State.Snapshot(), len(pending)) before each line, plus one after the last
+        self._pending = Pending()
+        self._results = []          # single pass: word, AssemblerError or None (fixup) for each pending entry
+        self._encoded = {}          # (cond, opcode, parameters, label scope) -> (word, symbol dependencies)
+        self._entries = []          # the entries, in the order they were output
+        self._words = array(word_typecode)
+
+        self._state = State()
+
+        if binary_format != "raw":
+            self._state.HubAddress = 0x10
+        else:
+            self._state.HubAddress = int(hub_offset)
+
+        if literal_pool:
+            self._state.Literals = {}
+
+        self._snapshots.append((self._state.Snapshot(), 0))
+
+    def Assemble(self, source) -> bytearray:
+        state = self._state
+        lines = list(source)
+
+        _prepare_parser(state, self.ExpressionParser)
+
+        # PASS 1, from the first line that differs from the previous run
+        first = 0
+
+        for (old, new) in zip(self._lines, lines):
+            if old != new:
+                break
+
+            first += 1
+
+        (snapshot, pending_count) = self._snapshots[first]
+        state.Restore(snapshot)
+        self._pending.Truncate(pending_count)
+        del self._results[pending_count:]
+        del self._snapshots[first + 1:]
+
+        for line in lines[first:]:
+            _pass1(line, state, self._pending)
+            self._encode_new()
+            self._snapshots.append((state.Snapshot(), len(self._pending)))
+
+        # the last pool is not part of any line's snapshot, so it is placed again every time
+        if state.Literals:
+            _place_literals(state, self._pending)
+            self._encode_new()
+
+        self._lines = lines
+
+        if self.SinglePass:
+            return self._patch()
+
+        # print("Pass 2...")
+
+        # PASS 2
+        output = array(word_typecode)
+        encoded = {}
+
+        for line in self._pending:
+            key = (line[0], line[1], line[2], line[6])
+            previous = self._encoded.get(key)
+
+            if previous and all(state.GetSymbolKey(name) == value for (name, value) in previous[1]):
+                word = previous[0]
+            else:
+                state.Lookups = []
+
+                try:
+                    word = _encode(line, state)
+                    previous = (word, tuple((name, state.GetSymbolKey(name)) for name in state.Lookups))
+                except AssemblerError as e:
+                    state.AddError(e)
+                    continue
+                finally:
+                    state.Lookups = None
+
+            encoded[key] = previous
+            output.append(word)
+
+        self._encoded = encoded
+
+        if state.Errors:
+            raise AssemblyFailedError(list(state.Errors))
+
+        return self._finish(output)
+
+    def _encode_new(self):
+        # single pass: encodes the entries pass 1 just appended
+        while self.SinglePass and len(self._results) < len(self._pending):
+            self._results.append(self._encode_now(self._pending[len(self._results)]))
+
+    def _encode_now(self, line : tuple):
+        self._state.Deferring = True
+
+        try:
+            return _encode(line, self._state)
+        except ForwardReferenceError:
+            return None
+        except AssemblerError as e:
+            return e
+        finally:
+            self._state.Deferring = False
+
+    def _patch(self) -> bytearray:
+        state = self._state
+        output = array(word_typecode)
+
+        for (line, result) in zip(self._pending, self._results):
+            if result is None:
+                try:
+                    result = _encode(line, state)
+                except AssemblerError as e:
+                    result = e
+
+            if isinstance(result, AssemblerError):
+                state.AddError(result)
+            else:
+                output.append(result)
+
+        if state.Errors:
+            raise AssemblyFailedError(list(state.Errors))
+
+        return self._finish(output)
+
+    def _finish(self, output : array) -> bytearray:
+        # Encoding never depends on where an entry is placed, so the scheduler can
+        # reorder the encoded entries, with the d and s fields it needs resolved.
+        entries = list(self._pending)
+
+        if self.HubSchedule:
+            (entries, output, self.ScheduleReport) = schedule.schedule(entries, output, self._state.Labels)
+
+        self._entries = entries
+        self._words = output
+
+        return _build_image(output, self.BinaryFormat)
+
+    def Listing(self) -> str:
+        '''Returns the listing, with timing, of the last successful Assemble()'''
+
+        literals = None
+
+        if self.LiteralPool:
+            pool = {symbol.HubAddress for (name, symbol) in self._state.Labels.items() if name.startswith(_literal_prefix)}
+            literals = (pool, self._state.LiteralUses)
+
+        return listing.format_listing(self._lines, self._entries, self._words, literals)
+
+    def Analyze(self) -> dict:
+        '''Returns the execution time report (see wcet.py) of the last successful Assemble()'''
+
+        return wcet.analyze(self._lines, self._entries, self._words, self._state.Labels)
+
+def assemble(source, binary_format="binary", hub_offset=0, syntax_version=1, expression_parser=None, single_pass=False, hub_schedule=False,
+             literal_pool=False):
+    return Assembler(binary_format, hub_offset, syntax_version, expression_parser, single_pass, hub_schedule, literal_pool).Assemble(source)
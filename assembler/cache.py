@@ -0,0 +1,144 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Content-addressed cache of pasm output files.  Entries are stored as
+# <folder>/<key[:2]>/<key><extension>, where the key is a hash of everything
+# that affects the output and the extension is the artifact's (".binary",
+# ".binary.hex", ...).  Outputs are hard-linked from the cache when possible.
+
+import os
+import json
+import shutil
+import hashlib
+from . import lang, __version__
+
+__all__ = ["BuildCache"]
+
+def _code_fingerprint() -> str:
+    digest = hashlib.sha256(__version__.encode("utf-8"))
+    folder = os.path.dirname(os.path.abspath(__file__))
+
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".py"):
+            with open(os.path.join(folder, name), "rb") as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()
+
+class BuildCache:
+    """Stores and fetches pasm outputs keyed by their inputs"""
+
+    _fingerprint = None
+
+    def __init__(self, folder : str, max_size : int = 64 << 20):
+        self.Folder = folder
+        self.MaxSize = max_size
+        self.Hits = 0
+        self.Misses = 0
+
+    def Key(self, source : bytes, binary_format : str, hub_offset : int, syntax_version : int, options : tuple = ()) -> str:
+        if BuildCache._fingerprint is None:
+            BuildCache._fingerprint = _code_fingerprint()
+
+        # the tables change with load_isa(), so they are hashed for every key
+        digest = hashlib.sha256((BuildCache._fingerprint + lang.fingerprint()).encode("utf-8"))
+        digest.update(repr((binary_format, hub_offset, syntax_version) + tuple(options)).encode("utf-8"))
+        digest.update(source)
+
+        return digest.hexdigest()
+
+    def _path(self, key : str, extension : str) -> str:
+        return os.path.join(self.Folder, key[:2], key + extension)
+
+    def Fetch(self, key : str, artifacts : list) -> bool:
+        '''Places every (extension, filename) artifact from the cache
+            Returns false, without touching any file, unless all of them are cached'''
+
+        paths = [self._path(key, extension) for (extension, filename) in artifacts]
+
+        if not all(os.path.isfile(path) for path in paths):
+            self.Misses += 1
+            return False
+
+        for (path, (extension, filename)) in zip(paths, artifacts):
+            _place(path, filename)
+            os.utime(path)          # eviction is least-recently-used by mtime
+
+        self.Hits += 1
+        return True
+
+    def Store(self, key : str, artifacts : list):
+        '''Adds freshly written (extension, filename) artifacts to the cache'''
+
+        os.makedirs(os.path.join(self.Folder, key[:2]), exist_ok=True)
+
+        for (extension, filename) in artifacts:
+            _place(filename, self._path(key, extension))
+
+    def Evict(self):
+        '''Removes least-recently-used entries until the cache fits in MaxSize bytes'''
+
+        entries = []
+
+        for (folder, subfolders, files) in os.walk(self.Folder):
+            for name in files:
+                if name == "stats.json":
+                    continue
+
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for (mtime, size, path) in entries)
+
+        for (mtime, size, path) in sorted(entries):
+            if total <= self.MaxSize:
+                break
+
+            os.unlink(path)
+            total -= size
+
+    def UpdateStatistics(self) -> dict:
+        '''Adds this run's hits and misses to the totals kept in the cache, and returns the totals'''
+
+        path = os.path.join(self.Folder, "stats.json")
+
+        try:
+            with open(path) as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {"hits" : 0, "misses" : 0}
+
+        totals["hits"] += self.Hits
+        totals["misses"] += self.Misses
+
+        os.makedirs(self.Folder, exist_ok=True)
+
+        with open(path + ".tmp", "w") as f:
+            json.dump(totals, f)
+
+        os.replace(path + ".tmp", path)
+
+        return totals
+
+def _place(source : str, destination : str):
+    # Outputs and cache entries may share an inode, so files are always replaced,
+    # never rewritten in place.
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+
+    temp = "{}.{}.tmp".format(destination, os.getpid())
+
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copyfile(source, temp)
+
+    os.replace(temp, destination)
@@ -0,0 +1,172 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Disassembly of assembled images (pasm --disassemble), built from the lang
+# tables in use, so images made with an --isa file can be checked against it.
+#
+# Each word is disassembled into source that assembles back to the same word:
+# operands are numbers (or register names), effects are the ones needed to
+# turn the instruction's mask into the word, and a word that no instruction
+# can produce is a LONG.  Instructions with a fixup (CALL) are never used,
+# since the fixup needs a label.  Where several instructions fit, the one that
+# needs the fewest effects wins, then the one with the most fixed bits (CMP
+# over SUB NR, COGID over HUBOP).
+
+import struct
+from . import lang
+
+__all__ = ["Disassembler", "disassemble"]
+
+_mask = 0xFFFFFFFF
+_effects = ((lang.z_flag, "WZ"), (lang.c_flag, "WC"))
+
+class Disassembler:
+    """Decodes words with an index built from lang.instructions and lang.conditions
+
+        The index maps the 6-bit opcode field to the instructions that can produce
+        it, each with the bits a word must share with its mask.  Decoded words are
+        kept, so repeated words (zeros, mostly) cost one dict lookup."""
+
+    def __init__(self):
+        self._index = {}
+        self._decoded = {}
+
+        self._conditions = {}
+
+        for (name, code) in lang.condition_codes.items():
+            self._conditions.setdefault(code, name)
+
+        self._registers = {value : name for (name, value) in lang.registers.items()}
+
+        flags = lang.z_flag | lang.c_flag | lang.r_flag | lang.i_flag
+
+        for (name, rules) in lang.instructions.items():
+            if len(rules) > 6:
+                continue
+
+            (base, d_shift, d_mask, s_shift, s_mask) = lang.encodings[name]
+            fixed = ~(d_mask | s_mask | flags | (lang.condition_mask if rules[5] else 0)) & _mask
+            candidate = (name, rules, base, fixed, d_shift, d_mask, s_shift, s_mask, bin(fixed).count("1"))
+
+            opcode = rules[0][0:6]
+
+            for value in range(64):
+                if all(bit not in "01" or int(bit) == (value >> (5 - i)) & 1 for (i, bit) in enumerate(opcode)):
+                    self._index.setdefault(value, []).append(candidate)
+
+    def _effects(self, word : int, base : int, rules : tuple, s_mask : int) -> list:
+        # the effects that turn base into word, or None if it cannot be done
+        effects = []
+
+        for (flag, (bit, name)) in zip(rules[1:3], _effects):
+            if word & bit != base & bit:
+                if base & bit or not flag:
+                    return None
+
+                effects.append(name)
+
+        if word & lang.r_flag != base & lang.r_flag:
+            if not rules[3]:
+                return None
+
+            effects.append("WR" if word & lang.r_flag else "NR")
+
+        if word & lang.i_flag != base & lang.i_flag:
+            if base & lang.i_flag or not rules[4] or not s_mask:
+                return None
+
+            effects.append("#")
+
+        return effects
+
+    def _operand(self, value : int) -> str:
+        return self._registers.get(value) or "${:03X}".format(value)
+
+    def Decode(self, word : int) -> tuple:
+        '''Returns (condition, opcode, operands) of source that assembles to word
+            condition is "" for IF_ALWAYS (or an instruction without one), and a word no
+            instruction can produce is ("", "LONG", "$XXXXXXXX").'''
+
+        decoded = self._decoded.get(word)
+
+        if decoded is not None:
+            return decoded
+
+        best = None
+
+        for (name, rules, base, fixed, d_shift, d_mask, s_shift, s_mask, weight) in self._index.get(word >> 26, ()):
+            if word & fixed != base & fixed:
+                continue
+
+            effects = self._effects(word, base, rules, s_mask)
+
+            if effects is not None and (best is None or (len(effects), -weight) < best[0]):
+                best = ((len(effects), -weight), name, rules, effects, d_shift, d_mask, s_shift, s_mask)
+
+        if best is None:
+            decoded = ("", "LONG", "${:08X}".format(word))
+        else:
+            (score, name, rules, effects, d_shift, d_mask, s_shift, s_mask) = best
+            code = (word & lang.condition_mask) >> lang.condition_shift
+            operands = []
+
+            if d_mask:
+                operands.append(self._operand((word & d_mask) >> d_shift))
+
+            if s_mask:
+                s = (word & s_mask) >> s_shift
+                operands.append("#${:03X}".format(s) if "#" in effects else self._operand(s))
+
+            text = ", ".join(operands)
+            flags = " ".join(effect for effect in effects if effect != "#")
+
+            if flags:
+                text = (text + " " + flags).strip()
+
+            condition = "" if not rules[5] or code == 0xF else self._conditions.get(code)
+
+            if condition is None:
+                decoded = ("", "LONG", "${:08X}".format(word))
+            else:
+                decoded = (condition, name, text)
+
+        self._decoded[word] = decoded
+
+        return decoded
+
+def _code(data, binary_format : str) -> tuple:
+    # (hub address of the code, code bytes) of an image
+    if binary_format == "raw":
+        return (0, bytes(data))
+
+    (clkfreq, clkmode, checksum, pbase, vbase, dbase, pcurr, dcurr) = struct.unpack_from("<IBBHHHHH", data, 0)
+
+    if not 0x10 <= pbase <= pcurr <= len(data):
+        raise ValueError("The image header does not point at any code.")
+
+    return (pbase, bytes(data[pbase:pcurr]))
+
+def disassemble(data, binary_format : str = "binary") -> str:
+    '''Returns source for the code in an assemble() image
+        Assembled with the same binary_format, the source reproduces the code longs
+        (for "binary" and "eeprom", the rest of the image is always the same).'''
+
+    (hub, code) = _code(data, binary_format)
+    code += bytes(-len(code) % 4)
+
+    disassembler = Disassembler()
+    lines = ["' Disassembled {} image, code at hub ${:04X}".format(binary_format, hub), "", "        ORG     0"]
+
+    for (address, (word,)) in enumerate(struct.iter_unpack("<I", code)):
+        (condition, opcode, operands) = disassembler.Decode(word)
+        text = "        {:<12} {:<8}{}".format(condition, opcode, operands) if condition else "        {:<8}{}".format(opcode, operands)
+        lines.append("{:<48}' ${:03X}  {:08X}".format(text, address, word))
+
+    return "\n".join(lines) + "\n"
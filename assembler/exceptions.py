@@ -2,8 +2,24 @@ class ErrorBase(Exception) : pass
 
 class AddressOutOfRangeError(ErrorBase): pass
 
+class ForwardReferenceError(ErrorBase): pass
+
 class AssemblerError(ErrorBase):
     def __init__(self, line_number : int, message : str):
-        Exception.__init__(self)
+        Exception.__init__(self, line_number, message)
         self.LineNumber = line_number
         self.Message = message
+
+class AssemblyFailedError(ErrorBase):
+    def __init__(self, errors : list):
+        Exception.__init__(self, errors)
+        self.Errors = errors
+
+    def __str__(self):
+        return "{} error(s) encountered".format(len(self.Errors))
+
+class SimulationError(ErrorBase):
+    def __init__(self, address : int, message : str):
+        Exception.__init__(self, address, message)
+        self.Address = address
+        self.Message = message
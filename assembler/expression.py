@@ -8,24 +8,54 @@
 # You should have received a copy of the GNU General Public License along with
 # the software.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import sys
 import math
-from pyparsing import Literal, Word, Combine, Optional, Forward, ZeroOrMore
-from pyparsing import nums, alphanums, alphas, hexnums, quotedString
+import functools
+import importlib.util
 from .state import State
 from .exceptions import AssemblerError
 from . import lang
 
-__all__ = ["ConstantExpression"]
+__all__ = ["ConstantExpression", "parsers", "default_parser"]
+
+# "pyparsing" : the original PyParsing grammar
+# "pratt"     : the built-in tokenizer and precedence-climbing parser (no dependencies)
+parsers = ("pyparsing", "pratt")
+
+def default_parser() -> str:
+    '''Returns the parser used when none is given: PyParsing if it is installed'''
+
+    return "pyparsing" if importlib.util.find_spec("pyparsing") else "pratt"
 
 class ConstantExpression(object):
     """performs expression parsing and evaluation for PASM constant expressions"""
 
-    def __init__(self, state : State ):
+    def __init__(self, state : State, cache_size : int = 1024, parser : str = None):
         self._state = state
         self._stack = []
 
-        self._bnf = self._BNF()
+        parser = parser or default_parser()
+
+        if parser not in parsers:
+            raise ValueError("Unknown expression parser: {}".format(parser))
+
+        self.Parser = parser
+        self._bnf = self._BNF() if parser == "pyparsing" else None
+
+        # Parsing does not depend on the symbol table, so each expression string is
+        # compiled once and the resulting program is re-evaluated on every use.
+        self._compile = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+    def SetState(self, state : State):
+        '''Evaluates against a new symbol table, keeping the grammar and parsed-expression cache'''
+
+        self._state = state
+
+    def CacheInfo(self):
+        '''Returns the (hits, misses, maxsize, currsize) counters of the parsed-expression cache'''
+
+        return self._compile.cache_info()
 
     def _resolve_label(self, label : str) -> int:
         hub_address = (label[0] == "@")
@@ -36,11 +66,11 @@ class ConstantExpression(object):
         value = self._state.GetLabelAddress(label, hub_address)
 
         if value is None:
-            raise AssemblerError(self._state.LineNumber, "Could not resolve label: {}".format(label))
+            raise self._state.Unresolved("Could not resolve label: {}".format(label))
 
         return value
 
-    def _resolve_constant(self, contant : str) -> int:
+    def _resolve_constant(self, constant : str) -> int:
 
         if constant not in lang.constants:
             raise AssemblerError(self._state.LineNumber, "Could not resolve constant: {}".format(constant))
@@ -95,6 +125,16 @@ class ConstantExpression(object):
         self._stack.append(tokens[0])
 
     def _BNF(self):
+        from pyparsing import Literal, Keyword, Word, Combine, Optional, Forward, ZeroOrMore
+        from pyparsing import nums, alphanums, alphas, hexnums, quotedString
+
+        def action(element, function):
+            # set_parse_action is the PyParsing 3 name of setParseAction
+            if hasattr(element, "set_parse_action"):
+                return element.set_parse_action(function)
+
+            return element.setParseAction(function)
+
         base16 = Literal("$")
         hex = Combine(base16 + Word(hexnums + "_"))
 
@@ -108,21 +148,22 @@ class ConstantExpression(object):
         integer = Combine(Optional(plusminus) + Word(nums+"_"))
 
         name_token = Combine(Optional(Literal(":") | Literal("@")) + Word("_" + alphas, "_" + alphanums))
-        name_token.setParseAction(self._mark_name_token)
+        action(name_token, self._mark_name_token)
 
         lparens = Literal("(").suppress()
         rparens = Literal(")").suppress()
 
         # op0 = Literal("@")
-        op1 = (Literal("^^") | Literal("||") | Literal("|<") | Literal(">|") | Literal("!")).setParseAction(self._mark_unary)
+        op1 = action(Literal("^^") | Literal("||") | Literal("|<") | Literal(">|") | Literal("!") |
+                     Literal("+") | Literal("-"), self._mark_unary)
         op2 = Literal("->") | Literal("<-") | Literal(">>") | Literal("<<") | Literal("~>") | Literal("><")
         op3 = Literal("&")
         op4 = Literal("|") | Literal("^")
         op5 = Literal("**") | Literal("*") | Literal("//") | Literal("/")
         op6 = Literal("+") | Literal("-")
         op7 = Literal("#>") | Literal("<#")
-        op8 = Literal("<") | Literal(">") | Literal("<>") | Literal("==") | Literal("=<") | Literal("=>")
-        op9 = Literal("NOT").setParseAction(self._mark_unary)
+        op8 = Literal("<>") | Literal("==") | Literal("=<") | Literal("=>") | Literal("<") | Literal(">")
+        op9 = action(Keyword("NOT"), self._mark_unary)
         op10 = Literal("AND")
         op11 = Literal("OR")
         op12 = Literal(",")
@@ -130,42 +171,199 @@ class ConstantExpression(object):
         expr = Forward()
 
         atom = name_token | hex | quaternary | binary | integer | quotedString
-        atom.setParseAction(self._push)
+        action(atom, self._push)
         atom = atom | (lparens + expr.suppress() + rparens)
  
-        # term0  = atom   + ZeroOrMore((op0 + atom)   .setParseAction(self._push))
-        # term1  = term0  + ZeroOrMore((op1 + term0)  .setParseAction(self._push))
-        term1  = atom   + ZeroOrMore((op1 + atom)   .setParseAction(self._push))
-        term2  = term1  + ZeroOrMore((op2 + term1)  .setParseAction(self._push))
-        term3  = term2  + ZeroOrMore((op3 + term2)  .setParseAction(self._push))
-        term4  = term3  + ZeroOrMore((op4 + term3)  .setParseAction(self._push))
-        term5  = term4  + ZeroOrMore((op5 + term4)  .setParseAction(self._push))
-        term6  = term5  + ZeroOrMore((op6 + term5)  .setParseAction(self._push))
-        term7  = term6  + ZeroOrMore((op7 + term6)  .setParseAction(self._push))
-        term8  = term7  + ZeroOrMore((op8 + term7)  .setParseAction(self._push))
-        term9  = term8  + ZeroOrMore((op9 + term8)  .setParseAction(self._push))
-        term10 = term9  + ZeroOrMore((op10 + term9) .setParseAction(self._push))
-        term11 = term10 + ZeroOrMore((op11 + term10).setParseAction(self._push))
-        expr  << term11 + ZeroOrMore((op12 + term11).setParseAction(self._push))
+        # The unary operators are prefixes: NOT applies to a comparison, the others
+        # to an atom (a sign written against a decimal number is part of it).
+        term1 = Forward()
+        term1 << (atom | action(op1 + term1, self._push))
+        term2  = term1  + ZeroOrMore(action(op2 + term1, self._push))
+        term3  = term2  + ZeroOrMore(action(op3 + term2, self._push))
+        term4  = term3  + ZeroOrMore(action(op4 + term3, self._push))
+        term5  = term4  + ZeroOrMore(action(op5 + term4, self._push))
+        term6  = term5  + ZeroOrMore(action(op6 + term5, self._push))
+        term7  = term6  + ZeroOrMore(action(op7 + term6, self._push))
+        term8  = term7  + ZeroOrMore(action(op8 + term7, self._push))
+        term9 = Forward()
+        term9 << (action(op9 + term9, self._push) | term8)
+        term10 = term9  + ZeroOrMore(action(op10 + term9, self._push))
+        term11 = term10 + ZeroOrMore(action(op11 + term10, self._push))
+        expr  << term11 + ZeroOrMore(action(op12 + term11, self._push))
 
         return expr
 
     def Evaluate(self, expression : str) -> int:
-        self._bnf.parseString(expression)
+        return self._evaluate(list(self._compile(expression)))
+
+    def _parse(self, expression : str) -> tuple:
+        '''Parses an expression into an immutable RPN program of (kind, value) tokens'''
+
+        if self._bnf is None:
+            self._stack = self._pratt(expression)
+        else:
+            from pyparsing import ParseBaseException
+
+            self._stack = []
+
+            try:
+                if hasattr(self._bnf, "parse_string"):
+                    self._bnf.parse_string(expression, parse_all=True)
+                else:
+                    self._bnf.parseString(expression, parseAll=True)
+            except ParseBaseException:
+                raise AssemblerError(self._state.LineNumber, "Could not parse expression: {}".format(expression)) from None
+
+        return tuple(self._decode(token) for token in self._stack)
+
+    _token_re = re.compile(r"""\s*(?:
+        (?P<string>"(?:[^"\n\r\\]|""|\\.)*"|'(?:[^'\n\r\\]|''|\\.)*')|
+        (?P<number>\$[0-9A-Fa-f_]+|%%[0-3_]+|%[01_]+|[0-9][0-9_]*)|
+        (?P<name>[:@]?[_A-Za-z][_A-Za-z0-9]*)|
+        (?P<op>\^\^|\|\||\|<|>\||->|<-|>>|<<|~>|><|\*\*|//|\#>|<\#|<>|==|=<|=>|[-+*/&|^!<>(),]))""", re.VERBOSE)
+
+    # Binding power of each infix operator; higher binds tighter.  The levels
+    # match the PyParsing grammar in _BNF.
+    _infix_power = {
+        ","  : 1,
+        "OR" : 2,
+        "AND" : 3,
+        "<"  : 5, ">"  : 5, "<>" : 5, "==" : 5, "=<" : 5, "=>" : 5,
+        "#>" : 6, "<#" : 6,
+        "+"  : 7, "-"  : 7,
+        "**" : 8, "*"  : 8, "//" : 8, "/"  : 8,
+        "|"  : 9, "^"  : 9,
+        "&"  : 10,
+        "->" : 11, "<-" : 11, ">>" : 11, "<<" : 11, "~>" : 11, "><" : 11,
+        }
 
-        return self._evaluate()
+    _prefix_power = {
+        "NOT" : 4,
+        "+"  : 12, "-"  : 12, "^^" : 12, "||" : 12, "|<" : 12, ">|" : 12, "!"  : 12,
+        }
 
-    def _bitwise_encode(value : int) -> int:
-        if value == 0:
-            return 0
+    def _tokenize(self, expression : str) -> list:
+        tokens = []
+        position = 0
+        expression = expression.rstrip()
+
+        while position < len(expression):
+            match = ConstantExpression._token_re.match(expression, position)
+
+            if not match:
+                raise AssemblerError(self._state.LineNumber, "Could not parse expression: {}".format(expression))
+
+            kind = match.lastgroup
+            text = match.group(kind)
+
+            if kind == "name" and text in ("AND", "OR", "NOT"):
+                kind = "op"
+
+            tokens.append((kind, text, match.start(kind), match.end()))
+            position = match.end()
+
+        return tokens
+
+    def _pratt(self, expression : str) -> list:
+        '''Parses an expression into the same RPN token list the PyParsing grammar produces'''
+
+        tokens = self._tokenize(expression)
+        output = []
+        position = self._pratt_expression(tokens, 0, 0, output)
+
+        if position != len(tokens):
+            raise AssemblerError(self._state.LineNumber, "Unexpected '{}' in expression: {}".format(tokens[position][1], expression))
+
+        return output
+
+    def _pratt_expression(self, tokens : list, position : int, min_power : int, output : list) -> int:
+        position = self._pratt_operand(tokens, position, output)
+
+        while position < len(tokens):
+            (kind, text, start, end) = tokens[position]
+            power = ConstantExpression._infix_power.get(text, 0) if kind == "op" else 0
+
+            if power <= min_power:
+                break
+
+            position = self._pratt_expression(tokens, position + 1, power, output)
+            output.append(text)
 
-        count = 1
+        return position
 
-        while value != 0:
-            value >> 1
-            count += 1
+    def _pratt_operand(self, tokens : list, position : int, output : list) -> int:
+        if position >= len(tokens):
+            raise AssemblerError(self._state.LineNumber, "Expression ended unexpectedly.")
 
-        return count
+        (kind, text, start, end) = tokens[position]
+
+        if kind == "string":
+            output.append(text)
+            return position + 1
+
+        if kind == "number":
+            output.append(text)
+            return position + 1
+
+        if kind == "name":
+            output.append(self._mark_name_token([text])[0])
+            return position + 1
+
+        if text == "(":
+            position = self._pratt_expression(tokens, position + 1, 0, output)
+
+            if position >= len(tokens) or tokens[position][1] != ")":
+                raise AssemblerError(self._state.LineNumber, "Missing ')' in expression.")
+
+            return position + 1
+
+        # a sign written directly against a decimal number is part of the literal
+        if text in "+-" and position + 1 < len(tokens):
+            (next_kind, next_text, next_start, next_end) = tokens[position + 1]
+
+            if next_kind == "number" and next_start == end and next_text[0].isdigit():
+                output.append(text + next_text)
+                return position + 2
+
+        if text in ConstantExpression._prefix_power:
+            position = self._pratt_expression(tokens, position + 1, ConstantExpression._prefix_power[text], output)
+            output.append("u" + text)
+            return position
+
+        raise AssemblerError(self._state.LineNumber, "Unexpected '{}' in expression.".format(text))
+
+    def _decode(self, token : str) -> tuple:
+        if token[0] in "clr":
+            return (token[0], token[1:])
+
+        if token[0] == "$":
+            return ("n", self._hex2int(token))
+
+        if token[:2] == "%%":
+            return ("n", self._quaternary2int(token))
+
+        if token[0] == "%":
+            return ("n", self._binary2int(token))
+
+        if token[0] in "\"'":
+            return ("q", tuple(ord(c) for c in token[1:-1]))
+
+        if token.replace("_","").lstrip("+-")[:1].isdigit():
+            return ("n", int(token.replace("_","")))
+
+        if token[0] == "u":
+            return ("u", ConstantExpression._unary_ops[token[1:]])
+
+        if token == ",":
+            return (",", None)
+
+        if token in ConstantExpression._binary_ops:
+            return ("b", ConstantExpression._binary_ops[token])
+
+        raise NotImplementedError("Token '{}' support is not implemented.".format(token))
+
+    def _bitwise_encode(value : int) -> int:
+        return (value & 0xFFFFFFFF).bit_length()
 
     _unary_ops = {
         "+"  : ( lambda a : a),
@@ -182,7 +380,7 @@ class ConstantExpression(object):
         if count == 0:
             return value
 
-        _v = format(value, "0>32b")
+        _v = format(value & 0xFFFFFFFF, "0>32b")
         _v = _v[count:] + _v[:count]
         return int(_v, 2)
 
@@ -190,7 +388,7 @@ class ConstantExpression(object):
         if count == 0:
             return value
 
-        _v = format(value, "0>32b")
+        _v = format(value & 0xFFFFFFFF, "0>32b")
         _v = _v[-count:] + _v[:-count]
         return int(_v, 2)
 
@@ -198,14 +396,14 @@ class ConstantExpression(object):
         if count == 0:
             return value
 
-        _v = format(value, "0>32b")
+        _v = format(value & 0xFFFFFFFF, "0>32b")
         sign = _v[0]
         _v = (sign * count) + _v[:-count]
         return int(_v, 2)
 
     def _bitwise_reverse_bits(value : int, count : int) -> int:
-        _v = format(value, "0>32b")
-        _v = ("0" * (32 - count)) + reversed(_v)[:count]
+        _v = format(value & 0xFFFFFFFF, "0>32b")
+        _v = ("0" * (32 - count)) + _v[::-1][:count]
         return int(_v, 2)
 
     _binary_ops = {
@@ -231,65 +429,43 @@ class ConstantExpression(object):
         "<>" : ( lambda a, b: -1 if a!=b else 0),
         "==" : ( lambda a, b: -1 if a==b else 0),
         "=<" : ( lambda a, b: -1 if a<=b else 0),
-        ">=" : ( lambda a, b: -1 if a>=b else 0),
+        "=>" : ( lambda a, b: -1 if a>=b else 0),
         "AND" : ( lambda a, b: -1 if bool(a) and bool(b) else 0),
         "OR"  : ( lambda a, b: -1 if bool(a) or bool(b) else 0),
         }
 
-    def _evaluate(self):
-        op = self._stack.pop()
+    def _evaluate(self, program : list):
+        (kind, value) = program.pop()
         
-        # print("Popped => {}".format(op))
-
-        if op[0] == "c":
-            return self._resolve_constant(op[1:])
+        # print("Popped => {}".format(value))
 
-        if op[0] == "l":
-            return self._resolve_label(op[1:])
-
-        if op[0] == "r":
-            return self._resolve_register(op[1:])
-
-        # if op[0] == "@":
-        #     op1 = self._stack.pop()
-        # 
-        #     if op1[0] != "r":
-        #         raise AssemblerError(self._state.LineNumber, "Symbol Address operator is not followed by a label.")
-        # 
-        #     return self._resolve_label(op1[1:], True)
+        if kind == "n":
+            return value
 
-        if op[0] == "$":
-            return self._hex2int(op)
+        if kind == "l":
+            return self._resolve_label(value)
 
-        if op[:2] == "%%":
-            return self._quaternary2int(op)
+        if kind == "r":
+            return self._resolve_register(value)
 
-        if op[0] == "%":
-            return self._binary2int(op)
+        if kind == "c":
+            return self._resolve_constant(value)
 
-        if op[0] in "\"'":
-            return [ord(c) for c in op[1:-1]]
+        if kind == "q":
+            return list(value)
 
-        if op.replace("_","")[0].isdigit():
-            return int(op.replace("_",""))
+        if kind == "u":
+            op1 = self._evaluate(program)
+            return int(value(op1))
 
-        if op[0] == "u":
-            op1 = self._evaluate()
-            value = int(ConstantExpression._unary_ops[op[1:]](op1))
-            return value
+        op2 = self._evaluate(program)
+        op1 = self._evaluate(program)
 
-        op2 = self._evaluate()
-        op1 = self._evaluate()
-
-        if op == ",":
+        if kind == ",":
             if isinstance(op1, list):
                 op1.append(op2)
                 return op1
 
             return [op1, op2]
 
-        if op in ConstantExpression._binary_ops:
-            value = int(ConstantExpression._binary_ops[op](op1, op2))
-            return value
-
-        raise NotImplementedError("Token '{}' support is not implemented.".format(op))
\ No newline at end of file
+        return int(value(op1, op2))
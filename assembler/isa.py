@@ -0,0 +1,289 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# ISA definition files (pasm --isa) replace the built-in lang tables.  Comments
+# start with ' and each section replaces the matching built-in table; sections
+# that are left out keep the built-in one.
+#
+#   [conditions]
+#   IF_ALWAYS   1111
+#
+#   [constants]
+#   TRUE        -1
+#
+#   [registers]
+#   PAR         $1F0
+#
+#   [instructions]
+#   ' opcode    mask (see lang.instructions)                allowed             fixup
+#   ADD         100000 001i 1111 ddddddddd sssssssss        WZ,WC,WR,#,IF
+#   CALL        010111 0011 1111 ????????? sssssssss        WZ,WR,#,IF          call
+#   NOP         ------ ---- 0000 --------- ---------        -
+#
+#   [cycles]
+#   ' opcode    best    worst   (see lang.cycles)
+#   RDLONG      8       23      hub
+#   DJNZ        4       8
+#   WAITCNT     6       +
+#
+# "allowed" lists what the instruction accepts: WZ, WC, WR (and NR), # and an
+# IF_ condition.  "fixup" names an entry of lang.fixups.  A worst case of "+"
+# means the instruction can wait indefinitely, and "hub" marks the difference
+# between best and worst as a hub window stall.
+#
+# A compiled copy of the tables is kept in <file>.cache, keyed by a hash of the
+# file's contents, so a file is only parsed again after it changes.
+
+import os
+import json
+import hashlib
+from . import lang
+
+__all__ = ["compile_isa", "format_isa", "load"]
+
+_cache_version = 2
+
+_sections = ("conditions", "constants", "registers", "instructions", "cycles")
+_allowed = ("WZ", "WC", "WR", "#", "IF")
+
+_builtin = lang.tables()
+_loaded = None                  # content hash of the ISA file in use, None for the built-in tables
+
+def _number(text : str) -> int:
+    if text.startswith("$"):
+        return int(text[1:].replace("_", ""), 16)
+
+    if text.startswith("%"):
+        return int(text[1:].replace("_", ""), 2)
+
+    return int(text.replace("_", ""), 10)
+
+def _instruction(words : list) -> tuple:
+    mask = ""
+    index = 1
+
+    while len(mask) < 32 and index < len(words):
+        mask += words[index].lower()
+        index += 1
+
+    if len(mask) != 32:
+        raise ValueError("the mask for {} does not contain 32 characters".format(words[0]))
+
+    if index == len(words):
+        raise ValueError("missing the allowed list for {}".format(words[0]))
+
+    allowed = [] if words[index] == "-" else words[index].upper().split(",")
+
+    for item in allowed:
+        if item not in _allowed:
+            raise ValueError("unknown item '{}' in the allowed list for {}".format(item, words[0]))
+
+    rules = (mask,) + tuple(item in allowed for item in _allowed)
+    fixups = words[index + 1:]
+
+    if len(fixups) > 1:
+        raise ValueError("unexpected text after the fixup for {}".format(words[0]))
+
+    if fixups:
+        if fixups[0].lower() not in lang.fixups:
+            raise ValueError("unknown fixup '{}' for {}".format(fixups[0], words[0]))
+
+        rules += (fixups[0].lower(),)
+
+    return rules
+
+def _cycles(words : list) -> tuple:
+    if len(words) not in (3, 4) or (len(words) == 4 and words[3].upper() != "HUB"):
+        raise ValueError("expected an opcode, best and worst cycles, and optionally hub")
+
+    return (int(words[1]), None if words[2] == "+" else int(words[2]), len(words) == 4)
+
+def compile_isa(text : str, filename : str = "<isa>") -> dict:
+    '''Compiles an ISA definition into lang.install() tables
+        Fixups are left as names.  Raises ValueError on a malformed definition.'''
+
+    tables = {}
+    section = None
+
+    for (number, line) in enumerate(text.splitlines(), 1):
+        words = line.split("'")[0].split()
+
+        if not words:
+            continue
+
+        words[0] = words[0].upper()
+
+        try:
+            if words[0].startswith("["):
+                section = words[0].strip("[]").lower()
+
+                if section not in _sections or len(words) > 1:
+                    raise ValueError("unknown section {}".format(" ".join(words)))
+
+                tables[section] = {}
+
+            elif section is None:
+                raise ValueError("definitions must follow a [section]")
+
+            elif words[0] in tables[section]:
+                raise ValueError("{} is defined twice".format(words[0]))
+
+            elif section == "instructions":
+                tables[section][words[0]] = _instruction(words)
+
+            elif section == "cycles":
+                tables[section][words[0]] = _cycles(words)
+
+            elif len(words) != 2:
+                raise ValueError("expected a name and a value")
+
+            elif section == "conditions":
+                if len(words[1]) != 4 or words[1].strip("01"):
+                    raise ValueError("condition {} must be 4 binary digits".format(words[0]))
+
+                tables[section][words[0]] = words[1]
+
+            else:
+                tables[section][words[0]] = _number(words[1])
+
+        except ValueError as e:
+            raise ValueError("{}:{}: {}".format(filename, number, e)) from None
+
+    for section in _sections:
+        if section not in tables:
+            tables[section] = {key : _unlink(value) for key, value in _builtin[section].items()}
+
+    tables["condition_codes"] = {key : int(value, 2) for key, value in tables["conditions"].items()}
+    tables["encodings"] = {key : lang._compile_pattern(value[0]) for key, value in tables["instructions"].items()}
+
+    return tables
+
+def _unlink(rules):
+    # built-in instruction rules hold their fixup function; compiled tables hold its name
+    if isinstance(rules, tuple) and len(rules) > 6:
+        return rules[:6] + (next(name for name, func in lang.fixups.items() if func is rules[6]),)
+
+    return rules
+
+def _link(tables : dict) -> dict:
+    tables = dict(tables)
+    tables["instructions"] = {key : tuple(rules[:6]) + tuple(lang.fixups[name] for name in rules[6:])
+                              for key, rules in tables["instructions"].items()}
+    tables["encodings"] = {key : tuple(value) for key, value in tables["encodings"].items()}
+    tables["cycles"] = {key : tuple(value) for key, value in tables["cycles"].items()}
+
+    return tables
+
+def _check(tables : dict) -> dict:
+    # Returns linked tables read from a cache file if they have the shape compile_isa()
+    # gives them, so that lang.install() cannot fail halfway; raises ValueError otherwise.
+    for (name, kind) in (("conditions", str), ("condition_codes", int), ("constants", int), ("registers", int)):
+        if not all(isinstance(key, str) and isinstance(value, kind) for (key, value) in tables[name].items()):
+            raise ValueError(name)
+
+    for (key, rules) in tables["instructions"].items():
+        if len(rules) < 6 or not isinstance(rules[0], str) or len(rules[0]) != 32:
+            raise ValueError(key)
+
+        if len(tables["encodings"][key]) != 5 or not all(isinstance(value, int) for value in tables["encodings"][key]):
+            raise ValueError(key)
+
+    if not all(len(value) == 3 for value in tables["cycles"].values()):
+        raise ValueError("cycles")
+
+    return tables
+
+def format_isa(tables : dict = None) -> str:
+    '''Returns tables (by default, the built-in ones) as the text of an ISA definition file'''
+
+    tables = tables or _builtin
+    lines = ["' Orochi ISA definition.  See assembler/isa.py for the format.", "", "[conditions]"]
+    lines += ["{:<16}{}".format(key, value) for key, value in tables["conditions"].items()]
+    lines += ["", "[constants]"]
+    lines += ["{:<16}{}".format(key, value) for key, value in tables["constants"].items()]
+    lines += ["", "[registers]"]
+    lines += ["{:<16}${:03X}".format(key, value) for key, value in tables["registers"].items()]
+    lines += ["", "[instructions]"]
+
+    for (key, rules) in tables["instructions"].items():
+        rules = _unlink(rules)
+        mask = " ".join((rules[0][0:6], rules[0][6:10], rules[0][10:14], rules[0][14:23], rules[0][23:32]))
+        allowed = ",".join(item for (item, flag) in zip(_allowed, rules[1:6]) if flag) or "-"
+        lines.append("{:<12}{}    {:<20}{}".format(key, mask, allowed, " ".join(rules[6:])).rstrip())
+
+    lines += ["", "[cycles]"]
+
+    for (key, (best, worst, hub)) in tables["cycles"].items():
+        lines.append("{:<12}{:<8}{:<8}{}".format(key, best, "+" if worst is None else worst, "hub" if hub else "").rstrip())
+
+    return "\n".join(lines) + "\n"
+
+def _read_cache(path : str, digest : str):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get("version") != _cache_version or cached.get("hash") != digest:
+        return None
+
+    return cached["tables"]
+
+def _write_cache(path : str, digest : str, tables : dict):
+    # The cache is only an optimization; an unwritable folder just means compiling every time.
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump({"version" : _cache_version, "hash" : digest, "tables" : tables}, f)
+
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def load(path : str = None) -> bool:
+    '''Installs the ISA defined in the file at path, or the built-in one if path is None
+        Returns whether the tables changed.  Raises OSError or ValueError if the file cannot be used.'''
+
+    global _loaded
+
+    if path is None:
+        if _loaded is None:
+            return False
+
+        lang.install(_builtin)
+        _loaded = None
+        return True
+
+    with open(path, "rb") as f:
+        source = f.read()
+
+    digest = hashlib.sha256(source).hexdigest()
+
+    if digest == _loaded:
+        return False
+
+    tables = _read_cache(path + ".cache", digest)
+    linked = None
+
+    if tables is not None:
+        try:
+            linked = _check(_link(tables))
+        except (KeyError, TypeError, ValueError, AttributeError, IndexError):
+            linked = None           # a damaged cache is rebuilt
+
+    if linked is None:
+        tables = compile_isa(source.decode("utf-8"), path)
+        _write_cache(path + ".cache", digest, tables)
+        linked = _link(tables)
+
+    lang.install(linked)
+    _loaded = digest
+
+    return True
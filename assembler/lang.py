@@ -8,6 +8,8 @@
 # You should have received a copy of the GNU General Public License along with
 # the software.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import hashlib
 from .state import State
 from .exceptions import AssemblerError
 
@@ -15,12 +17,21 @@ __all__ = ["directives",
            "effects",
            "datatypes",
            "conditions",
+           "condition_codes",
            "constants",
            "registers",
            "instructions",
-           "reserved_words"]
+           "encodings",
+           "cycles",
+           "default_cycles",
+           "reserved_words",
+           "keywords",
+           "fixups",
+           "tables",
+           "install",
+           "fingerprint"]
 
-directives = ("ORG", "FIT", "RES")
+directives = ("ORG", "FIT", "RES", "LITPOOL")
 effects = ("WC", "WZ", "WR", "NR")
 datatypes = ("BYTE", "WORD", "LONG")
 
@@ -83,26 +94,21 @@ registers["PHSB"]               = 0x1FD
 registers["VCFG"]               = 0x1FE
 registers["VSCL"]               = 0x1FF
 
-def _fix_call(bits : str, parameters : str, state : State) -> str:
+def _fix_call(word : int, parameters : str, state : State) -> int:
     if parameters[0] != "#":
-        raise AssemblerError(state.LineNumber, "Cannot fix CALL. Parameters is: {}".format(parameter))
+        raise AssemblerError(state.LineNumber, "Cannot fix CALL. Parameters is: {}".format(parameters))
 
-    label = parameters[1:]
+    symbol = state.GetSymbol(parameters[1:])
 
-    if label[0] == ":":
-        label = state.CurrentLabel + label
+    if symbol is None:
+        raise state.Unresolved("Cannot fix CALL. Label not found.")
 
-    match = [l for l in state.Labels if l[0] == label]
+    if symbol.Return is None:
+        raise state.Unresolved("Cannot fix CALL. No matching '_ret' label.")
 
-    if not match:
-        raise AssemblerError(state.LineNumber, "Cannot fix CALL. Label not found.")
+    d = symbol.Return.CogAddress
 
-    if len(match[0]) < 4:
-        raise AssemblerError(state.LineNumber, "Cannot fix CALL. No matching '_ret' label.")
-
-    d = state.Labels[match[0][3]][2]
-
-    return (bits[:14] + format(d, "0>9b") + bits[23:])
+    return (word & ~0x0003FE00) | ((d << 9) & 0x0003FE00)
 
 # Instruction map:
 # Key : opcode
@@ -117,7 +123,7 @@ def _fix_call(bits : str, parameters : str, state : State) -> str:
 #    Can override R
 #    Can override I
 #    Can override condition
-#    (optional) func that does some extra processing to bits
+#    (optional) func that does some extra processing to the encoded word
 
 instructions = {}
 instructions["ABS"]     = ("101010 001i 1111 ddddddddd sssssssss", True,    True,   True,   True,   True)
@@ -206,11 +212,141 @@ for key, value in instructions.items():
     if len(instructions[key][0]) != 32:
         raise ValueError("The mask for {} does not contain 32 characters.".format(key))
 
+# Fixed fields of an instruction word.  Bit 31 is the first character of a mask.
+z_flag = 1 << 25
+c_flag = 1 << 24
+r_flag = 1 << 23
+i_flag = 1 << 22
+condition_shift = 18
+condition_mask = 0xF << condition_shift
+
+def _compile_field(pattern : str, field : str) -> tuple:
+    if field not in pattern:
+        return (0, 0)
+
+    shift = 31 - pattern.rindex(field)
+    width = pattern.rindex(field) - pattern.index(field) + 1
+
+    return (shift, ((1 << width) - 1) << shift)
+
+def _compile_pattern(pattern : str) -> tuple:
+    '''Compiles a 32-character mask into (base, d_shift, d_mask, s_shift, s_mask)
+        The base word has every "1" of the mask set and everything else cleared.'''
+
+    base = int(re.sub("[^1]", "0", pattern), 2)
+
+    return (base,) + _compile_field(pattern, "d") + _compile_field(pattern, "s")
+
+# Encoding map:
+# Key : opcode
+# Value : tuple (base, d_shift, d_mask, s_shift, s_mask)
+#    d_mask/s_mask are 0 if the instruction does not have that field.
+
+encodings = {key : _compile_pattern(value[0]) for key, value in instructions.items()}
+
+condition_codes = {key : int(value, 2) for key, value in conditions.items()}
+
+# Timing map:
+# Key : opcode
+# Value : tuple (best, worst, hub)
+#    Clock cycles taken when the condition is met.  worst is None if the instruction
+#    can wait indefinitely.  hub is True if the difference between best and worst is
+#    the wait for the cog's hub access window.
+#    Instructions not listed here take 4 cycles, as does any instruction whose condition is not met.
+
+cycles = {}
+cycles["CLKSET"]    = (8,   23,     True)
+cycles["COGID"]     = (8,   23,     True)
+cycles["COGINIT"]   = (8,   23,     True)
+cycles["COGSTOP"]   = (8,   23,     True)
+cycles["DJNZ"]      = (4,   8,      False)      # 4 if it jumps, 8 if not
+cycles["HUBOP"]     = (8,   23,     True)
+cycles["LOCKCLR"]   = (8,   23,     True)
+cycles["LOCKNEW"]   = (8,   23,     True)
+cycles["LOCKRET"]   = (8,   23,     True)
+cycles["LOCKSET"]   = (8,   23,     True)
+cycles["RDBYTE"]    = (8,   23,     True)
+cycles["RDLONG"]    = (8,   23,     True)
+cycles["RDWORD"]    = (8,   23,     True)
+cycles["TJNZ"]      = (4,   8,      False)      # 4 if it jumps, 8 if not
+cycles["TJZ"]       = (4,   8,      False)      # 4 if it jumps, 8 if not
+cycles["WAITCNT"]   = (6,   None,   False)
+cycles["WAITPEQ"]   = (6,   None,   False)
+cycles["WAITPNE"]   = (6,   None,   False)
+cycles["WAITVID"]   = (4,   None,   False)
+cycles["WRBYTE"]    = (8,   23,     True)
+cycles["WRLONG"]    = (8,   23,     True)
+cycles["WRWORD"]    = (8,   23,     True)
+
+default_cycles = (4, 4, False)
+
+reserved_words = ()
+
+# Value : tuple (kind, record)
+#    kind is "directive", "effect", "datatype", "condition", "instruction", "constant" or "register".
+#    record is the keyword's entry in condition_codes, encodings, constants or registers (None otherwise).
+
+keywords = {}
+
+def _index():
+    global reserved_words
+
+    reserved_words = directives                     \
+                     + effects                      \
+                     + datatypes                    \
+                     + tuple(instructions.keys())   \
+                     + tuple(conditions.keys())     \
+                     + tuple(constants.keys())      \
+                     + tuple(registers.keys())
+
+    keywords.clear()
+    keywords.update((key, ("directive", None)) for key in directives)
+    keywords.update((key, ("effect", None)) for key in effects)
+    keywords.update((key, ("datatype", None)) for key in datatypes)
+    keywords.update((key, ("condition", value)) for key, value in condition_codes.items())
+    keywords.update((key, ("instruction", value)) for key, value in encodings.items())
+    keywords.update((key, ("constant", value)) for key, value in constants.items())
+    keywords.update((key, ("register", value)) for key, value in registers.items())
+
+_index()
+
+# Instruction post-processing functions, by the name an ISA file refers to them with.
+fixups = {"call" : _fix_call}
+
+def _isa_tables() -> tuple:
+    return (("conditions", conditions),
+            ("condition_codes", condition_codes),
+            ("constants", constants),
+            ("registers", registers),
+            ("instructions", instructions),
+            ("encodings", encodings),
+            ("cycles", cycles))
+
+def tables() -> dict:
+    '''Returns a copy of the ISA tables, in the form install() takes'''
+
+    return {name : dict(table) for (name, table) in _isa_tables()}
+
+def install(new_tables : dict):
+    '''Replaces the ISA tables (conditions, condition_codes, constants, registers, instructions,
+        encodings and cycles) in place, and rebuilds reserved_words and keywords from them'''
+
+    for (name, table) in _isa_tables():
+        table.clear()
+        table.update(new_tables[name])
+
+    _index()
+
+def fingerprint() -> str:
+    '''Returns a hash of the current tables, used to key cached output'''
+
+    tables = (directives,
+              effects,
+              datatypes,
+              sorted(conditions.items()),
+              sorted(constants.items()),
+              sorted(registers.items()),
+              sorted(cycles.items()),
+              sorted((key, tuple(getattr(v, "__name__", v) for v in value)) for key, value in instructions.items()))
 
-reserved_words = directives                     \
-                 + effects                      \
-                 + datatypes                    \
-                 + tuple(instructions.keys())   \
-                 + tuple(conditions.keys())     \
-                 + tuple(constants.keys())      \
-                 + tuple(registers.keys())
+    return hashlib.sha256(repr(tables).encode("utf-8")).hexdigest()
@@ -0,0 +1,113 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Assembly listings (pasm --listing) with static timing from lang.cycles.
+#
+# Every source line is listed.  Lines that produced a long also show its cog
+# and hub address, the encoded word, the clock cycles the instruction takes,
+# the possible stall waiting for the hub window, and a running total for the
+# block since the last (non-local) label.  Totals are for straight-line code:
+# they add up every instruction once, whatever the branches do.  In literal
+# pool mode, the pool longs are listed too, and counted in a summary.
+
+from . import lang
+
+__all__ = ["timing", "format_listing"]
+
+def timing(cond : str, opcode : str) -> tuple:
+    '''Returns (best, worst, hub stall) cycles for an instruction, or None for data
+        worst is None if the instruction can wait indefinitely.  The hub stall is
+        (best, worst) for instructions that wait for the hub window, None otherwise.'''
+
+    if opcode in lang.datatypes:
+        return None
+
+    (best, worst, hub) = lang.cycles.get(opcode, lang.default_cycles)
+    stall = (0, worst - best) if hub else None
+
+    code = lang.condition_codes.get(cond, 0xF)
+
+    if code == 0x0:
+        return (4, 4, None)         # never executed
+
+    if code != 0xF:
+        # a condition that is not met still takes 4 cycles
+        best = min(best, 4)
+        worst = None if worst is None else max(worst, 4)
+
+    return (best, worst, stall)
+
+def _range(best : int, worst : int) -> str:
+    if worst is None:
+        return "{}+".format(best)
+
+    if best == worst:
+        return str(best)
+
+    return "{}..{}".format(best, worst)
+
+def format_listing(lines : list, pending, words, literals : tuple = None) -> str:
+    '''Returns the listing for source lines, given the pending entries and the words encoded from them
+        literals is (hub addresses of the literal pool longs, number of literals used) in literal pool mode.'''
+
+    entries = {}
+
+    for (entry, word) in zip(pending, words):
+        entries.setdefault(entry[3], []).append((entry, word))
+
+    pool = literals[0] if literals else ()
+
+    rows = ["LINE  COG  HUB   WORD      CYCLES  HUB WAIT  BLOCK     SOURCE"]
+    blocks = []                     # [label, instructions, best, worst]
+
+    for (number, text) in enumerate(lines, 1):
+        text = text.rstrip("\r\n").expandtabs()
+        found = entries.get(number, [])
+
+        # literal pool longs are placed on the line of the directive (or the last line) that placed them
+        if all(entry[5] in pool for (entry, word) in found):
+            found.append((None, None))
+
+        for (entry, word) in found:
+            if entry is None:
+                rows.append("{:>4}  {:<49}{}".format(number, "", text).rstrip())
+                continue
+
+            ((cond, opcode, parameters, line_number, cog, hub, scope), word) = (entry, word)
+            cost = timing(cond, opcode)
+
+            if cost is None:
+                source = "' literal {}".format(parameters) if hub in pool else text
+                rows.append("{:>4}  {:03X}  {:04X}  {:08X}  {:<28}{}".format(number, cog, hub, word, "", source).rstrip())
+                continue
+
+            (best, worst, stall) = cost
+
+            if not blocks or blocks[-1][0] != scope:
+                blocks.append([scope, 0, 0, 0])
+
+            block = blocks[-1]
+            block[1] += 1
+            block[2] += best
+            block[3] = None if worst is None or block[3] is None else block[3] + worst
+
+            rows.append("{:>4}  {:03X}  {:04X}  {:08X}  {:<8}{:<10}{:<10}{}".format(
+                        number, cog, hub, word, _range(best, worst),
+                        "" if stall is None else _range(*stall),
+                        _range(block[2], block[3]), text).rstrip())
+
+    rows += ["", "BLOCK                     INSTRUCTIONS  CYCLES"]
+    rows += ["{:<26}{:<14}{}".format(label or "(start)", count, _range(best, worst)) for (label, count, best, worst) in blocks]
+
+    if literals:
+        rows += ["", "Literal pool: {} literals in {} longs, {} longs saved by de-duplication.".format(
+                 literals[1], len(pool), literals[1] - len(pool))]
+
+    return "\n".join(rows) + "\n"
@@ -0,0 +1,81 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+
+__all__ = ["Pending", "word_typecode"]
+
+# array typecode for unsigned 32-bit words
+word_typecode = "I" if array("I").itemsize == 4 else "L"
+
+class Pending:
+    """The instructions and data found by pass 1, waiting to be encoded
+
+        Entries are stored as parallel arrays.  Strings (condition, opcode,
+        parameters and label scope) are interned and stored as indexes.  An entry
+        reads back as the tuple:
+
+            (cond, opcode, parameters, line number, cog address, hub address, label scope)"""
+
+    def __init__(self):
+        self.LineNumbers = array("i")
+        self.CogAddresses = array("i")
+        self.HubAddresses = array("i")
+        self.Conditions = array(word_typecode)
+        self.Opcodes = array(word_typecode)
+        self.Parameters = array(word_typecode)
+        self.Scopes = array(word_typecode)
+
+        self._strings = []
+        self._ids = {}
+
+    def _intern(self, text : str) -> int:
+        index = self._ids.get(text)
+
+        if index is None:
+            index = self._ids[text] = len(self._strings)
+            self._strings.append(text)
+
+        return index
+
+    def Append(self, cond : str, opcode : str, parameters : str, line_number : int, cog_address : int, hub_address : int, scope : str):
+        self.Conditions.append(self._intern(cond))
+        self.Opcodes.append(self._intern(opcode))
+        self.Parameters.append(self._intern(parameters))
+        self.LineNumbers.append(line_number)
+        self.CogAddresses.append(cog_address)
+        self.HubAddresses.append(hub_address)
+        self.Scopes.append(self._intern(scope))
+
+    def Truncate(self, count : int):
+        '''Removes every entry from index count on'''
+
+        for column in (self.LineNumbers, self.CogAddresses, self.HubAddresses, self.Conditions, self.Opcodes, self.Parameters, self.Scopes):
+            del column[count:]
+
+    def __len__(self):
+        return len(self.LineNumbers)
+
+    def __getitem__(self, index : int) -> tuple:
+        strings = self._strings
+
+        return (strings[self.Conditions[index]],
+                strings[self.Opcodes[index]],
+                strings[self.Parameters[index]],
+                self.LineNumbers[index],
+                self.CogAddresses[index],
+                self.HubAddresses[index],
+                strings[self.Scopes[index]])
+
+    def __iter__(self):
+        strings = self._strings
+
+        for entry in zip(self.Conditions, self.Opcodes, self.Parameters, self.LineNumbers, self.CogAddresses, self.HubAddresses, self.Scopes):
+            yield (strings[entry[0]], strings[entry[1]], strings[entry[2]], entry[3], entry[4], entry[5], strings[entry[6]])
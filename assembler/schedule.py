@@ -0,0 +1,210 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Hub window scheduling (pasm --schedule).
+#
+# A cog gets the hub every 16 clocks.  A hub instruction that finds its window
+# takes 8; after it, two 4-clock instructions bring the next hub instruction
+# exactly onto the following window.  Any other spacing stalls the next one
+# by up to 15 clocks.  This pass reorders independent instructions between hub
+# instructions to get that spacing.
+#
+# Instructions are only moved within a block: a run of consecutive
+# instructions in which only the first may have a label.  Branches, WAITs,
+# instructions that write special registers or code, or that read CNT, INA,
+# INB, PHSA or PHSB, end a block and are never moved.  Within a block,
+# instructions keep their order if they share a register (from the d and s
+# fields), a flag (from the condition and WZ/WC effects), or are both hub
+# instructions.
+
+from array import array
+from bisect import bisect_left
+from . import lang
+
+__all__ = ["schedule"]
+
+_branches = ("JMP", "JMPRET", "CALL", "RET", "DJNZ", "TJZ", "TJNZ")
+_volatile = frozenset((0x1F1, 0x1F2, 0x1F3, 0x1FC, 0x1FD))      # CNT, INA, INB, PHSA, PHSB
+_special = frozenset(range(0x1F0, 0x200))
+
+# instructions that use the C or Z flag as an operand
+_flag_readers = ("ADDSX", "ADDX", "CMPSX", "CMPX", "SUBSX", "SUBX", "RCL", "RCR",
+                 "MUXC", "MUXNC", "MUXZ", "MUXNZ", "NEGC", "NEGNC", "NEGZ", "NEGNZ",
+                 "SUMC", "SUMNC", "SUMZ", "SUMNZ")
+
+def _stalls(hubs : list) -> int:
+    '''Returns the clocks lost waiting for the hub window, for a sequence where hubs[i] is
+        true for a hub instruction, assuming the first hub instruction finds its window'''
+
+    stalls = 0
+    gap = None
+
+    for hub in hubs:
+        if not hub:
+            gap = None if gap is None else gap + 1
+            continue
+
+        if gap is not None:
+            stalls += -(8 + 4 * gap) % 16
+
+        gap = 0
+
+    return stalls
+
+def _operands(entry : tuple, word : int) -> tuple:
+    # (reads, writes) of an instruction, as register addresses plus "Z" and "C"
+    (base, d_shift, d_mask, s_shift, s_mask) = lang.encodings[entry[1]]
+    reads = set()
+    writes = set()
+
+    if d_mask:
+        d = (word & d_mask) >> d_shift
+        reads.add(d)
+
+        if word & lang.r_flag:
+            writes.add(d)
+
+    if s_mask and not word & lang.i_flag:
+        reads.add((word & s_mask) >> s_shift)
+
+    if lang.condition_codes.get(entry[0], 0xF) not in (0x0, 0xF) or entry[1] in _flag_readers:
+        reads.update(("Z", "C"))
+
+    if word & lang.z_flag:
+        writes.add("Z")
+
+    if word & lang.c_flag:
+        writes.add("C")
+
+    return (reads, writes)
+
+def _order(region : list, pinned : bool, operands : list, hubs : list) -> list:
+    count = len(region)
+    predecessors = [set() for i in range(count)]
+
+    for j in range(count):
+        (reads, writes) = operands[j]
+
+        for i in range(j):
+            (earlier_reads, earlier_writes) = operands[i]
+
+            if (hubs[i] and hubs[j]) or earlier_writes & (reads | writes) or earlier_reads & writes:
+                predecessors[j].add(i)
+
+    if pinned:
+        for j in range(1, count):
+            predecessors[j].add(0)
+
+    ancestors = []
+
+    for j in range(count):
+        ancestors.append(set(predecessors[j]).union(*(ancestors[i] for i in predecessors[j])))
+
+    order = []
+    done = set()
+    gap = None
+
+    while len(order) < count:
+        ready = [p for p in range(count) if p not in done and predecessors[p] <= done]
+        fillers = [p for p in ready if not hubs[p]]
+        following = next((p for p in range(count) if p not in done and hubs[p]), None)
+
+        if following is None:
+            choice = ready[0]
+        elif following in ready and (gap is None or gap % 4 == 2 or not fillers):
+            choice = following
+        elif following not in ready:
+            choice = next(p for p in fillers if p in ancestors[following])
+        else:
+            choice = fillers[0]
+
+        order.append(choice)
+        done.add(choice)
+
+        if hubs[choice]:
+            gap = 0
+        elif gap is not None:
+            gap += 1
+
+    return order
+
+def schedule(entries : list, words, labels : dict) -> tuple:
+    '''Reorders instructions so that hub instructions land on their hub window
+
+        entries and words are the pending entries of a program and the words they
+        encode to.  Returns (entries, words, report), where report has a dict
+        (label, line, cog, before, after) of the stall clocks in every block
+        that changed.'''
+
+    entries = list(entries)
+    words = array(words.typecode, words)
+    report = []
+
+    line_numbers = [entry[3] for entry in entries]
+    labelled = set()
+
+    for symbol in labels.values():
+        index = bisect_left(line_numbers, symbol.LineNumber)
+
+        if index < len(entries) and entries[index][4] == symbol.CogAddress:
+            labelled.add(index)
+
+    code = {entry[4] for entry in entries if entry[1] not in lang.datatypes} | _special
+
+    def fixed(index : int) -> bool:
+        opcode = entries[index][1]
+
+        if opcode in lang.datatypes or opcode in _branches or lang.cycles.get(opcode, lang.default_cycles)[1] is None:
+            return True
+
+        (reads, writes) = _operands(entries[index], words[index])
+
+        return bool(writes & code or reads & _volatile)
+
+    region = []
+
+    for index in range(len(entries)):
+        if region and (index in labelled or fixed(index) or entries[index][4] != entries[region[-1]][4] + 1):
+            _reschedule(entries, words, region, region[0] in labelled, report)
+            region = []
+
+        if not fixed(index):
+            region.append(index)
+
+    if region:
+        _reschedule(entries, words, region, region[0] in labelled, report)
+
+    return (entries, words, report)
+
+def _reschedule(entries : list, words, region : list, pinned : bool, report : list):
+    hubs = [lang.cycles.get(entries[index][1], lang.default_cycles)[2] for index in region]
+
+    if sum(hubs) < 2:
+        return
+
+    operands = [_operands(entries[index], words[index]) for index in region]
+    order = _order(region, pinned, operands, hubs)
+
+    before = _stalls(hubs)
+    after = _stalls([hubs[p] for p in order])
+
+    if after >= before:
+        return
+
+    moved = [(entries[region[p]], words[region[p]]) for p in order]
+
+    for (index, (entry, word)) in zip(region, moved):
+        slot = entries[index]
+        entries[index] = entry[0:4] + slot[4:6] + entry[6:7]
+        words[index] = word
+
+    first = entries[region[0]]
+    report.append({"label" : first[6], "line" : min(entry[3] for (entry, word) in moved), "cog" : first[4],
+                   "before" : before, "after" : after})
@@ -0,0 +1,153 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# A long-running assembler that keeps the lang tables and the expression parser
+# warm between requests.  The protocol is one JSON request per connection:
+#
+#   request  : {"source": text, "format": "binary", "hub_offset": 1, "syntax": 1, "parser": null, "single_pass": false, "isa": null}
+#   response : {"ok": true, "data": base64 image}
+#              {"ok": false, "errors": [[line number, message], ...]}
+#
+# The client shuts down its side of the socket after sending the request.
+
+import os
+import sys
+import json
+import stat
+import base64
+import signal
+import socket
+import tempfile
+import socketserver
+from . import assemble, load_isa
+from .exceptions import AssemblerError, AssemblyFailedError
+
+__all__ = ["default_socket", "trusted_socket", "serve", "request"]
+
+def default_socket() -> str:
+    '''Returns $PASM_SOCKET, or pasm.sock in $XDG_RUNTIME_DIR or in a per-user folder of
+        the temp directory (which serve() creates with mode 0700)'''
+
+    if os.environ.get("PASM_SOCKET"):
+        return os.environ["PASM_SOCKET"]
+
+    folder = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), "pasm-{}".format(os.getuid()))
+
+    return os.path.join(folder, "pasm.sock")
+
+def _owned(path : str, kind) -> bool:
+    # whether path is a kind of file of this user that no one else can write to
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+
+    return kind(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def trusted_socket(path : str) -> bool:
+    '''Returns True if path is a socket of this user, in a folder of this user, and no other
+        user can write to either.  Sources are only sent to (and images only taken from) these.'''
+
+    return _owned(path, stat.S_ISSOCK) and _owned(os.path.dirname(os.path.abspath(path)), stat.S_ISDIR)
+
+def _read_all(sock : socket.socket) -> bytes:
+    chunks = []
+
+    while True:
+        chunk = sock.recv(65536)
+
+        if not chunk:
+            return b"".join(chunks)
+
+        chunks.append(chunk)
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            args = json.loads(_read_all(self.request).decode("utf-8"))
+
+            load_isa(args.get("isa"))
+
+            data = assemble(args["source"].splitlines(True),
+                            args.get("format", "binary"),
+                            args.get("hub_offset", 1),
+                            syntax_version = args.get("syntax", 1),
+                            expression_parser = args.get("parser"),
+                            single_pass = args.get("single_pass", False),
+                            literal_pool = args.get("literal_pool", False))
+
+            reply = {"ok": True, "data": base64.b64encode(bytes(data)).decode("ascii")}
+
+        except AssemblyFailedError as e:
+            reply = {"ok": False, "errors": [[error.LineNumber, error.Message] for error in e.Errors]}
+
+        except Exception as e:
+            reply = {"ok": False, "errors": [[0, "{}: {}".format(type(e).__name__, e)]]}
+
+        self.request.sendall(json.dumps(reply).encode("utf-8"))
+
+def serve(path : str = None):
+    '''Serves assemble requests on a Unix socket until interrupted'''
+
+    path = path or default_socket()
+    folder = os.path.dirname(os.path.abspath(path))
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder, 0o700)
+
+    if not _owned(folder, stat.S_ISDIR):
+        raise PermissionError("\"{}\" must belong to this user and not be writable by others.".format(folder))
+
+    if os.path.lexists(path):
+        if not _owned(path, stat.S_ISSOCK):
+            raise PermissionError("\"{}\" exists and is not a socket of this user.".format(path))
+
+        os.unlink(path)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with socketserver.UnixStreamServer(path, _Handler) as server:
+        os.chmod(path, 0o600)
+
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            os.unlink(path)
+
+def request(source : str, binary_format : str = "binary", hub_offset : int = 1, syntax_version : int = 1,
+            expression_parser : str = None, path : str = None, single_pass : bool = False, isa : str = None,
+            literal_pool : bool = False) -> bytearray:
+    '''Forwards an assemble request to a running server
+        isa is an ISA definition file, which the server must be able to read by that path.
+        Only use a path that trusted_socket() accepts.
+        Raises OSError if no server is listening, AssemblyFailedError if the source has errors'''
+
+    path = path or default_socket()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps({"source": source,
+                                 "format": binary_format,
+                                 "hub_offset": hub_offset,
+                                 "syntax": syntax_version,
+                                 "parser": expression_parser,
+                                 "single_pass": single_pass,
+                                 "isa": isa and os.path.abspath(isa),
+                                 "literal_pool": literal_pool}).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+
+        reply = json.loads(_read_all(sock).decode("utf-8"))
+
+    if not reply["ok"]:
+        raise AssemblyFailedError([AssemblerError(line_number, message) for (line_number, message) in reply["errors"]])
+
+    return bytearray(base64.b64decode(reply["data"]))
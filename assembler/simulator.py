@@ -0,0 +1,509 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# A cycle-counting simulator for one cog, to run assembled code without hardware.
+#
+#   cog = Cog(assemble(source))
+#   cog.Run(cycles=80000)
+#   cog.Cog[0x1F4]                  # OUTA
+#
+# Words are decoded through a table built from lang.instructions: the 6-bit
+# opcode of a word selects the instruction it executes as (CMP and SUB, or
+# JMP and JMPRET, are the same instruction with a different r bit).  Each cog
+# address keeps its decoded word until something writes to it.
+#
+# Timing follows lang.cycles.  A hub instruction waits for the cog's hub
+# window, which comes when (CNT - 2 * CogId) % 16 == 0 at the start of the
+# instruction.  WAITCNT waits for CNT to match, however long that takes.
+# As the S operand, CNT reads the clock at the start of the instruction,
+# and INA and INB read the Ina and Inb attributes; as the D operand, special
+# registers read their shadow RAM, as on the chip.  Counters, video and the
+# other cogs are not simulated: COGINIT of another cog is only recorded in
+# Launches, and a WAITPEQ or WAITPNE that is not met at once raises
+# SimulationError, since nothing can change the pins.
+
+import struct
+from array import array
+from . import lang
+from .pending import word_typecode
+from .exceptions import SimulationError
+
+__all__ = ["Cog"]
+
+_mask = 0xFFFFFFFF
+_hub_size = 0x8000              # RAM; ROM above it reads as zero
+_cog_size = 0x1F0               # longs loaded by COGINIT
+
+def _signed(value : int) -> int:
+    return value - 0x100000000 if value & 0x80000000 else value
+
+def _overflow(value : int) -> bool:
+    return not -0x80000000 <= value <= 0x7FFFFFFF
+
+def _parity(value : int) -> bool:
+    return bin(value).count("1") & 1 == 1
+
+# Instructions that compute a result and flags: f(d, s, c, z) -> (result, c, z)
+
+def _add(d, s, c, z):
+    r = d + s
+    return (r & _mask, r > _mask, r & _mask == 0)
+
+def _addx(d, s, c, z):
+    r = d + s + c
+    return (r & _mask, r > _mask, z and r & _mask == 0)
+
+def _adds(d, s, c, z):
+    r = _signed(d) + _signed(s)
+    return (r & _mask, _overflow(r), r & _mask == 0)
+
+def _addsx(d, s, c, z):
+    r = _signed(d) + _signed(s) + c
+    return (r & _mask, _overflow(r), z and r & _mask == 0)
+
+def _addabs(d, s, c, z):
+    r = d + abs(_signed(s))
+    return (r & _mask, r > _mask, r & _mask == 0)
+
+def _sub(d, s, c, z):
+    return ((d - s) & _mask, d < s, d == s)
+
+def _subx(d, s, c, z):
+    r = (d - s - c) & _mask
+    return (r, d < s + c, z and r == 0)
+
+def _subs(d, s, c, z):
+    r = _signed(d) - _signed(s)
+    return (r & _mask, _overflow(r), r & _mask == 0)
+
+def _subsx(d, s, c, z):
+    r = _signed(d) - _signed(s) - c
+    return (r & _mask, _overflow(r), z and r & _mask == 0)
+
+def _subabs(d, s, c, z):
+    s = abs(_signed(s))
+    return ((d - s) & _mask, d < s, d == s)
+
+def _cmps(d, s, c, z):
+    return ((d - s) & _mask, _signed(d) < _signed(s), d == s)
+
+def _cmpsx(d, s, c, z):
+    r = (d - s - c) & _mask
+    return (r, _signed(d) < _signed(s) + c, z and r == 0)
+
+def _cmpsub(d, s, c, z):
+    if d >= s:
+        return (d - s, True, d == s)
+
+    return (d, False, False)
+
+def _abs(d, s, c, z):
+    r = abs(_signed(s)) & _mask
+    return (r, s >> 31 == 1, r == 0)
+
+def _absneg(d, s, c, z):
+    r = -abs(_signed(s)) & _mask
+    return (r, s >> 31 == 1, r == 0)
+
+def _neg_if(condition : bool, s : int) -> tuple:
+    r = -s & _mask if condition else s
+    return (r, s >> 31 == 1, r == 0)
+
+def _sum_if(condition : bool, d : int, s : int) -> tuple:
+    r = _signed(d) - _signed(s) if condition else _signed(d) + _signed(s)
+    return (r & _mask, _overflow(r), r & _mask == 0)
+
+def _mux(condition : bool, d : int, s : int) -> tuple:
+    r = (d & ~s) | (s if condition else 0)
+    return (r, _parity(r), r == 0)
+
+def _logic(r : int) -> tuple:
+    return (r, _parity(r), r == 0)
+
+def _rol(d, s, c, z):
+    n = s & 31
+    return (((d << n) | (d >> (32 - n))) & _mask, d >> 31 == 1, d == 0)
+
+def _ror(d, s, c, z):
+    n = s & 31
+    return (((d >> n) | (d << (32 - n))) & _mask, d & 1 == 1, d == 0)
+
+def _rcl(d, s, c, z):
+    n = s & 31
+    r = ((d << n) | (((1 << n) - 1) if c else 0)) & _mask
+    return (r, d >> 31 == 1, r == 0)
+
+def _rcr(d, s, c, z):
+    n = s & 31
+    r = (d >> n) | ((_mask << (32 - n)) & _mask if c else 0)
+    return (r, d & 1 == 1, r == 0)
+
+def _shl(d, s, c, z):
+    r = (d << (s & 31)) & _mask
+    return (r, d >> 31 == 1, r == 0)
+
+def _shr(d, s, c, z):
+    r = d >> (s & 31)
+    return (r, d & 1 == 1, r == 0)
+
+def _sar(d, s, c, z):
+    r = (_signed(d) >> (s & 31)) & _mask
+    return (r, d & 1 == 1, r == 0)
+
+def _rev(d, s, c, z):
+    r = int("{:032b}".format(d)[::-1], 2) >> (s & 31)
+    return (r, d & 1 == 1, r == 0)
+
+def _max(d, s, c, z):
+    return (s if s < d else d, d < s, s == 0)
+
+def _min(d, s, c, z):
+    return (s if s > d else d, d < s, s == 0)
+
+def _maxs(d, s, c, z):
+    return (s if _signed(s) < _signed(d) else d, _signed(d) < _signed(s), s == 0)
+
+def _mins(d, s, c, z):
+    return (s if _signed(s) > _signed(d) else d, _signed(d) < _signed(s), s == 0)
+
+def _mov(d, s, c, z):
+    return (s, s >> 31 == 1, s == 0)
+
+def _field(shift : int):
+    def move(d, s, c, z):
+        r = (d & ~(0x1FF << shift) | (s & 0x1FF) << shift) & _mask
+        return (r, c, r == 0)
+
+    return move
+
+_alu = {
+    "ABS" : _abs, "ABSNEG" : _absneg,
+    "ADD" : _add, "ADDABS" : _addabs, "ADDS" : _adds, "ADDSX" : _addsx, "ADDX" : _addx,
+    "SUB" : _sub, "SUBABS" : _subabs, "SUBS" : _subs, "SUBSX" : _subsx, "SUBX" : _subx,
+    "CMP" : _sub, "CMPX" : _subx, "CMPS" : _cmps, "CMPSX" : _cmpsx, "CMPSUB" : _cmpsub,
+    "AND" : lambda d, s, c, z: _logic(d & s),
+    "ANDN" : lambda d, s, c, z: _logic(d & ~s & _mask),
+    "OR" : lambda d, s, c, z: _logic(d | s),
+    "XOR" : lambda d, s, c, z: _logic(d ^ s),
+    "TEST" : lambda d, s, c, z: _logic(d & s),
+    "TESTN" : lambda d, s, c, z: _logic(d & ~s & _mask),
+    "MUXC" : lambda d, s, c, z: _mux(c, d, s),
+    "MUXNC" : lambda d, s, c, z: _mux(not c, d, s),
+    "MUXZ" : lambda d, s, c, z: _mux(z, d, s),
+    "MUXNZ" : lambda d, s, c, z: _mux(not z, d, s),
+    "NEG" : lambda d, s, c, z: _neg_if(True, s),
+    "NEGC" : lambda d, s, c, z: _neg_if(c, s),
+    "NEGNC" : lambda d, s, c, z: _neg_if(not c, s),
+    "NEGZ" : lambda d, s, c, z: _neg_if(z, s),
+    "NEGNZ" : lambda d, s, c, z: _neg_if(not z, s),
+    "SUMC" : lambda d, s, c, z: _sum_if(c, d, s),
+    "SUMNC" : lambda d, s, c, z: _sum_if(not c, d, s),
+    "SUMZ" : lambda d, s, c, z: _sum_if(z, d, s),
+    "SUMNZ" : lambda d, s, c, z: _sum_if(not z, d, s),
+    "ROL" : _rol, "ROR" : _ror, "RCL" : _rcl, "RCR" : _rcr,
+    "SHL" : _shl, "SHR" : _shr, "SAR" : _sar, "REV" : _rev,
+    "MAX" : _max, "MAXS" : _maxs, "MIN" : _min, "MINS" : _mins,
+    "MOV" : _mov, "MOVS" : _field(0), "MOVD" : _field(9), "MOVI" : _field(23),
+    "WAITVID" : lambda d, s, c, z: (d, c, z),
+    }
+
+# Instructions that branch, wait or use the hub: f(cog, d, s, decoded) -> (result or None, c, z, next pc, cycles)
+
+def _jmpret(cog, d, s, decoded):
+    r = (d & ~0x1FF) | ((cog.PC + 1) & 0x1FF)
+    return (r, cog.C, r == 0, s, 4)
+
+def _djnz(cog, d, s, decoded):
+    r = (d - 1) & _mask
+    return (r, d == 0, r == 0) + ((s, 4) if r else (cog.PC + 1, 8))
+
+def _tjnz(cog, d, s, decoded):
+    return (d, False, d == 0) + ((s, 4) if d else (cog.PC + 1, 8))
+
+def _tjz(cog, d, s, decoded):
+    return (d, False, d == 0) + ((cog.PC + 1, 8) if d else (s, 4))
+
+def _waitcnt(cog, d, s, decoded):
+    # CNT is compared from the clock after the instruction starts, and it ends 5 clocks after the match
+    wait = (d - cog.Cnt - 1) & _mask
+    r = d + s
+    return (r & _mask, r > _mask, r & _mask == 0, cog.PC + 1, wait + 6)
+
+def _waitpeq(cog, d, s, decoded):
+    if (cog.Ina & s) != d:
+        raise SimulationError(cog.PC, "WAITPEQ waits forever: INA does not change in the simulator.")
+
+    return (d, cog.C, cog.Z, cog.PC + 1, 6)
+
+def _waitpne(cog, d, s, decoded):
+    if (cog.Ina & s) == d:
+        raise SimulationError(cog.PC, "WAITPNE waits forever: INA does not change in the simulator.")
+
+    return (d, cog.C, cog.Z, cog.PC + 1, 6)
+
+def _hub_access(size : int):
+    def access(cog, d, s, decoded):
+        address = s & 0xFFFF & -size
+        cycles = cog.HubCycles()
+
+        if not decoded[8]:
+            # write (the r bit selects RDxxxx or WRxxxx)
+            if address < _hub_size:
+                cog.Hub[address:address + size] = (d & ((1 << 8 * size) - 1)).to_bytes(size, "little")
+
+            return (None, cog.C, d == 0, cog.PC + 1, cycles)
+
+        r = int.from_bytes(cog.Hub[address:address + size], "little") if address < _hub_size else 0
+
+        return (r, cog.C, r == 0, cog.PC + 1, cycles)
+
+    return access
+
+def _hubop(cog, d, s, decoded):
+    cycles = cog.HubCycles()
+    operation = s & 7
+    (r, c, z) = (d, cog.C, cog.Z)
+    following = cog.PC + 1
+
+    if operation == 0:                  # CLKSET
+        cog.ClockMode = d & 0xFF
+    elif operation == 1:                # COGID
+        (r, c, z) = (cog.CogId, False, cog.CogId == 0)
+    elif operation == 2:                # COGINIT
+        target = d & 7
+        (par, code) = ((d >> 16) & 0xFFFC, (d >> 2) & 0xFFFC)
+
+        if d & 8:
+            running = {cog.CogId} | {launch[0] for launch in cog.Launches}
+            free = [i for i in range(8) if i not in running]
+
+            if not free:
+                return (7, True, False, following, cycles)
+
+            target = free[0]
+
+        if target == cog.CogId:
+            cog.Start(code, par)
+            return (None, cog.C, cog.Z, 0, cycles)
+
+        cog.Launches.append((target, code, par))
+        (r, c, z) = (target, False, target == 0)
+    elif operation == 3:                # COGSTOP
+        if d & 7 == cog.CogId:
+            cog.Halted = True
+            following = cog.PC
+    elif operation == 4:                # LOCKNEW
+        free = [i for i in range(8) if i not in cog.CheckedOut]
+
+        if free:
+            cog.CheckedOut.add(free[0])
+            (r, c, z) = (free[0], False, free[0] == 0)
+        else:
+            (r, c, z) = (7, True, False)
+    elif operation == 5:                # LOCKRET
+        cog.CheckedOut.discard(d & 7)
+    else:                               # LOCKSET, LOCKCLR
+        c = cog.Locks[d & 7]
+        cog.Locks[d & 7] = (operation == 6)
+
+    return (r, c, z, following, cycles)
+
+def _undefined(cog, d, s, decoded):
+    raise SimulationError(cog.PC, "No simulation for instruction ${:08X}.".format(cog.Cog[cog.PC]))
+
+_special = {
+    "JMP" : _jmpret, "JMPRET" : _jmpret, "CALL" : _jmpret, "RET" : _jmpret,
+    "DJNZ" : _djnz, "TJNZ" : _tjnz, "TJZ" : _tjz,
+    "WAITCNT" : _waitcnt, "WAITPEQ" : _waitpeq, "WAITPNE" : _waitpne,
+    "RDBYTE" : _hub_access(1), "RDWORD" : _hub_access(2), "RDLONG" : _hub_access(4),
+    "WRBYTE" : _hub_access(1), "WRWORD" : _hub_access(2), "WRLONG" : _hub_access(4),
+    "HUBOP" : _hubop, "CLKSET" : _hubop, "COGID" : _hubop, "COGINIT" : _hubop, "COGSTOP" : _hubop,
+    "LOCKNEW" : _hubop, "LOCKRET" : _hubop, "LOCKSET" : _hubop, "LOCKCLR" : _hubop,
+    }
+
+def _opcodes() -> dict:
+    '''Maps each 6-bit opcode to the lang instruction it executes as
+
+        Of the instructions that share an opcode, the one with the fewest fixed
+        d and s bits is the general case (HUBOP rather than COGID).'''
+
+    table = {}
+
+    for (name, rules) in lang.instructions.items():
+        bits = rules[0][0:6]
+
+        if bits.strip("01") or (name not in _alu and name not in _special):
+            continue
+
+        fixed = sum(bit in "01" for bit in rules[0][14:])
+
+        if bits not in table or fixed < table[bits][0]:
+            table[bits] = (fixed, name)
+
+    return {int(bits, 2) : name for (bits, (fixed, name)) in table.items()}
+
+class Cog:
+    """One simulated cog with its own copy of hub RAM
+
+        Cog is the 512-long cog RAM, and Hub the 32 KB of hub RAM.  Counts and
+        Cycles are the times each cog address was executed and the clocks it took
+        (see Profile()).  Write to cog RAM with Poke(), so that a decoded copy of
+        the old word is not executed."""
+
+    def __init__(self, image=None, binary_format : str = "binary", hub_offset : int = 0, cog_id : int = 0):
+        self.Cog = array(word_typecode, bytes(0x200 * 4))
+        self.Hub = bytearray(_hub_size)
+        self.CogId = cog_id
+        self.PC = 0
+        self.C = False
+        self.Z = False
+        self.Cnt = 0
+        self.Ina = 0
+        self.Inb = 0
+        self.ClockMode = 0
+        self.Halted = False
+        self.Launches = []          # (cog, code address, PAR) of every COGINIT of another cog
+        self.Locks = [False] * 8
+        self.CheckedOut = set()     # locks taken by LOCKNEW and not returned
+
+        self.Counts = array("Q", bytes(0x200 * 8))
+        self.Cycles = array("Q", bytes(0x200 * 8))
+
+        self._opcodes = _opcodes()
+        self._decoded = [None] * 0x200
+
+        if image is not None:
+            self.Load(image, binary_format, hub_offset)
+
+    def Load(self, image, binary_format : str = "binary", hub_offset : int = 0):
+        '''Copies an assemble() image into hub RAM and starts the cog on its code
+            A "raw" image is placed at hub_offset; the others have a header that gives the code address.'''
+
+        image = bytes(image)
+
+        if binary_format == "raw":
+            address = hub_offset
+        else:
+            address = struct.unpack_from("<H", image, 6)[0]        # pbase
+            hub_offset = 0
+
+        if hub_offset + len(image) > _hub_size:
+            raise ValueError("The image does not fit in hub RAM.")
+
+        self.Hub[hub_offset:hub_offset + len(image)] = image
+        self.Start(address)
+
+    def Start(self, address : int, par : int = 0):
+        '''Loads cog RAM from hub RAM at address and starts at cog address 0, as COGINIT does'''
+
+        code = bytes(self.Hub[address:address + _cog_size * 4])
+        code += bytes(_cog_size * 4 - len(code))
+
+        self.Cog[0:_cog_size] = array(word_typecode, struct.unpack("<{}I".format(_cog_size), code))
+        self.Cog[0x1F0] = par
+        self.PC = 0
+        self.Halted = False
+        self._decoded = [None] * 0x200
+
+    def Poke(self, address : int, value : int):
+        '''Writes a long to cog RAM'''
+
+        self.Cog[address] = value & _mask
+        self._decoded[address] = None
+
+    def HubCycles(self) -> int:
+        '''Returns the clocks a hub instruction starting now takes, including the wait for the hub window'''
+
+        return 8 + (2 * self.CogId - self.Cnt) % 16
+
+    def _decode(self, word : int) -> tuple:
+        name = self._opcodes.get(word >> 26)
+        function = _special.get(name) or _alu.get(name) or _undefined
+        best = lang.cycles.get(name, lang.default_cycles)[0]
+
+        return (function, name not in _alu, (word >> 18) & 0xF,
+                (word >> 9) & 0x1FF, word & 0x1FF, word & lang.i_flag, word & lang.z_flag, word & lang.c_flag, word & lang.r_flag,
+                best)
+
+    def Run(self, instructions : int = None, cycles : int = None, breakpoints = ()) -> str:
+        '''Runs until the cog stops ("halted"), reaches a cog address in breakpoints
+            ("breakpoint"), or has run the given number of instructions or clock
+            cycles ("limit").  Raises SimulationError for code it cannot simulate.'''
+
+        cog = self.Cog
+        decoded = self._decoded
+        counts = self.Counts
+        spent = self.Cycles
+        stop = None if cycles is None else self.Cnt + cycles
+        breakpoints = frozenset(breakpoints)
+        executed = 0
+
+        while True:
+            if self.Halted:
+                return "halted"
+
+            if (instructions is not None and executed >= instructions) or (stop is not None and self.Cnt >= stop):
+                return "limit"
+
+            pc = self.PC
+
+            if executed and pc in breakpoints:
+                return "breakpoint"
+
+            entry = decoded[pc]
+
+            if entry is None:
+                entry = decoded[pc] = self._decode(cog[pc])
+
+            (function, special, cond, d, s, immediate, wz, wc, wr, taken) = entry
+
+            if (cond >> ((self.C << 1) | self.Z)) & 1:
+                if not immediate:
+                    if 0x1F1 <= s <= 0x1F3:
+                        s = (self.Cnt & _mask, self.Ina, self.Inb)[s - 0x1F1]
+                    else:
+                        s = cog[s]
+
+                if special:
+                    (result, c, z, following, taken) = function(self, cog[d], s, entry)
+                else:
+                    (result, c, z) = function(cog[d], s, self.C, self.Z)
+                    following = pc + 1
+
+                if wr and result is not None:
+                    cog[d] = result
+                    decoded[d] = None
+
+                if wz:
+                    self.Z = bool(z)
+
+                if wc:
+                    self.C = bool(c)
+            else:
+                taken = 4
+                following = pc + 1
+
+            counts[pc] += 1
+            spent[pc] += taken
+            self.Cnt += taken
+            self.PC = following & 0x1FF
+            executed += 1
+
+    def Step(self) -> str:
+        '''Runs one instruction'''
+
+        return self.Run(instructions=1)
+
+    def Profile(self) -> list:
+        '''Returns a list with a dict (address, count, cycles) for every cog address that was executed,
+            in address order'''
+
+        return [{"address" : address, "count" : count, "cycles" : self.Cycles[address]}
+                for (address, count) in enumerate(self.Counts) if count]
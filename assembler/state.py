@@ -10,9 +10,21 @@
 # the software.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
-from .exceptions import AddressOutOfRangeError, AssemblerError
+from .exceptions import AddressOutOfRangeError, AssemblerError, ForwardReferenceError
 
-__all__ = ["State"]
+__all__ = ["State", "Symbol"]
+
+class Symbol:
+    """A label and the addresses it resolved to"""
+
+    __slots__ = ("Name", "LineNumber", "CogAddress", "HubAddress", "Return")
+
+    def __init__(self, name : str, line_number : int):
+        self.Name = name
+        self.LineNumber = line_number
+        self.CogAddress = -1
+        self.HubAddress = -1
+        self.Return = None          # the matching "_RET" symbol, if any
 
 class State:
     label_re = re.compile(":?[_A-Z][_A-Z0-9]*", re.IGNORECASE);
@@ -22,11 +34,20 @@ class State:
         self.CogAddress = 0
         self.HubAddress = 1
         self.CurrentLabel = ""
-        self.Labels = []
+        self.Labels = {}
         self.Instructions = []
 
         self.Errors = []
 
+        self.Lookups = None         # when a list, every symbol name looked up is appended to it
+        self.Deferring = False      # when true, unknown labels raise ForwardReferenceError
+
+        self.Literals = None        # literal pool mode: value -> symbol name of each literal not placed yet
+        self.LiteralUses = 0        # oversized immediates turned into literals
+        self.LiteralLongs = 0       # longs placed in literal pools
+
+        self._unresolved = []
+
     def ORG(self, address : int = 0):
         if address < 0 or address > 0x1FF:
             raise AddressOutOfRangeError()
@@ -45,15 +66,42 @@ class State:
 
         self.CogAddress += count
 
-    def SetLineNumber(self, line_number : int):
-        self.LineNumber = line_number
+    def Snapshot(self) -> tuple:
+        '''Captures everything pass 1 changes, for Restore()'''
 
-        matches = [l for l in self.Labels if l[1] <= line_number and ":" not in l[0]]
+        literals = None if self.Literals is None else dict(self.Literals)
 
-        if matches:
-            self.CurrentLabel = matches[-1][0]
-        else:
-            self.CurrentLabel = ""
+        return (self.LineNumber, self.CogAddress, self.HubAddress, self.CurrentLabel,
+                len(self.Labels), tuple(self._unresolved), len(self.Errors),
+                literals, self.LiteralUses, self.LiteralLongs)
+
+    def Restore(self, snapshot : tuple):
+        '''Rolls back to a Snapshot(), forgetting every label and error added since'''
+
+        (self.LineNumber, self.CogAddress, self.HubAddress, self.CurrentLabel, label_count, unresolved, error_count,
+         literals, self.LiteralUses, self.LiteralLongs) = snapshot
+
+        for name in list(self.Labels)[label_count:]:
+            symbol = self.Labels.pop(name)
+
+            if name.endswith("_RET") and name[:-4] in self.Labels and self.Labels[name[:-4]].Return is symbol:
+                self.Labels[name[:-4]].Return = None
+
+        for symbol in unresolved:
+            symbol.CogAddress = -1
+            symbol.HubAddress = -1
+
+        self._unresolved = list(unresolved)
+
+        del self.Errors[error_count:]
+
+        self.Literals = None if literals is None else dict(literals)
+
+    def SetLineNumber(self, line_number : int, current_label : str):
+        '''Restores the line number and local-label scope recorded for a line during pass 1'''
+
+        self.LineNumber = line_number
+        self.CurrentLabel = current_label
 
     def AddLabel(self, label : str) -> bool:
         '''Validates a label and adds it to the label collection
@@ -67,34 +115,69 @@ class State:
         else:
             self.CurrentLabel = label
 
-            if label.endswith("_RET"):
-                for l in reversed(self.Labels):
-                    if label == (l[0] + "_RET"):
-                        l.append(len(self.Labels))
-                        break
-
         if label in self.Labels:
             return False
 
-        self.Labels.append([label, self.LineNumber, -1, -1])
+        symbol = Symbol(label, self.LineNumber)
+
+        if label.endswith("_RET") and label[:-4] in self.Labels:
+            self.Labels[label[:-4]].Return = symbol
+
+        self.Labels[label] = symbol
+        self._unresolved.append(symbol)
 
         return True
 
+    def PlaceSymbol(self, name : str):
+        '''Adds a generated (not source) symbol at the current addresses'''
+
+        symbol = Symbol(name, self.LineNumber)
+        symbol.CogAddress = self.CogAddress
+        symbol.HubAddress = self.HubAddress
+
+        self.Labels[name] = symbol
+
     def FixLabelAddresses(self):
-        for label in reversed(self.Labels):
-            if label[2] != -1:
-                break
+        for symbol in self._unresolved:
+            symbol.CogAddress = self.CogAddress
+            symbol.HubAddress = self.HubAddress
 
-            label[2] = self.CogAddress
-            label[3] = self.HubAddress
+        self._unresolved.clear()
 
-    def GetLabelAddress(self, name : str, hub_address : bool = False) -> int:
+    def GetSymbol(self, name : str) -> Symbol:
         if name[0] == ":":
             name = self.CurrentLabel + name
 
-        match = [l for l in self.Labels if l[0] == name]
+        if self.Lookups is not None:
+            self.Lookups.append(name)
+
+        return self.Labels.get(name)
+
+    def Unresolved(self, message : str) -> AssemblerError:
+        '''Returns the error to raise for a label that is not defined (yet)'''
+
+        if self.Deferring:
+            return ForwardReferenceError()
+
+        return AssemblerError(self.LineNumber, message)
+
+    def GetSymbolKey(self, name : str) -> tuple:
+        '''Returns everything an encoding can depend on for a (fully qualified) symbol name'''
+
+        symbol = self.Labels.get(name)
+
+        if symbol is None:
+            return None
+
+        return (symbol.CogAddress, symbol.HubAddress, symbol.Return and symbol.Return.CogAddress)
+
+    def GetLabelAddress(self, name : str, hub_address : bool = False) -> int:
+        symbol = self.GetSymbol(name)
+
+        if symbol is None:
+            return None
 
-        return None if not match else match[0][3 if hub_address else 2]
+        return symbol.HubAddress if hub_address else symbol.CogAddress
 
     def AddError(self, error : AssemblerError):
         self.Errors.append(error)
\ No newline at end of file
@@ -0,0 +1,89 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Text renderings of an assembled image, for loading into simulators and FPGA
+# block RAM.  Each one formats the whole image at once and returns a string.
+
+import sys
+import binascii
+from array import array
+from .pending import word_typecode
+
+__all__ = ["hex_dump", "intel_hex", "readmemh", "mif", "formats"]
+
+def _words(data) -> bytes:
+    # The image as big-endian longs, so that _hex() prints each long the way it reads.
+    # The Propeller is little-endian, so every long is byte-reversed.
+    data = bytes(data)
+    words = array(word_typecode)
+    words.frombytes(data + bytes(-len(data) % 4))
+
+    if sys.byteorder == "little":
+        words.byteswap()
+
+    return words.tobytes()
+
+def _hex(data) -> str:
+    # upper-case hex digits of data, two per byte
+    return binascii.hexlify(data).decode("ascii").upper()
+
+def _groups(text : str, size : int) -> list:
+    # text cut into pieces of size characters (the last one may be shorter)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def hex_dump(data) -> str:
+    '''Bytes in groups of four, sixteen to a line'''
+
+    return "".join("\n" + " ".join(_groups(line, 8)) for line in _groups(_hex(data), 32))
+
+def _ihex_record(record_type : int, address : int, payload) -> str:
+    record = bytes([len(payload), (address >> 8) & 0xFF, address & 0xFF, record_type]) + bytes(payload)
+
+    return ":" + _hex(record) + format(-sum(record) & 0xFF, "02X")
+
+def intel_hex(data) -> str:
+    '''Intel HEX, sixteen bytes to a data record'''
+
+    view = memoryview(data)
+    records = []
+
+    for address in range(0, len(view), 16):
+        if address and address & 0xFFFF == 0:
+            records.append(_ihex_record(0x04, 0, (address >> 16).to_bytes(2, "big")))
+
+        records.append(_ihex_record(0x00, address, view[address:address + 16]))
+
+    records.append(_ihex_record(0x01, 0, b""))
+
+    return "\n".join(records) + "\n"
+
+def readmemh(data) -> str:
+    '''Verilog $readmemh, one 32-bit word per line'''
+
+    return "\n".join(_groups(_hex(_words(data)).lower(), 8)) + "\n"
+
+def mif(data) -> str:
+    '''Altera memory initialization file with a 32-bit word width'''
+
+    words = _groups(_hex(_words(data)), 8)
+
+    lines = ["WIDTH=32;", "DEPTH={};".format(len(words)), "", "ADDRESS_RADIX=HEX;", "DATA_RADIX=HEX;", "", "CONTENT BEGIN"]
+    lines += ["\t{:04X} : {};".format(address, word) for (address, word) in enumerate(words)]
+    lines.append("END;")
+
+    return "\n".join(lines) + "\n"
+
+# name : (filename suffix, writer)
+formats = {
+    "hex"      : (".hex", hex_dump),
+    "ihex"     : (".ihx", intel_hex),
+    "readmemh" : (".mem", readmemh),
+    "mif"      : (".mif", mif),
+}
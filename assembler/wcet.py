@@ -0,0 +1,390 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Best- and worst-case execution time of an assembled program (pasm --wcet).
+#
+# The control flow graph has one node per instruction.  Edges come from JMP,
+# JMPRET, DJNZ, TJZ and TJNZ targets (when immediate), from CALL (which costs
+# the called routine, up to its RET), and from the instruction's condition: a
+# condition that may not be met also falls through.  RET, indirect jumps and
+# running off the end of the code end a path.
+#
+# Each label is timed from its first instruction to the end of a path.  Loops
+# are found from the graph and need a bound to have a worst case: put
+# "@bound N" in the comment of the jump that closes the loop, meaning it is
+# taken at most N times each time the loop is entered.
+#
+#   :loop   XOR     OUTA, #1
+#           DJNZ    count, #:loop       ' @bound 8
+#
+# WAIT instructions are counted at their minimum.  Instead, each WAITCNT is
+# checked against its budget: the worst case from it to the next WAITCNT on the
+# same register must not exceed its delay (the s operand, or the initial value
+# of the s register).
+#
+# Times are in clock cycles.  A worst case of None means unbounded.
+
+import re
+import math
+import heapq
+from bisect import bisect_left
+from . import lang
+from .listing import timing
+
+__all__ = ["analyze"]
+
+_return = "return"              # end of path sentinels
+_exit = "exit"
+
+_bound_re = re.compile(r"@BOUND\s+(\d+)", re.IGNORECASE)
+
+def _postorder(root, successors) -> list:
+    order = []
+    seen = {root}
+    stack = [(root, iter(successors(root)))]
+
+    while stack:
+        (node, children) = stack[-1]
+
+        for child in children:
+            if child not in seen:
+                seen.add(child)
+                stack.append((child, iter(successors(child))))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+
+    return order
+
+def _cycles(value) -> int:
+    return None if value == math.inf or value is None else value
+
+class _Program:
+    def __init__(self, lines : list, pending, words, labels : dict):
+        self.Lines = lines
+        self.Entries = list(pending)
+        self.Words = list(words)
+        self.Labels = labels
+        self.Loops = {}
+
+        self._segments = []         # ORG section of each entry
+        self._code = {}             # (section, cog address) -> entry index
+        self._routines = {}
+
+        segment = 0
+
+        for (index, entry) in enumerate(self.Entries):
+            if index and entry[4] <= self.Entries[index - 1][4]:
+                segment += 1
+
+            self._segments.append(segment)
+            self._code[(segment, entry[4])] = index
+
+        # a label is on the first entry from its line, if that entry is at its address
+        line_numbers = [entry[3] for entry in self.Entries]
+        self._labels = {}
+
+        for (name, symbol) in labels.items():
+            index = bisect_left(line_numbers, symbol.LineNumber)
+
+            if index < len(self.Entries) and self.Entries[index][4] == symbol.CogAddress and self.IsCode(index):
+                self._labels[name] = index
+
+    def IsCode(self, index) -> bool:
+        return index is not None and self.Entries[index][1] not in lang.datatypes
+
+    def Find(self, index : int, address : int) -> int:
+        '''Returns the entry at a cog address in the same ORG section as entry index, or None'''
+
+        return self._code.get((self._segments[index], address))
+
+    def Field(self, index : int, name : str) -> int:
+        (base, d_shift, d_mask, s_shift, s_mask) = lang.encodings[self.Entries[index][1]]
+        word = self.Words[index]
+
+        return (word & d_mask) >> d_shift if name == "d" else (word & s_mask) >> s_shift
+
+    def Bound(self, index : int) -> int:
+        text = self.Lines[self.Entries[index][3] - 1]
+        match = _bound_re.search(text[text.find("'"):]) if "'" in text else None
+
+        return int(match.group(1)) if match else None
+
+    def _target(self, index : int):
+        if not self.Words[index] & lang.i_flag:
+            return _exit                # indirect
+
+        target = self.Find(index, self.Field(index, "s"))
+
+        return target if self.IsCode(target) else _exit
+
+    def Edges(self, index : int) -> list:
+        '''Returns the (successor, best, worst) cycles of every way out of an instruction'''
+
+        (cond, opcode) = self.Entries[index][0:2]
+        following = self.Find(index, self.Entries[index][4] + 1)
+        following = following if self.IsCode(following) else _exit
+
+        code = lang.condition_codes.get(cond, 0xF)
+        skipped = [] if code == 0xF else [(following, 4, 4)]
+
+        if code == 0x0:
+            return skipped
+
+        if opcode == "RET":
+            return [(_return, 4, 4)] + skipped
+
+        if opcode in ("JMP", "JMPRET"):
+            return [(self._target(index), 4, 4)] + skipped
+
+        if opcode in ("DJNZ", "TJZ", "TJNZ"):
+            return [(self._target(index), 4, 4), (following, 4 if skipped else 8, 8)]
+
+        if opcode == "CALL":
+            (best, worst) = self.Routine(self._target(index))
+
+            return [(following, 4 + best, 4 + worst)] + skipped
+
+        (best, worst, stall) = timing(cond, opcode)
+
+        return [(following, best, best if worst is None else worst)]
+
+    def Routine(self, index) -> tuple:
+        '''Returns the (best, worst) cycles of the routine starting at entry index, up to its return'''
+
+        if index == _exit:
+            return (math.inf, math.inf)
+
+        if index not in self._routines:
+            self._routines[index] = (math.inf, math.inf)       # recursion never returns
+            result = self.Bounds([(index, 0, 0)])
+
+            if result["best"] == math.inf:
+                self._routines[index] = (math.inf, math.inf)        # never returns
+            else:
+                self._routines[index] = (result["best"], result["worst"])
+
+        return self._routines[index]
+
+    def Bounds(self, start : list, stop : set = frozenset()) -> dict:
+        '''Times every path from the start edges until it ends, or reaches an entry in stop'''
+
+        graph = {}
+        todo = ["start"]
+
+        while todo:
+            node = todo.pop()
+
+            if node in graph:
+                continue
+
+            if node == "start":
+                graph[node] = start
+            elif node in stop or node in (_return, _exit):
+                graph[node] = []
+            else:
+                graph[node] = self.Edges(node)
+
+            todo.extend(edge[0] for edge in graph[node])
+
+        ends = {node for node in graph if node in stop or node in (_return, _exit)}
+
+        return {"best" : self._best(graph, ends), "worst" : self._worst(graph, ends)}
+
+    def _best(self, graph : dict, ends : set):
+        # Dijkstra; loops never make a path shorter
+        distance = {"start" : 0}
+        queue = [(0, 0, "start")]
+        count = 0
+
+        while queue:
+            (cost, tie, node) = heapq.heappop(queue)
+
+            if node in ends:
+                return cost
+
+            if cost > distance[node]:
+                continue
+
+            for (successor, best, worst) in graph[node]:
+                if cost + best < distance.get(successor, math.inf):
+                    distance[successor] = cost + best
+                    count += 1
+                    heapq.heappush(queue, (cost + best, count, successor))
+
+        return math.inf
+
+    def _worst(self, graph : dict, ends : set):
+        successors = lambda node: [edge[0] for edge in graph[node]]
+        order = _postorder("start", successors)
+        position = {node : i for (i, node) in enumerate(order)}
+
+        predecessors = {node : [] for node in graph}
+
+        for node in graph:
+            for successor in successors(node):
+                predecessors[successor].append(node)
+
+        # dominators, in reverse postorder
+        dominators = {node : set(graph) for node in graph}
+        dominators["start"] = {"start"}
+        changed = True
+
+        while changed:
+            changed = False
+
+            for node in reversed(order):
+                if node == "start":
+                    continue
+
+                new = {node} | set.intersection(*(dominators[p] for p in predecessors[node]))
+
+                if new != dominators[node]:
+                    dominators[node] = new
+                    changed = True
+
+        # loops: an edge to a node no later in postorder closes one, if its target dominates it
+        loops = {}
+
+        for node in graph:
+            for successor in successors(node):
+                if position[successor] >= position[node]:
+                    if successor not in dominators[node]:
+                        return math.inf                             # irreducible
+
+                    loops.setdefault(successor, set()).add(node)
+
+        bodies = {}
+
+        for (header, latches) in loops.items():
+            body = {header}
+            todo = list(latches)
+
+            while todo:
+                node = todo.pop()
+
+                if node not in body:
+                    body.add(node)
+                    todo.extend(predecessors[node])
+
+            bodies[header] = body
+
+        # collapse loops, innermost first, into their header
+        costs = {node : [(edge[0], edge[2]) for edge in graph[node]] for node in graph}
+
+        for header in sorted(bodies, key=lambda h: len(bodies[h])):
+            body = bodies[header] & set(costs)
+            inner = lambda node: [s for (s, c) in costs[node] if s in body and s != header]
+
+            distance = {header : 0}
+
+            for node in reversed(_postorder(header, inner)):
+                for (successor, cost) in costs[node]:
+                    if successor in body and successor != header:
+                        distance[successor] = max(distance.get(successor, -math.inf), distance[node] + cost)
+
+            iteration = max((distance[node] + cost for node in distance for (successor, cost) in costs[node] if successor == header), default=0)
+
+            bounds = [self.Bound(latch) for latch in loops[header]]
+            count = None if None in bounds else sum(bounds)
+            repeats = math.inf if count is None else count * iteration
+
+            self.Loops.setdefault(header, {"line" : self.Entries[header][3],
+                                           "cog" : self.Entries[header][4],
+                                           "bound" : count,
+                                           "iteration" : _cycles(iteration)})
+
+            costs[header] = [(successor, repeats + distance[node] + cost)
+                             for node in distance for (successor, cost) in costs[node] if successor not in body]
+
+            for node in body - {header}:
+                del costs[node]
+
+        # longest path through what is left, which has no cycles
+        longest = {}
+
+        for node in _postorder("start", lambda node: [s for (s, c) in costs[node]]):
+            if node in ends:
+                longest[node] = 0
+            else:
+                # -inf: no path from here ever ends
+                longest[node] = max((cost + longest[successor] for (successor, cost) in costs[node] if longest[successor] != -math.inf),
+                                    default=-math.inf)
+
+        return longest["start"]
+
+    def Label(self, name : str) -> int:
+        '''Returns the entry index of the instruction a label is on, or None'''
+
+        return self._labels.get(name)
+
+def _report(best, worst) -> dict:
+    # best is inf, and worst -inf, if no path ever ends
+    return {"best" : None if best == math.inf else best,
+            "worst" : None if worst in (math.inf, -math.inf) else worst,
+            "returns" : best != math.inf,
+            "bounded" : worst not in (math.inf, -math.inf)}
+
+def analyze(lines : list, pending, words, labels : dict) -> dict:
+    '''Returns the timing report for an assembled program, as a dict that converts to JSON
+
+        lines are the source lines, pending and words the entries and words the
+        program was assembled into, and labels the symbol table (State.Labels).'''
+
+    program = _Program(lines, pending, words, labels)
+    report = {"labels" : [], "loops" : [], "waitcnt" : []}
+
+    for (name, symbol) in labels.items():
+        index = program.Label(name)
+
+        if index is None:
+            continue
+
+        result = program.Bounds([(index, 0, 0)])
+        row = {"label" : name, "line" : symbol.LineNumber, "cog" : symbol.CogAddress}
+        row.update(_report(result["best"], result["worst"]))
+
+        if symbol.Return is not None:
+            row["ret_line"] = symbol.Return.LineNumber
+
+        report["labels"].append(row)
+
+    for (index, entry) in enumerate(program.Entries):
+        if entry[1] != "WAITCNT":
+            continue
+
+        register = program.Field(index, "d")
+
+        if program.Words[index] & lang.i_flag:
+            delay = program.Field(index, "s")
+        else:
+            source = program.Find(index, program.Field(index, "s"))
+            delay = None if source is None or program.IsCode(source) else program.Words[source]
+
+        stop = {i for (i, e) in enumerate(program.Entries)
+                if e[1] == "WAITCNT" and program.Find(index, e[4]) == i and program.Field(i, "d") == register}
+
+        result = program.Bounds(program.Edges(index), stop)
+        row = {"line" : entry[3], "cog" : entry[4], "register" : register, "delay" : delay}
+        row.update(_report(result["best"], result["worst"]))
+
+        if delay is None or not row["bounded"]:
+            row["status"] = "unknown"
+        elif row["worst"] <= delay:
+            row["status"] = "met"
+        else:
+            row["status"] = "violated"
+
+        report["waitcnt"].append(row)
+
+    report["loops"] = sorted(program.Loops.values(), key=lambda loop: loop["line"])
+
+    return report
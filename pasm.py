@@ -12,68 +12,326 @@
 
 import argparse
 import os
+import re
+import json
+import struct
 import sys
+import concurrent.futures
 import assembler
-    
+import assembler.cache
+import assembler.disassembler
+import assembler.textformats
+import assembler.server
+
+def print_errors(errors):
+    print("Errors Encountered:\n")
+
+    for error in errors:
+        print("{: >3} : {}\n".format(error.LineNumber, error.Message))
+
+_manifest_comment = re.compile(r"(?:^|\s)['#]")     # not in a name like "part#2.pasm"
+
+def read_manifest(filename):
+    '''Returns the files listed in a manifest, one per line.  Blank lines and comments (' or #, at the
+        start of a line or after white space) are ignored.  Relative paths are relative to the manifest.'''
+
+    files = []
+    folder = os.path.dirname(filename)
+
+    with open(filename) as f:
+        for line in f:
+            line = _manifest_comment.split(line, 1)[0].strip()
+
+            if line:
+                files.append(os.path.join(folder, line))
+
+    return files
+
+def output_filename(filename, args):
+    if args.output:
+        return args.output
+
+    extension = {"binary" : ".binary", "eeprom" : ".eeprom"}.get(args.format, ".raw")
+
+    return os.path.splitext(filename)[0] + extension
+
+def output_artifacts(filename, args):
+    '''Returns the (cache extension, filename) of every file written for an input'''
+
+    outfile = output_filename(filename, args)
+    artifacts = [("." + args.format, outfile)]
+
+    if args.hex:
+        suffix = assembler.textformats.formats[args.hex][0]
+        artifacts.append(("." + args.format + suffix, outfile + suffix))
+
+    if args.listing:
+        artifacts.append(("." + args.format + ".lst", outfile + ".lst"))
+
+    if args.wcet:
+        artifacts.append(("." + args.format + ".wcet.json", outfile + ".wcet.json"))
+
+    return artifacts
+
+def _remove(path):
+    # Outputs may be hard links into the build cache, so they are replaced rather than rewritten.
+    if os.path.lexists(path):
+        os.unlink(path)
+
+def write_output(data, outfile, text_format=None):
+    _remove(outfile)
+
+    with open(outfile, "w+b") as f:
+        f.write(data)
+
+    if text_format:
+        (suffix, writer) = assembler.textformats.formats[text_format]
+        outfile += suffix
+        _remove(outfile)
+
+        with open(outfile, "w+") as f:
+            f.write(writer(data))
+
+def write_listing(text, outfile):
+    # also used for the --wcet report
+    _remove(outfile)
+
+    with open(outfile, "w+") as f:
+        f.write(text)
+
+def assemble_file(filename, args, key=None):
+    '''Assembles a file and writes its output(s), adding them to the build cache under key if given
+        Returns None on success, or a list of errors.  A failure never affects other files.'''
+
+    try:
+        with open(filename) as f:
+            source = f.read()
+    except OSError:
+        return [assembler.AssemblerError(0, "Failed to open file \"{0}\"!".format(filename))]
+
+    data = None
+
+    try:
+        if args.listing or args.wcet or args.schedule:
+            # the daemon only returns the image, so these are always made here
+            session = assembler.Assembler(args.format, args.hub_offset, args.syntax, args.parser, args.single_pass, args.schedule,
+                                          args.literal_pool)
+            data = session.Assemble(source.splitlines(True))
+
+            for block in session.ScheduleReport:
+                print("{}({}): hub stalls in block at ${:03X} cut from {} to {} cycles.".format(
+                      filename, block["line"], block["cog"], block["before"], block["after"]))
+
+            if args.listing:
+                write_listing(session.Listing(), output_filename(filename, args) + ".lst")
+
+            if args.wcet:
+                write_listing(json.dumps(session.Analyze(), indent=1) + "\n", output_filename(filename, args) + ".wcet.json")
+
+        elif args.daemon and assembler.server.trusted_socket(args.socket):
+            try:
+                data = assembler.server.request(source, args.format, args.hub_offset, args.syntax, args.parser, args.socket, args.single_pass, args.isa,
+                                                args.literal_pool)
+            except OSError:
+                pass    # no daemon listening; assemble locally
+
+        if data is None:
+            data = assembler.assemble(source.splitlines(True), args.format, args.hub_offset, syntax_version = args.syntax,
+                                      expression_parser = args.parser, single_pass = args.single_pass, literal_pool = args.literal_pool)
+
+        write_output(data, output_filename(filename, args), args.hex)
+
+        if key:
+            assembler.cache.BuildCache(args.cache).Store(key, output_artifacts(filename, args))
+
+    except assembler.AssemblyFailedError as e:
+        return e.Errors
+
+    except Exception as e:
+        return [assembler.AssemblerError(0, "{}: {}".format(type(e).__name__, e))]
+
+    return None
+
+def _init_worker(expression_parser, isa):
+    assembler.load_isa(isa)
+    assembler.initialize(expression_parser)
+
+def assemble_files(filenames, args, cache=None):
+    '''Assembles every file, using up to args.jobs processes
+        Files whose outputs are in the build cache are not assembled at all.
+        Returns a list of (filename, errors) in the same order as filenames'''
+
+    results = {}
+    pending = []
+
+    for filename in filenames:
+        key = None
+
+        if cache:
+            try:
+                with open(filename, "rb") as f:
+                    key = cache.Key(f.read(), args.format, args.hub_offset, args.syntax,
+                                    (args.parser or assembler.expression.default_parser(), args.single_pass, args.schedule, args.literal_pool))
+            except OSError:
+                pass    # reported by assemble_file
+
+            if key and cache.Fetch(key, output_artifacts(filename, args)):
+                results[filename] = None
+                continue
+
+        pending.append((filename, key))
+
+    if args.jobs <= 1 or len(pending) <= 1:
+        for (filename, key) in pending:
+            results[filename] = assemble_file(filename, args, key)
+    else:
+        # Batches are assembled in-process by each worker; the daemon is only used for single files.
+        args.daemon = False
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(args.parser, args.isa)) as executor:
+            files = [filename for (filename, key) in pending]
+            keys = [key for (filename, key) in pending]
+
+            results.update(zip(files, executor.map(assemble_file, files, [args] * len(files), keys)))
+
+    return [(filename, results[filename]) for filename in filenames]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-v", "--version", action="version", version="%(prog)s 0.1")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s " + assembler.__version__)
     parser.add_argument("-s", "--syntax", type=int, default=1, choices=(1,),
                         help="Syntax version of PASM code.")
     parser.add_argument("-f", "--format", type=str, default="binary", choices=["binary", "eeprom", "raw"],
                         help="Save as a binary with the SPIN bootstrap, EEPROM image with SPIN bootstrap, or without any bootstrap. Default: %(default)s.")
-    parser.add_argument("-x", "--hex", action="store_true", default=False,
+    parser.add_argument("-x", "--hex", action="store_const", const="hex", default=None,
                         help="Save output as a hex textfile.")
+    parser.add_argument("--hex-format", type=str, dest="hex", choices=sorted(assembler.textformats.formats),
+                        help="Save output as a text file in this format instead: hex (same as -x), ihex (Intel HEX), readmemh (Verilog $readmemh, 32-bit words) or mif (Altera).")
+
+    parser.add_argument("-l", "--listing", action="store_true", default=False,
+                        help="Also save a listing with the cycles each instruction takes and running totals per label.")
+    parser.add_argument("--wcet", action="store_true", default=False,
+                        help="Also save a JSON report of best and worst case cycles per label and loop, and of WAITCNT budgets. See assembler/wcet.py.")
 
     parser.add_argument("-b", "--hub_offset", type=int, default=1,
                         help="The initial value for the @ symbol.")
+    parser.add_argument("-p", "--parser", type=str, default=None, choices=assembler.expression.parsers,
+                        help="Constant expression parser. Default: pyparsing if it is installed, otherwise pratt.")
+
+    parser.add_argument("--schedule", action="store_true", default=False,
+                        help="Reorder independent instructions so hub instructions land on their hub window.")
+    parser.add_argument("--literal-pool", action="store_true", default=False,
+                        help="Place immediates too large for the s field in a pool of LONGs (at LITPOOL, or before the next RES, ORG or FIT) and refer to those instead.")
+    parser.add_argument("-1", "--single-pass", action="store_true", default=False,
+                        help="Encode instructions as they are read, backpatching forward references at the end.")
+
+    parser.add_argument("--isa", type=str, default=None, metavar="FILE",
+                        help="Use the instructions, conditions, constants and registers defined in this file instead of the built-in ones.")
+    parser.add_argument("--dump-isa", type=str, default=None, metavar="FILE",
+                        help="Write the built-in ISA as a definition file, to start an --isa file from, and exit.")
+    parser.add_argument("--disassemble", type=str, default=None, metavar="IMAGE",
+                        help="Write source for the code in an image of the given --format to --output (or the console), using the --isa tables, and exit.")
 
     parser.add_argument("-o", "--output", type=str, default="",
-                        help="Filename to save to (default is input filename with appropriate extension)")
-    parser.add_argument("filename", type=str, default="",
-                        help="Filename to be compiled.")
+                        help="Filename to save to (default is input filename with appropriate extension). Only valid for a single file.")
+    parser.add_argument("filename", type=str, nargs="*", default=[],
+                        help="Filename(s) to be compiled.")
+    parser.add_argument("-m", "--manifest", type=str, action="append", default=[],
+                        help="File listing more filenames to be compiled, one per line.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of files to assemble in parallel. Default: %(default)s.")
+
+    parser.add_argument("--cache", type=str, default=os.environ.get("PASM_CACHE", ""), metavar="FOLDER",
+                        help="Reuse outputs from this build cache when the source and options are unchanged. Default: $PASM_CACHE, if set.")
+    parser.add_argument("--cache-size", type=int, default=64, metavar="MB",
+                        help="Maximum size of the build cache. Default: %(default)s MB.")
+    parser.add_argument("--cache-stats", action="store_true", default=False,
+                        help="Print build cache hits and misses.")
+
+    parser.add_argument("--serve", action="store_true", default=False,
+                        help="Run as an assembler daemon listening on --socket.")
+    parser.add_argument("--socket", type=str, default=assembler.server.default_socket(),
+                        help="Unix socket of the assembler daemon. If a daemon is listening, files are assembled by it. Default: %(default)s.")
+    parser.add_argument("--no-daemon", action="store_false", dest="daemon", default=True,
+                        help="Always assemble in this process, even if a daemon is running.")
     
     args = parser.parse_args()
 
-    if args.filename == "":
+    if args.dump_isa:
+        with open(args.dump_isa, "w") as f:
+            f.write(assembler.isa.format_isa())
+
+        sys.exit(0)
+
+    if args.serve:
+        try:
+            assembler.server.serve(args.socket)
+        except OSError as e:
+            print("Failed to serve on \"{0}\": {1}".format(args.socket, e))
+            sys.exit(-1)
+
+        sys.exit(0)
+
+    if args.isa:
+        try:
+            assembler.load_isa(args.isa)
+        except (OSError, ValueError) as e:
+            print("Failed to load ISA \"{0}\": {1}".format(args.isa, e))
+            sys.exit(-1)
+
+    if args.disassemble:
+        try:
+            with open(args.disassemble, "rb") as f:
+                text = assembler.disassembler.disassemble(f.read(), args.format)
+        except (OSError, ValueError, struct.error) as e:
+            print("Failed to disassemble \"{0}\": {1}".format(args.disassemble, e))
+            sys.exit(-1)
+
+        if args.output:
+            write_listing(text, args.output)
+        else:
+            sys.stdout.write(text)
+
+        sys.exit(0)
+
+    filenames = list(args.filename)
+
+    try:
+        for manifest in args.manifest:
+            filenames += read_manifest(manifest)
+    except OSError as e:
+        print("Failed to read manifest \"{0}\"!".format(e.filename))
+        sys.exit(-1)
+
+    if not filenames:
         parser.print_help()
         sys.exit(-1)
 
-    try:
-        f = open(args.filename)
-    except OSError:
-        print("Failed to open file \"{0}\"!".format(args.filename))
+    if args.output and len(filenames) > 1:
+        print("--output cannot be used with more than one file.")
+        sys.exit(-1)
 
-    data = assembler.assemble(f, args.format, args.hub_offset, syntax_version = args.syntax)
+    cache = assembler.cache.BuildCache(args.cache, args.cache_size << 20) if args.cache else None
 
-    # Now, write it out...
-    outfile = os.path.splitext(args.filename)[0]
+    results = assemble_files(filenames, args, cache)
 
-    if args.output:
-        outfile = args.output
-    elif args.format == "binary":
-        outfile += ".binary"
-    elif args.format == "eeprom":
-        outfile += ".eeprom"
-    else:
-        outfile += ".raw"
+    if cache:
+        cache.Evict()
+        totals = cache.UpdateStatistics()
 
-    with open(outfile, "w+b") as f:
-        f.write(data)
+        if args.cache_stats:
+            print("Cache: {} hits, {} misses ({} hits, {} misses in total).".format(cache.Hits, cache.Misses, totals["hits"], totals["misses"]))
 
-    if args.hex:
-        outfile += ".hex"
-    
-        with open(outfile, "w+") as f:
-            count = 0
-
-            for b in data:
-                if count % 4 == 0:
-                    if count % 16 == 0:
-                        f.write("\n")
-                    else:
-                        f.write(" ")
-
-                f.write(format(b, "0>2x").upper())
-            
-                count += 1
+    failed = [(filename, errors) for (filename, errors) in results if errors]
+
+    for (filename, errors) in failed:
+        if len(filenames) > 1:
+            print("{}:".format(filename))
+
+        print_errors(errors)
+
+    if len(filenames) > 1:
+        print("{} assembled, {} failed.".format(len(filenames) - len(failed), len(failed)))
+
+    if failed:
+        sys.exit(1)
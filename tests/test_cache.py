@@ -0,0 +1,127 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The build cache: keys, fetching, eviction, and its use by pasm.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pasm
+from assembler.cache import BuildCache
+
+_source = b"""
+        ORG
+start   XOR     OUTA, #1
+        JMP     #start
+"""
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = BuildCache(os.path.join(self.folder, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name : str, data : bytes) -> str:
+        path = os.path.join(self.folder, name)
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return path
+
+    def test_key(self):
+        base = (_source, "binary", 1, 1, (False, False, "pratt", False))
+        key = self.cache.Key(*base)
+
+        self.assertEqual(self.cache.Key(*base), key)
+
+        changes = [(_source + b"\n", "binary", 1, 1, base[4]),
+                   (_source, "eeprom", 1, 1, base[4]),
+                   (_source, "binary", 0, 1, base[4]),
+                   (_source, "binary", 1, 2, base[4])]
+
+        for index in range(len(base[4])):
+            options = list(base[4])
+            options[index] = "pyparsing" if index == 2 else True
+            changes.append(base[0:4] + (tuple(options),))
+
+        keys = [self.cache.Key(*change) for change in changes]
+
+        self.assertNotIn(key, keys)
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_fetch_all_or_nothing(self):
+        key = self.cache.Key(_source, "binary", 1, 1)
+        image = self._write("a.binary", b"image")
+        text = self._write("a.binary.hex", b"text")
+
+        self.cache.Store(key, [(".binary", image)])
+        os.unlink(image)
+        os.unlink(text)
+
+        self.assertFalse(self.cache.Fetch(key, [(".binary", image), (".binary.hex", text)]))
+        self.assertFalse(os.path.exists(image))
+        self.assertEqual((self.cache.Hits, self.cache.Misses), (0, 1))
+
+        self.assertTrue(self.cache.Fetch(key, [(".binary", image)]))
+        self.assertEqual((self.cache.Hits, self.cache.Misses), (1, 1))
+
+        with open(image, "rb") as f:
+            self.assertEqual(f.read(), b"image")
+
+    def test_evict(self):
+        keys = [self.cache.Key(_source, "binary", 1, 1, (index,)) for index in range(4)]
+
+        for (index, key) in enumerate(keys):
+            self.cache.Store(key, [(".binary", self._write("{}.binary".format(index), bytes(100)))])
+
+            # the oldest entries go first
+            stamp = time.time() - 100 + index
+            os.utime(os.path.join(self.cache.Folder, key[:2], key + ".binary"), (stamp, stamp))
+
+        self.cache.UpdateStatistics()
+        self.cache.MaxSize = 250
+        self.cache.Evict()
+
+        remaining = [self.cache.Fetch(key, [(".binary", os.path.join(self.folder, "out.binary"))]) for key in keys]
+
+        self.assertEqual(remaining, [False, False, True, True])
+        self.assertTrue(os.path.isfile(os.path.join(self.cache.Folder, "stats.json")))
+
+    def test_pasm_hit(self):
+        args = argparse.Namespace(syntax=1, format="binary", hex=None, listing=False, wcet=False, hub_offset=1, parser=None,
+                                  schedule=False, literal_pool=False, single_pass=False, isa=None, output="", jobs=1,
+                                  cache=self.cache.Folder, daemon=False)
+        filename = self._write("a.pasm", _source)
+        output = os.path.join(self.folder, "a.binary")
+
+        self.assertEqual(pasm.assemble_files([filename], args, self.cache), [(filename, None)])
+
+        with open(output, "rb") as f:
+            image = f.read()
+
+        os.unlink(output)
+        self.assertEqual(pasm.assemble_files([filename], args, self.cache), [(filename, None)])
+        self.assertEqual((self.cache.Hits, self.cache.Misses), (1, 1))
+
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), image)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The disassembler: its source must assemble back to the same image.
+
+import os
+import sys
+import random
+import struct
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+from assembler.disassembler import Disassembler, disassemble
+
+_program = """
+        ORG     0
+start   MOV     vx, #5
+:loop   ADD     acc, vx
+        DJNZ    vx, #:loop
+        CMP     acc, #15 WZ
+        SUB     acc, vx NR
+  IF_NZ SUB     vz, #1 WC
+        RDLONG  vy, ptr
+        WRBYTE  vy, PAR
+        SHL     OUTA, #3 WZ WC
+        MOVS    start, #:loop
+        CALL    #pause
+        COGID   id
+        COGSTOP id
+        JMP     #start
+pause   WAITCNT vx, #100
+pause_ret RET
+
+acc     LONG    0
+vx      LONG    $FFFF_FFFF
+vy      LONG    0
+vz      LONG    $1234_5678
+ptr     LONG    $10
+id      LONG    0
+"""
+
+def _word(source : str) -> int:
+    return struct.unpack("<I", assembler.assemble([source], "raw"))[0]
+
+def _round_trip(image, binary_format : str) -> bytearray:
+    return assembler.assemble(disassemble(image, binary_format).splitlines(True), binary_format)
+
+class DisassemblerTest(unittest.TestCase):
+    def test_round_trip(self):
+        for binary_format in ("raw", "binary", "eeprom"):
+            with self.subTest(binary_format=binary_format):
+                image = assembler.assemble(_program.splitlines(True), binary_format)
+
+                self.assertEqual(_round_trip(image, binary_format), image)
+
+    def test_random_words(self):
+        random.seed(0)
+        image = struct.pack("<2000I", *(random.getrandbits(32) for i in range(2000)))
+
+        self.assertEqual(_round_trip(image, "raw"), image)
+
+    def test_fewest_effects_then_most_fixed_bits(self):
+        disassembler = Disassembler()
+
+        self.assertEqual(disassembler.Decode(_word("SUB 5, 6 NR")), ("", "CMP", "$005, $006"))
+        self.assertEqual(disassembler.Decode(_word("HUBOP 5, #1")), ("", "COGID", "$005 NR"))
+        self.assertEqual(disassembler.Decode(_word("IF_B ADD 5, #6 WZ")), ("IF_B", "ADD", "$005, #$006 WZ"))
+
+    def test_long(self):
+        # opcode 000100 is not an instruction
+        word = 0x10BC0000
+
+        self.assertEqual(Disassembler().Decode(word), ("", "LONG", "$10BC0000"))
+        self.assertEqual(_round_trip(struct.pack("<I", word), "raw"), struct.pack("<I", word))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The built-in (pratt) expression parser against the PyParsing grammar.
+# Run with: python -m unittest discover tests   (or python -m pytest tests)
+
+import os
+import sys
+import importlib.util
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from assembler.state import State
+from assembler.expression import ConstantExpression, parsers
+from assembler.exceptions import AssemblerError
+
+_have_pyparsing = importlib.util.find_spec("pyparsing") is not None
+
+# Expressions both parsers must accept, with the value they evaluate to.
+_corpus = {
+    # unary operators
+    "-5"                : -5,
+    "- 5"               : -5,
+    "-(3 + 4)"          : -7,
+    "- - 3"             : 3,
+    "1 - -3"            : 4,
+    "3 * -5"            : 0xFFFFFFF1,
+    "-FOO"              : -3,
+    "!0"                : -1,
+    "! $F0"             : -0xF1,
+    "!!5"               : 5,
+    "^^ 16"             : 4,
+    "^^ 17"             : 4,
+    "|< 3"              : 8,
+    "|< 31"             : 0x80000000,
+    "-|< 3"             : -8,
+    "|< 2 + 1"          : 5,
+    ">| 5"              : 3,
+    ">| -1"             : 32,
+    "|| -4"             : 4,
+    "NOT 0"             : -1,
+    "NOT 1 == 1"        : 0,
+    "NOT 0 AND 0"       : 0,
+
+    # rotates, shifts and reverse
+    "$1 -> 1"           : 0x80000000,
+    "$F0 -> 4"          : 0x0F,
+    "-1 -> 4"           : 0xFFFFFFFF,
+    "$1 <- 31"          : 0x80000000,
+    "$80000000 <- 1"    : 1,
+    "-2 <- 1"           : 0xFFFFFFFD,
+    "$12345678 -> 0"    : 0x12345678,
+    "$80000000 ~> 4"    : 0xF8000000,
+    "$F0 >< 8"          : 0x0F,
+    "-1 >< 4"           : 0x0F,
+    "1 >< 32"           : 0x80000000,
+    "$FF >> 4 -> 4"     : 0xF0000000,
+
+    # comparisons
+    "5 => 3"            : -1,
+    "3 => 5"            : 0,
+    "5 => 5"            : -1,
+    "3 =< 5"            : -1,
+    "5 =< 3"            : 0,
+    "1 <> 2"            : -1,
+    "2 <> 2"            : 0,
+    "1 < 2"             : -1,
+    "2 > 1"             : -1,
+    "FOO == 3"          : -1,
+
+    # precedence and associativity
+    "1 + 2 * 3"         : 7,
+    "(1 + 2) * 3"       : 9,
+    "10 - 4 - 3"        : 3,
+    "100 / 10 / 5"      : 2,
+    "2 << 1 + 1"        : 5,
+    "1 << 2 << 3"       : 32,
+    "1 | 2 & 3"         : 3,
+    "6 ^ 3 | 8"         : 13,
+    "1 + 2 == 3"        : -1,
+    "1 == 1 AND 2 == 3" : 0,
+    "0 OR 1 AND 0"      : 0,
+    "1 OR 0 AND 0"      : -1,
+    "2 * 3 // 4"        : 2,
+    "7 #> 3 <# 5"       : 5,
+    "-2 * -3"           : 6,
+    "$1_0000 ** $1_0000 + 1"  : 2,
+    "@BAR - @FOO + 4"   : 7,
+    }
+
+class ConstantExpressionTest(unittest.TestCase):
+    def setUp(self):
+        self.state = State()
+
+        for name in ("FOO", "BAR"):
+            self.state.CogAddress += 3
+            self.state.HubAddress += 3
+            self.state.AddLabel(name)
+            self.state.FixLabelAddresses()
+
+    def _value(self, parser : str, expression : str) -> int:
+        value = ConstantExpression(self.state, parser=parser).Evaluate(expression)
+        return value & 0xFFFFFFFF
+
+    def test_pratt(self):
+        for (expression, expected) in _corpus.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(self._value("pratt", expression), expected & 0xFFFFFFFF)
+
+    @unittest.skipUnless(_have_pyparsing, "PyParsing is not installed")
+    def test_pyparsing(self):
+        for (expression, expected) in _corpus.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(self._value("pyparsing", expression), expected & 0xFFFFFFFF)
+
+    @unittest.skipUnless(_have_pyparsing, "PyParsing is not installed")
+    def test_same_program(self):
+        pratt = ConstantExpression(self.state, parser="pratt")
+        grammar = ConstantExpression(self.state, parser="pyparsing")
+
+        for expression in _corpus:
+            with self.subTest(expression=expression):
+                self.assertEqual(pratt._parse(expression), grammar._parse(expression))
+
+    def test_errors(self):
+        for parser in parsers:
+            if parser == "pyparsing" and not _have_pyparsing:
+                continue
+
+            for expression in ("(1 + 2", "1 +", "4 + (!0", "1 ^^ 16", "* 2"):
+                with self.subTest(parser=parser, expression=expression):
+                    with self.assertRaises(AssemblerError):
+                        ConstantExpression(self.state, parser=parser).Evaluate(expression)
+
+if __name__ == "__main__":
+    unittest.main()
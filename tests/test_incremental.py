@@ -0,0 +1,111 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Reassembly in an Assembler session, in two passes or in one, against a clean
+# two-pass assemble() of the same source.
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+
+_program = """
+        ORG
+start   MOV     count, #7
+        MOV     ptr, #@table
+:loop   RDLONG  value, ptr
+        ADD     ptr, #4
+        ADD     total, value WC
+  IF_C  JMP     #overflow
+        DJNZ    count, #:loop
+        JMP     #start
+overflow
+        MOVS    :patch, #total
+:patch  MOV     OUTA, 0
+        JMP     #overflow
+count   LONG    0
+ptr     LONG    0
+value   LONG    0
+total   LONG    0
+table   LONG    1, 2, 3, 4
+        LONG    @table + 4, (3 + 4) * 2
+        RES     2
+        FIT
+"""
+
+def _result(assemble) -> tuple:
+    # the image, or the errors (line and message) it failed with
+    try:
+        return ("image", bytes(assemble()))
+    except assembler.AssemblyFailedError as e:
+        return ("errors", [(error.LineNumber, error.Message) for error in e.Errors])
+
+class IncrementalTest(unittest.TestCase):
+    options = {}
+
+    def assertEdits(self, edits : list, binary_format : str = "binary"):
+        # each edit is the source for the next Assemble() in the same session
+        session = assembler.Assembler(binary_format, **self.options)
+
+        for source in edits:
+            lines = source.splitlines(True)
+
+            self.assertEqual(_result(lambda: session.Assemble(lines)),
+                             _result(lambda: assembler.assemble(lines, binary_format)), source)
+
+    def test_edits(self):
+        self.assertEdits([_program,
+                          _program.replace("#7", "#9"),
+                          _program.replace("        ADD     ptr, #4\n", "        ADD     ptr, #4\n        NOP\n"),
+                          _program.replace("table   LONG    1, 2, 3, 4\n", ""),
+                          _program])
+
+    def test_restore_after_error(self):
+        # snapshots taken while a line is in error must not leak into the next run
+        self.assertEdits([_program,
+                          _program.replace("count   LONG    0", "count   LONG    0\ncount   LONG    1"),
+                          _program.replace("#7", "#undefined"),
+                          _program.replace("        FIT", "        FIT     4"),
+                          _program.replace("@table", "@tabel"),
+                          _program,
+                          _program.replace("#start", "#begin").replace("start   ", "begin   ")])
+
+    def test_random_edits(self):
+        random.seed(0)
+
+        for binary_format in ("raw", "binary"):
+            lines = _program.splitlines(True)
+            edits = []
+
+            for step in range(80):
+                edits.append("".join(lines))
+                index = random.randrange(len(lines))
+                edit = random.random()
+
+                if edit < 0.3 and len(lines) > 3:
+                    del lines[index]
+                elif edit < 0.6:
+                    lines.insert(index, random.choice(lines))
+                else:
+                    other = random.randrange(len(lines))
+                    (lines[index], lines[other]) = (lines[other], lines[index])
+
+            with self.subTest(binary_format=binary_format):
+                self.assertEdits(edits, binary_format)
+
+class SinglePassTest(IncrementalTest):
+    options = {"single_pass" : True}
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# ISA definition files and their compiled cache.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from assembler import isa, lang
+
+class IsaTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "p1x.isa")
+
+        # the built-in ISA, with MOV moved to another opcode
+        text = isa.format_isa().replace("\nMOV         101000", "\nMOV         101001")
+
+        with open(self.path, "w") as f:
+            f.write(text)
+
+        self.builtin = lang.fingerprint()
+
+    def tearDown(self):
+        isa.load(None)
+        shutil.rmtree(self.folder)
+
+    def _load(self) -> str:
+        isa.load(None)
+        self.assertTrue(isa.load(self.path))
+        return lang.fingerprint()
+
+    def test_cold_then_cached(self):
+        cold = self._load()
+
+        self.assertNotEqual(cold, self.builtin)
+        self.assertTrue(os.path.isfile(self.path + ".cache"))
+        self.assertEqual(self._load(), cold)
+        self.assertEqual(lang.encodings["MOV"][0] >> 26, 0b101001)
+
+        isa.load(None)
+        self.assertEqual(lang.fingerprint(), self.builtin)
+
+    def test_damaged_cache(self):
+        cold = self._load()
+
+        with open(self.path + ".cache") as f:
+            text = f.read()
+
+        cached = json.loads(text)
+        del cached["tables"]["encodings"]["MOV"]
+        missing = json.dumps(cached)
+
+        cached = json.loads(text)
+        cached["tables"]["instructions"]["MOV"] = 5
+        wrong_type = json.dumps(cached)
+
+        cached = json.loads(text)
+        cached["tables"]["instructions"]["CALL"][6] = "NO_SUCH_FIXUP"
+        bad_fixup = json.dumps(cached)
+
+        for damaged in (text[:len(text) // 2], missing, wrong_type, bad_fixup, "[]"):
+            with self.subTest(damaged=damaged[:40]):
+                with open(self.path + ".cache", "w") as f:
+                    f.write(damaged)
+
+                self.assertEqual(self._load(), cold)
+
+                with open(self.path + ".cache") as f:
+                    self.assertEqual(f.read(), text)
+
+if __name__ == "__main__":
+    unittest.main()
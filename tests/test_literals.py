@@ -0,0 +1,106 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Literal pools: where the LONGs go and what refers to them.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+from assembler.state import State
+
+def _pooled(source : str) -> bytearray:
+    return assembler.assemble(source.splitlines(True), "raw", literal_pool=True)
+
+def _assemble(source : str) -> bytearray:
+    return assembler.assemble(source.splitlines(True), "raw")
+
+class LiteralPoolTest(unittest.TestCase):
+    def test_litpool(self):
+        # each different value is pooled once; small immediates are left alone
+        self.assertEqual(_pooled("""
+                ORG     0
+                MOV     vx, #$12345
+                MOV     vy, #$12345
+                ADD     vy, #$FFFF WC
+                ADD     vy, #$1FF
+                LITPOOL
+        vx      LONG    0
+        vy      LONG    0
+        """), _assemble("""
+                ORG     0
+                MOV     vx, lit0
+                MOV     vy, lit0
+                ADD     vy, lit1 WC
+                ADD     vy, #$1FF
+        lit0    LONG    $12345
+        lit1    LONG    $FFFF
+        vx      LONG    0
+        vy      LONG    0
+        """))
+
+    def test_before_res_and_org(self):
+        self.assertEqual(_pooled("""
+                ORG     0
+                MOV     vx, #$12345
+        vx      RES     1
+                ORG     0
+                MOV     vy, #-1
+        vy      RES     1
+        """), _assemble("""
+                ORG     0
+                MOV     vx, lit0
+        lit0    LONG    $12345
+        vx      RES     1
+                ORG     0
+                MOV     vy, lit1
+        lit1    LONG    $FFFFFFFF
+        vy      RES     1
+        """))
+
+    def test_end_of_source(self):
+        self.assertEqual(_pooled("""
+                ORG     0
+                MOV     vx, #$12345
+        vx      LONG    0
+        """), _assemble("""
+                ORG     0
+                MOV     vx, lit0
+        vx      LONG    0
+        lit0    LONG    $12345
+        """))
+
+    def test_fit_counts_pool(self):
+        with self.assertRaises(assembler.AssemblyFailedError):
+            _pooled("""
+                ORG     0
+                MOV     0, #$12345
+                FIT     2
+            """)
+
+        _pooled("""
+                ORG     0
+                MOV     0, #$12345
+                FIT     3
+            """)
+
+    def test_literal_at_address_0(self):
+        state = State()
+        state.Literals = {}
+        assembler._prepare_parser(state, None)
+        state.PlaceSymbol(assembler._literal_prefix + "0")
+
+        self.assertEqual(assembler._evaluate_s(assembler._literal_prefix + "0", state), 0)
+
+if __name__ == "__main__":
+    unittest.main()
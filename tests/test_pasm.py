@@ -0,0 +1,97 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# pasm batches: manifests, and one failing file among many.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+import pasm
+
+_good = """
+        ORG
+start   XOR     OUTA, #{}
+        JMP     #start
+"""
+
+_bad = """
+        ORG
+start   XOR     OUTA, #1
+        JMP     #finish
+"""
+
+def _args(**options) -> argparse.Namespace:
+    # the options of a plain pasm run
+    args = dict(syntax=1, format="binary", hex=None, listing=False, wcet=False, hub_offset=1, parser=None, schedule=False,
+                literal_pool=False, single_pass=False, isa=None, output="", jobs=1, cache="", daemon=False)
+    args.update(options)
+
+    return argparse.Namespace(**args)
+
+class PasmTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name : str, text : str) -> str:
+        path = os.path.join(self.folder, name)
+
+        with open(path, "w") as f:
+            f.write(text)
+
+        return path
+
+    def test_read_manifest(self):
+        manifest = self._write("files.txt", "# parts\n"
+                                            "a.pasm\n"
+                                            "  ' old\n"
+                                            "\n"
+                                            "part#2.pasm   # the second part\n"
+                                            "sub/it's.pasm\t' quoted\n")
+
+        self.assertEqual(pasm.read_manifest(manifest),
+                         [os.path.join(self.folder, name) for name in ("a.pasm", "part#2.pasm", "sub/it's.pasm")])
+
+    def test_failing_file_isolated(self):
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                names = ["a.pasm", "bad.pasm", "b.pasm", "missing.pasm", "c.pasm"]
+                files = [self._write(name, _bad if name == "bad.pasm" else _good.format(index))
+                         for (index, name) in enumerate(names) if name != "missing.pasm"]
+                files.insert(3, os.path.join(self.folder, "missing.pasm"))
+
+                results = pasm.assemble_files(files, _args(jobs=jobs))
+
+                self.assertEqual([filename for (filename, errors) in results], files)
+                self.assertEqual([errors is None for (filename, errors) in results], [True, False, True, False, True])
+                self.assertEqual([error.LineNumber for error in results[1][1]], [4])
+
+                for (index, filename) in enumerate(files):
+                    output = os.path.splitext(filename)[0] + ".binary"
+
+                    if results[index][1] is None:
+                        with open(output, "rb") as f:
+                            self.assertEqual(f.read(), assembler.assemble(_good.format(index).splitlines(True), "binary", 1))
+
+                        os.unlink(output)
+                    else:
+                        self.assertFalse(os.path.exists(output))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Hub window scheduling: which instructions may move, and where they go.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+
+_data = """
+        JMP     #0
+va      LONG    0
+vb      LONG    0
+vx      LONG    0
+vy      LONG    0
+vz      LONG    0
+ptr     LONG    0
+"""
+
+def _program(lines : tuple, labelled : int = None) -> str:
+    # the instructions in lines, the one at index labelled with the label TOP, then _data
+    return "        ORG     0\n" + "".join("{:<8}{}\n".format("top" if index == labelled else "", line)
+                                            for (index, line) in enumerate(lines)) + _data
+
+def _schedule(source : str) -> tuple:
+    session = assembler.Assembler("raw", hub_schedule=True)
+    return (session.Assemble(source.splitlines(True)), session.ScheduleReport)
+
+def _assemble(source : str) -> bytearray:
+    return assembler.assemble(source.splitlines(True), "raw")
+
+class ScheduleTest(unittest.TestCase):
+    def assertScheduled(self, lines : tuple, expected : tuple, before : int, labelled : int = None):
+        (image, report) = _schedule(_program(lines, labelled))
+
+        self.assertEqual(image, _assemble(_program(expected, labelled)))
+        self.assertEqual([(row["before"], row["after"]) for row in report], [(before, 0)])
+
+    def assertUnchanged(self, lines : tuple, labelled : int = None):
+        (image, report) = _schedule(_program(lines, labelled))
+
+        self.assertEqual(image, _assemble(_program(lines, labelled)))
+        self.assertEqual(report, [])
+
+    def test_spacing(self):
+        # two 4-clock instructions between hub instructions bring the second onto its window
+        self.assertScheduled(("RDLONG va, ptr", "RDLONG vb, ptr", "ADD vx, #1", "ADD vy, #1"),
+                             ("RDLONG va, ptr", "ADD vx, #1", "ADD vy, #1", "RDLONG vb, ptr"), 8)
+
+    def test_labelled_entry_pinned(self):
+        lines = ("ADD vz, #1", "RDLONG va, ptr", "RDLONG vb, ptr", "ADD vx, #1", "ADD vy, #1")
+
+        self.assertScheduled(lines, ("RDLONG va, ptr", "ADD vz, #1", "ADD vx, #1", "RDLONG vb, ptr", "ADD vy, #1"), 8)
+
+        # a label keeps the first entry of its block first
+        self.assertScheduled(lines, ("ADD vz, #1", "RDLONG va, ptr", "ADD vx, #1", "ADD vy, #1", "RDLONG vb, ptr"), 8, 0)
+
+    def test_label_ends_block(self):
+        self.assertUnchanged(("RDLONG va, ptr", "RDLONG vb, ptr", "ADD vx, #1", "ADD vy, #1"), 1)
+
+    def test_fixed_entries_end_block(self):
+        for fixed in ("JMP #3", "WAITCNT vx, #4", "MOV OUTA, #1", "MOV CNT, #1", "MOV 0, #1", "MOV vx, INA"):
+            with self.subTest(fixed=fixed):
+                self.assertUnchanged(("RDLONG va, ptr", fixed, "RDLONG vb, ptr", "ADD vx, #1", "ADD vy, #1"))
+
+    def test_dependencies_kept(self):
+        for dependency in ("MOV vb, #1", "ADD ptr, #1", "ADD va, #1"):
+            with self.subTest(dependency=dependency):
+                self.assertScheduled(("RDLONG va, ptr", dependency, "RDLONG vb, ptr", "ADD vx, #1", "ADD vy, #1"),
+                                     ("RDLONG va, ptr", dependency, "ADD vx, #1", "RDLONG vb, ptr", "ADD vy, #1"), 4)
+
+    def test_flags_kept(self):
+        self.assertScheduled(("RDLONG va, ptr WZ", "RDLONG vb, ptr", "IF_Z ADD vx, #1", "ADD vy, #1"),
+                             ("RDLONG va, ptr WZ", "IF_Z ADD vx, #1", "ADD vy, #1", "RDLONG vb, ptr"), 8)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The assembler daemon: which sockets are trusted, and a request round trip.
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, _root)
+
+import assembler
+from assembler import server
+
+_source = """
+        ORG
+start   MOV     DIRA, #1
+        XOR     OUTA, #1
+        JMP     #start
+"""
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not available.")
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.chmod(self.folder, 0o700)
+        self.path = os.path.join(self.folder, "pasm.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _listen(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_trusted_socket(self):
+        self.assertFalse(server.trusted_socket(self.path))
+
+        with open(self.path, "w"):
+            pass
+
+        self.assertFalse(server.trusted_socket(self.path))
+
+        os.unlink(self.path)
+        self._listen()
+        os.chmod(self.path, 0o600)
+
+        self.assertTrue(server.trusted_socket(self.path))
+
+        os.chmod(self.path, 0o622)
+        self.assertFalse(server.trusted_socket(self.path))
+
+        os.chmod(self.path, 0o600)
+        os.chmod(self.folder, 0o770)
+        self.assertFalse(server.trusted_socket(self.path))
+
+    def test_request(self):
+        daemon = subprocess.Popen([sys.executable, "-c", "from assembler import server; server.serve({!r})".format(self.path)],
+                                  cwd=_root)
+
+        try:
+            for i in range(200):
+                if server.trusted_socket(self.path):
+                    break
+
+                time.sleep(0.05)
+
+            lines = _source.splitlines(True)
+
+            self.assertEqual(server.request(_source, "raw", 0, path=self.path), assembler.assemble(lines, "raw", 0))
+            self.assertEqual(server.request(_source, path=self.path), assembler.assemble(lines))
+
+            with self.assertRaises(assembler.AssemblyFailedError) as failed:
+                server.request(_source.replace("#start", "#finish"), path=self.path)
+
+            self.assertEqual([error.LineNumber for error in failed.exception.Errors], [5])
+        finally:
+            daemon.terminate()
+            daemon.wait(10)
+
+        self.assertFalse(os.path.lexists(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
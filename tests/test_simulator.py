@@ -0,0 +1,97 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The cog simulator: results, flags, clocks and the profile of a small program.
+
+import os
+import sys
+import struct
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+from assembler.simulator import Cog
+
+_program = """
+        ORG     0
+start   MOV     vx, #5
+:loop   ADD     acc, vx
+        DJNZ    vx, #:loop
+        CMP     acc, #15 WZ
+        SUB     vz, #1 WC
+        RDLONG  vy, ptr
+        COGID   id
+        COGSTOP id
+
+acc     LONG    0
+vx      LONG    0
+vy      LONG    0
+vz      LONG    0
+ptr     LONG    $10
+id      LONG    0
+"""
+
+_acc = 8        # cog address of acc
+
+def _cog() -> Cog:
+    return Cog(assembler.assemble(_program.splitlines(True)))
+
+def _word(line : str) -> int:
+    return struct.unpack("<I", assembler.assemble([line], "raw"))[0]
+
+class SimulatorTest(unittest.TestCase):
+    def test_run(self):
+        cog = _cog()
+
+        self.assertEqual(cog.Run(cycles=10000), "halted")
+
+        # vy is the hub long at $10, the first instruction of the image
+        self.assertEqual(list(cog.Cog[_acc:_acc + 6]), [15, 0, _word("MOV 9, #5"), 0xFFFFFFFF, 0x10, 0])
+        self.assertTrue(cog.Z)
+        self.assertTrue(cog.C)
+        self.assertEqual(cog.PC, 7)
+
+        # RDLONG starts at clock 56 and waits 8 for the window at 64; COGID and COGSTOP wait 8 each
+        self.assertEqual(cog.Cnt, 4 + 5 * 4 + 4 * 4 + 8 + 4 + 4 + 16 + 16 + 16)
+
+    def test_profile(self):
+        cog = _cog()
+        cog.Run(cycles=10000)
+
+        self.assertEqual([(row["address"], row["count"], row["cycles"]) for row in cog.Profile()],
+                         [(0, 1, 4), (1, 5, 20), (2, 5, 24), (3, 1, 4), (4, 1, 4), (5, 1, 16), (6, 1, 16), (7, 1, 16)])
+        self.assertEqual(sum(cog.Cycles), cog.Cnt)
+
+    def test_step_and_breakpoints(self):
+        cog = _cog()
+
+        self.assertEqual(cog.Step(), "limit")
+        self.assertEqual((cog.PC, cog.Cnt, cog.Cog[_acc + 1]), (1, 4, 5))
+
+        self.assertEqual(cog.Run(breakpoints=[3]), "breakpoint")
+        self.assertEqual((cog.PC, cog.Cnt, cog.Cog[_acc]), (3, 48, 15))
+
+        self.assertEqual(cog.Run(instructions=2), "limit")
+        self.assertEqual(cog.PC, 5)
+
+    def test_poke(self):
+        cog = _cog()
+
+        # the loop's ADD is decoded by its first run, and must not be executed again after the Poke
+        self.assertEqual(cog.Run(breakpoints=[2]), "breakpoint")
+        cog.Poke(1, _word("ADD 8, #100"))
+
+        self.assertEqual(cog.Run(cycles=10000), "halted")
+        self.assertEqual(cog.Cog[_acc], 5 + 4 * 100)
+        self.assertFalse(cog.Z)
+
+if __name__ == "__main__":
+    unittest.main()
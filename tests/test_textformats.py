@@ -0,0 +1,65 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The text renderings of an image against known-good output.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from assembler import textformats
+
+class TextFormatsTest(unittest.TestCase):
+    def test_hex_dump(self):
+        self.assertEqual(textformats.hex_dump(bytes(range(20))),
+                         "\n00010203 04050607 08090A0B 0C0D0E0F"
+                         "\n10111213")
+        self.assertEqual(textformats.hex_dump(bytes(range(6))), "\n00010203 0405")
+        self.assertEqual(textformats.hex_dump(b""), "")
+
+    def test_intel_hex(self):
+        # checksums worked out by hand: the two's complement of the record's byte sum
+        self.assertEqual(textformats.intel_hex(bytes(range(20))),
+                         ":10000000000102030405060708090A0B0C0D0E0F78\n"
+                         ":0400100010111213A6\n"
+                         ":00000001FF\n")
+
+    def test_intel_hex_extended_address(self):
+        records = textformats.intel_hex(bytes(0x10010)).splitlines()
+        zeros = ":10000000" + "00" * 16 + "F0"
+
+        self.assertEqual(records[0], zeros)
+        self.assertEqual(records[0x1000], ":020000040001F9")
+        self.assertEqual(records[0x1001], zeros)
+        self.assertEqual(records[-1], ":00000001FF")
+
+        for record in records:
+            self.assertEqual(sum(bytes.fromhex(record[1:])) & 0xFF, 0, record)
+
+    def test_readmemh(self):
+        self.assertEqual(textformats.readmemh(bytes(range(10))), "03020100\n07060504\n00000908\n")
+
+    def test_mif(self):
+        self.assertEqual(textformats.mif(bytes.fromhex("01000000 FFFFFFFF")),
+                         "WIDTH=32;\n"
+                         "DEPTH=2;\n"
+                         "\n"
+                         "ADDRESS_RADIX=HEX;\n"
+                         "DATA_RADIX=HEX;\n"
+                         "\n"
+                         "CONTENT BEGIN\n"
+                         "\t0000 : 00000001;\n"
+                         "\t0001 : FFFFFFFF;\n"
+                         "END;\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# The uploader: its encoding, against the original encoder, and its reads from a
+# fake serial port.
+
+import os
+import sys
+import time
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import upload
+
+def _encode_long(value):
+    # the original encoder: ten 3-bit groups, then the top 2 bits
+    result = bytearray()
+    for i in range(10):
+        result.append(0x92 | (value & 0x01) | ((value & 2) << 2) | ((value & 4) << 4))
+        value >>= 3
+    result.append(0xf2 | (value & 0x01) | ((value & 2) << 2))
+    return result
+
+class _Serial:
+    """A serial port whose replies arrive at set times after it is created
+
+        read() blocks for up to timeout seconds, as pyserial's does."""
+
+    baudrate = 115200
+
+    def __init__(self, replies=()):
+        self.timeout = 0
+        self.start = time.monotonic()
+        self.replies = sorted(replies)         # (seconds, bytes)
+        self.written = []
+        self.reads = 0
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def setDTR(self, value):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def flushInput(self):
+        self._ready()
+
+    def _ready(self) -> bytes:
+        now = time.monotonic() - self.start
+        data = b"".join(reply for (when, reply) in self.replies if when <= now)
+        self.replies = [(when, reply) for (when, reply) in self.replies if when > now]
+        return data
+
+    def read(self, count):
+        self.reads += 1
+        data = self._ready()
+
+        if not data and self.replies:
+            wait = self.replies[0][0] - (time.monotonic() - self.start)
+            time.sleep(max(0, min(wait, self.timeout)))
+            data = self._ready()
+        elif not data:
+            time.sleep(self.timeout)
+
+        (data, rest) = (data[:count], data[count:])
+
+        if rest:
+            self.replies.insert(0, (0, rest))
+
+        return data
+
+def _loader(replies=()) -> upload.Loader:
+    loader = upload.Loader(None)
+    loader.serial = _Serial(replies)
+    return loader
+
+class EncodeTest(unittest.TestCase):
+    def test_encode_long(self):
+        random.seed(0)
+        values = [0, 1, 7, 8, 0xfff, 0x1000, 0xffffff, 0x1000000, 0x7fffffff, 0x80000000, 0xffffffff]
+        values += [random.getrandbits(32) for i in range(2000)]
+
+        for value in values:
+            self.assertEqual(upload.encode_long(value), _encode_long(value), hex(value))
+
+        self.assertEqual(upload.encode_longs(values), b"".join(_encode_long(value) for value in values))
+        self.assertEqual(upload.encode_longs([]), b"")
+
+    def test_encode_code(self):
+        code = bytes(range(16)) + bytes(16)
+        longs = [upload.cmdLoadRamRun, 8] + [int.from_bytes(code[i:i + 4], "little") for i in range(0, 32, 4)]
+
+        self.assertEqual(upload.encode_code(code), b"".join(_encode_long(value) for value in longs))
+        self.assertEqual(upload.encode_code(code, eeprom=False, run=False), _encode_long(upload.cmdShutdown))
+
+class ReadTest(unittest.TestCase):
+    def test_read_bit_waits(self):
+        # without probes, one read waits for the reply
+        loader = _loader([(0.05, b"\xfe")])
+
+        self.assertEqual(loader._read_bit(False, 1), 0)
+        self.assertLessEqual(loader.serial.reads, 2)
+        self.assertEqual(loader.serial.timeout, 0)
+
+    def test_read_bit_probes(self):
+        # probes back off from 1 ms to 25 ms, so a reply at 100 ms takes about 8 of them
+        loader = _loader([(0.1, b"\xff")])
+        start = time.monotonic()
+
+        self.assertEqual(loader._read_bit(True, 1), 1)
+        self.assertLess(time.monotonic() - start, 0.1 + upload._probe_max + 0.05)
+        self.assertEqual(set(loader.serial.written), {b"\xf9"})
+        self.assertLess(len(loader.serial.written), 15)
+
+    def test_read_bit_errors(self):
+        with self.assertRaisesRegex(upload.LoaderError, "Bad reply"):
+            _loader([(0, b"\x00")])._read_bit(False, 1)
+
+        loader = _loader()
+        start = time.monotonic()
+
+        with self.assertRaisesRegex(upload.LoaderError, "Timeout error"):
+            loader._read_bit(True, 0.1)
+
+        self.assertLess(time.monotonic() - start, 0.1 + upload._probe_max + 0.05)
+        self.assertEqual(loader.serial.timeout, 0)
+
+class ConnectTest(unittest.TestCase):
+    # the reset takes 115 ms, and flushes anything received before it ends
+    after_reset = 0.2
+
+    def _connect(self, reply : bytes) -> upload.Loader:
+        loader = _loader([(self.after_reset, reply)] if reply else [])
+        self.version = loader._connect()
+        return loader
+
+    def test_read_bytes(self):
+        loader = _loader([(0.02, b"ab"), (0.04, b"cd"), (0.06, b"ef")])
+
+        self.assertEqual(loader._read_bytes(5, 1, "Lost"), b"abcde")
+        self.assertEqual(loader.serial.timeout, 0)
+
+        with self.assertRaisesRegex(upload.LoaderError, "^Lost$"):
+            loader._read_bytes(2, 0.1, "Lost")
+
+        self.assertEqual(loader.serial.timeout, 0)
+
+    def test_connect(self):
+        loader = self._connect(upload._handshake_reply + b"\xff\xfe\xff" + b"\xfe" * 5)
+
+        self.assertEqual(self.version, 5)
+        self.assertEqual(loader.serial.written, [b"\xf9", upload._handshake_request + b"\xf9" * (upload.lfsrReplyLen + 8)])
+
+    def test_no_hardware(self):
+        wrong = bytearray(upload._handshake_reply)
+        wrong[100] ^= 1
+
+        for reply in (b"", upload._handshake_reply[:-1], bytes(wrong) + b"\xfe" * 8):
+            with self.subTest(length=len(reply)):
+                with self.assertRaisesRegex(upload.LoaderError, "No hardware found"):
+                    self._connect(reply)
+
+    def test_version_errors(self):
+        with self.assertRaisesRegex(upload.LoaderError, "Timeout error"):
+            self._connect(upload._handshake_reply + b"\xfe" * 7)
+
+        with self.assertRaisesRegex(upload.LoaderError, "Bad reply"):
+            self._connect(upload._handshake_reply + b"\xfe" * 7 + b"\x00")
+
+if __name__ == "__main__":
+    unittest.main()
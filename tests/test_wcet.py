@@ -0,0 +1,96 @@
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Worst-case timing: loop bounds and WAITCNT budgets.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+
+_blink = """
+        ORG     0
+start   CALL    #blink
+        JMP     #start
+
+blink   MOV     count, #8
+:loop   XOR     OUTA, #1
+        DJNZ    count, #:loop{}
+blink_ret RET
+
+count   LONG    0
+"""
+
+_waits = """
+        ORG     0
+loop    WAITCNT time, #20
+        XOR     OUTA, #1
+        WAITCNT time, #4
+        NOP
+        NOP
+        JMP     #loop
+
+time    LONG    0
+"""
+
+_unbounded_wait = """
+        ORG     0
+loop    WAITCNT time, #20
+:spin   DJNZ    count, #:spin
+        JMP     #loop
+
+time    LONG    0
+count   LONG    0
+"""
+
+def _analyze(source : str) -> dict:
+    session = assembler.Assembler("raw")
+    session.Assemble(source.splitlines(True))
+    return session.Analyze()
+
+def _label(report : dict, name : str) -> dict:
+    return next(row for row in report["labels"] if row["label"] == name)
+
+class WcetTest(unittest.TestCase):
+    def test_bound(self):
+        report = _analyze(_blink.format("       ' @bound 8"))
+        blink = _label(report, "BLINK")
+
+        # MOV, then 8 taken DJNZs (XOR 4 + DJNZ 4), the last XOR and DJNZ (4 + 8), and RET
+        self.assertEqual((blink["best"], blink["worst"]), (20, 4 + 8 * 8 + 12 + 4))
+        self.assertTrue(blink["bounded"])
+        self.assertEqual(blink["ret_line"], 9)
+
+        loop = next(row for row in report["loops"] if row["line"] == 7)
+        self.assertEqual((loop["bound"], loop["iteration"]), (8, 8))
+
+    def test_no_bound(self):
+        blink = _label(_analyze(_blink.format("")), "BLINK")
+
+        self.assertEqual(blink["best"], 20)
+        self.assertIsNone(blink["worst"])
+        self.assertFalse(blink["bounded"])
+
+    def test_waitcnt_met_and_violated(self):
+        waits = _analyze(_waits)["waitcnt"]
+
+        self.assertEqual([(row["line"], row["delay"], row["worst"], row["status"]) for row in waits],
+                         [(3, 20, 10, "met"), (5, 4, 18, "violated")])
+
+    def test_waitcnt_unknown(self):
+        (wait,) = _analyze(_unbounded_wait)["waitcnt"]
+
+        self.assertEqual((wait["delay"], wait["worst"], wait["status"]), (20, None, "unknown"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Orochi is free software: you can redistribute it and/or modify it under the terms
+# of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version. The
+# software is distributed WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# the software.  If not, see <http://www.gnu.org/licenses/>.
+
+# Times assembler._build_image() against the image builder it replaced, which
+# concatenated the header, code and spin code (with its "eeprom" branch
+# repaired so it runs).  Both must build the same bytes.
+#
+#   python tools/bench_image.py [--repeat N] [--number N]
+
+import os
+import sys
+import random
+import timeit
+import argparse
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import assembler
+from assembler.pending import word_typecode
+
+def _old_build_image(output, binary_format):
+    if sys.byteorder != "little":
+        output = array(word_typecode, output)
+        output.byteswap()
+
+    data = bytearray(output.tobytes())
+
+    if binary_format in ("binary", "eeprom"):
+        spin_code = bytearray.fromhex("35 37 03 35   2C 00 00 00")
+
+        pbase = 0x0010
+        pcurr = pbase + len(data)
+        vbase = pcurr + len(spin_code)
+        dbase = vbase + 0x08
+        dcurr = dbase + 0x04
+
+        header  = bytearray(reversed(bytearray.fromhex(format(80000000, "0>8x"))))
+        header += bytearray([0x6F])
+        header += bytearray([0x00])
+        header += bytearray(reversed(bytearray.fromhex(format(pbase, "0>4x"))))
+        header += bytearray(reversed(bytearray.fromhex(format(vbase, "0>4x"))))
+        header += bytearray(reversed(bytearray.fromhex(format(dbase, "0>4x"))))
+        header += bytearray(reversed(bytearray.fromhex(format(pcurr, "0>4x"))))
+        header += bytearray(reversed(bytearray.fromhex(format(dcurr, "0>4x"))))
+
+        data = header + data + spin_code
+
+        checksum = (sum(data) + 0xEC) % 256
+        checksum = (256 - checksum) % 256
+        data[0x05] = checksum
+
+        if binary_format == "eeprom":
+            data += bytearray([0xff, 0xff, 0xf9, 0xff] * 2)
+            data += bytearray([0x00] * (0x8000 - len(data)))
+
+    return data
+
+def _best(function, number, repeat):
+    # best time per call, in microseconds
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs; the best is kept. Default: %(default)s.")
+    parser.add_argument("--number", type=int, default=200, help="Calls per timing run. Default: %(default)s.")
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    print("longs  format   old         new")
+
+    for longs in (496, 8000):
+        output = array(word_typecode, (random.getrandbits(32) for i in range(longs)))
+
+        for binary_format in ("raw", "binary", "eeprom"):
+            if binary_format == "eeprom" and longs * 4 > 0x8000 - 0x30:
+                continue
+
+            if _old_build_image(output, binary_format) != assembler._build_image(output, binary_format):
+                sys.exit("{} longs, {}: the builders disagree".format(longs, binary_format))
+
+            old = _best(lambda: _old_build_image(output, binary_format), args.number, args.repeat)
+            new = _best(lambda: assembler._build_image(output, binary_format), args.number, args.repeat)
+
+            print("{:<6} {:<8} {:>7.1f}us   {:>7.1f}us".format(longs, binary_format, old, new))
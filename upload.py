@@ -16,8 +16,15 @@
 # http://forums.parallax.com/showthread.php/157773-Stand-alone-Programmer?p=1298179
 
 import os
+import sys
+import glob
+import json
+import tempfile
 import time
+import struct
+import threading
 import serial
+from concurrent.futures import ThreadPoolExecutor
 
 # Processor constants
 lfsrRequestLen = 250
@@ -35,19 +42,58 @@ defSerial = {
     "nt": "COM1",
 }
 
+# A scan of the candidate ports is kept in the user's cache folder and reused
+# for _scan_ttl seconds, by later scans and as the default port.
+if os.name == "nt":
+    _cache_folder = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+else:
+    _cache_folder = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+_scan_cache = os.path.join(_cache_folder, "orochi", "scan.json")
+_scan_ttl = 60.0
+_scan_workers = 8
+
 def _lfsr(seed):
     """Generate bits from 8-bit LFSR with taps at 0xB2."""
     while True:
         yield seed & 0x01
         seed = ((seed << 1) & 0xfe) | (((seed >> 7) ^ (seed >> 5) ^ (seed >> 4) ^ (seed >> 1)) & 1)
 
+# A long is sent as 11 bytes: ten 3-bit groups, least significant first, then
+# the top 2 bits.  Each byte carries its bits as short/long pulses.
+_group = [0x92 | (v & 0x01) | ((v & 2) << 2) | ((v & 4) << 4) for v in range(8)]
+
+# bits 0-11 and 12-23 of a long -> their 4 bytes; bits 24-31 -> the last 3 bytes
+_low_bits = [bytes(_group[(v >> shift) & 7] for shift in (0, 3, 6, 9)) for v in range(4096)]
+_high_bits = [bytes((_group[v & 7], _group[(v >> 3) & 7], 0xf2 | ((v >> 6) & 0x01) | (((v >> 6) & 2) << 2))) for v in range(256)]
+
+_write_chunk = 11 * 1024        # encoded bytes per serial write
+
+# While the chip checks or programs, it answers a 0xF9 probe with its status
+# once it is done.  Probes start 1 ms apart, for quick answers, and back off
+# to 25 ms for the long EEPROM phases.
+_probe_min = 0.001
+_probe_max = 0.025
+
+# The handshake: the request bits from the LFSR, and the reply the chip must
+# send back (the next bits), one bit per byte.
+_handshake = [bit for (i, bit) in zip(range(lfsrRequestLen + lfsrReplyLen), _lfsr(lfsrSeed))]
+_handshake_request = bytes(bit | 0xfe for bit in _handshake[:lfsrRequestLen])
+_handshake_reply = bytes(bit | 0xfe for bit in _handshake[lfsrRequestLen:])
+
 def encode_long(value):
     """Encode a 32-bit long as short/long pulses."""
-    result = bytearray()
-    for i in range(10):
-        result.append(0x92 | (value & 0x01) | ((value & 2) << 2) | ((value & 4) << 4))
-        value >>= 3
-    result.append(0xf2 | (value & 0x01) | ((value & 2) << 2))
+    return bytearray(_low_bits[value & 0xfff] + _low_bits[(value >> 12) & 0xfff] + _high_bits[(value >> 24) & 0xff])
+
+def encode_longs(values):
+    """Encode a sequence of 32-bit longs into one buffer."""
+    result = bytearray(11 * len(values))
+    position = 0
+    for value in values:
+        result[position:position + 4] = _low_bits[value & 0xfff]
+        result[position + 4:position + 8] = _low_bits[(value >> 12) & 0xfff]
+        result[position + 8:position + 11] = _high_bits[(value >> 24) & 0xff]
+        position += 11
     return result
 
 
@@ -59,6 +105,53 @@ def do_nothing(msg):
 class LoaderError(Exception): pass
 
 
+def _bin_to_eeprom(code, size):
+    if len(code) > size - 8:
+        raise LoaderError("Code too long for EEPROM (max {} bytes)".format(size - 8))
+    
+    dbase = code[0x0a] + (code[0x0b] << 8)
+    
+    if dbase > size:
+        raise LoaderError("Invalid binary format")
+    
+    eeprom = bytearray(code)
+    eeprom += bytearray([0x00] * (dbase - 8 - len(code)))
+    eeprom += bytearray([0xff, 0xff, 0xf9, 0xff] * 2)
+    eeprom += bytearray([0x00] * int(size - len(code)))
+    
+    return eeprom
+
+def prepare_code(code, eeprom=False, eepromSize=32768):
+    """Check an image and convert it for RAM or EEPROM."""
+    if len(code) % 4 != 0:
+        raise LoaderError("Invalid code size: must be a multiple of 4")
+
+    if eeprom and len(code) < eepromSize:
+        code = _bin_to_eeprom(code, eepromSize)
+
+    checksum = sum(code)
+    
+    if not eeprom:
+        checksum += 2 * (0xff + 0xff + 0xf9 + 0xff)
+
+    checksum &= 0xff
+
+    if checksum != 0:
+        raise LoaderError("Code checksum error: 0x{:0>2x}".format(checksum))
+
+    return bytes(code)
+
+def encode_code(code, eeprom=False, run=True):
+    """Encode the load command, length and code of a prepared image as sent to the chip."""
+    command = [cmdShutdown, cmdLoadRamRun, cmdLoadEeprom, cmdLoadEepromRun][eeprom * 2 + run]
+
+    if not eeprom and not run:
+        return bytes(encode_long(command))
+
+    count = len(code) // 4
+    return bytes(encode_longs((command, count) + struct.unpack("<{}I".format(count), code)))
+
+
 class Loader(object):
     """Propeller code uploader."""
     eepromSize = 32768
@@ -88,27 +181,16 @@ class Loader(object):
             with open(path, "rb") as f:
                 code = f.read()
 
-        if len(code) % 4 != 0:
-            raise LoaderError("Invalid code size: must be a multiple of 4")
-
-        if eeprom and len(code) < self.eepromSize:
-            code = self._bin_to_eeprom(code)
-
-        checksum = sum(code)
-        
-        if not eeprom:
-            checksum += 2 * (0xff + 0xff + 0xf9 + 0xff)
-
-        checksum &= 0xff
-
-        if checksum != 0:
-            raise LoaderError("Code checksum error: 0x{:0>2x}".format(checksum))
+        self.send(encode_code(prepare_code(code, eeprom, self.eepromSize), eeprom, run), eeprom, run, progress)
 
+    def send(self, data, eeprom=False, run=True, progress=do_nothing):
+        """Connect to the Propeller and send code encoded by encode_code()."""
         self._open()
         try:
             version = self._connect()
             progress("Connected (version={})".format(version))
-            self._send_code(code, eeprom, run, progress)
+            self._send_code(data, eeprom, run, progress)
+            return version
         finally:
             self._close()
     
@@ -134,56 +216,43 @@ class Loader(object):
         self._reset()
         self._calibrate()
         
-        seq = []
-        
-        for (i, value) in zip(range(lfsrRequestLen + lfsrReplyLen), _lfsr(lfsrSeed)):
-            seq.append(value)
-        
-        self.serial.write(bytes((each | 0xfe) for each in seq[0:lfsrRequestLen]))
-        self.serial.write(bytes((0xf9,) * (lfsrReplyLen + 8)))
-        
-        for i in range(lfsrRequestLen, lfsrRequestLen + lfsrReplyLen):
-            if self._read_bit(False, 0.100) != seq[i]:
-                raise LoaderError("No hardware found")
-        
+        # the reply and the 8 version bits are clocked out by 0xF9 bytes
+        request = _handshake_request + bytes((0xf9,) * (lfsrReplyLen + 8))
+        self.serial.write(request)
+
+        # time to send the request and get every reply byte back, plus the chip's 100 ms
+        reply = self._read_bytes(lfsrReplyLen, 0.100 + 10.0 * (len(request) + lfsrReplyLen) / self.serial.baudrate,
+                                 "No hardware found")
+
+        if reply != _handshake_reply:
+            raise LoaderError("No hardware found")
+
         version = 0
-        for i in range(8):
-            version = ((version >> 1) & 0x7f) | ((self._read_bit(False, 0.050) << 7))
-        
+        for (i, c) in enumerate(self._read_bytes(8, 0.050 + 10.0 * 8 / self.serial.baudrate, "Timeout error")):
+            if c not in (0xfe, 0xff):
+                raise LoaderError("Bad reply")
+            version |= (c & 0x01) << i
+
         return version
 
-    def _bin_to_eeprom(self, code):
-        if len(code) > self.eepromSize - 8:
-            raise LoaderError("Code too long for EEPROM (max {} bytes)".format(self.eepromSize - 8))
-        
-        dbase = code[0x0a] + (code[0x0b] << 8)
-        
-        if dbase > self.eepromSize:
-            raise LoaderError("Invalid binary format")
-        
-        eeprom = bytearray(code)
-        eeprom += bytearray([0x00] * (dbase - 8 - len(code)))
-        eeprom += bytearray([0xff, 0xff, 0xf9, 0xff] * 2)
-        eeprom += bytearray([0x00] * int(self.eepromSize - len(code)))
-        
-        return eeprom
-        
-    def _send_code(self, code, eeprom=False, run=True, progress=do_nothing):
-        command = [cmdShutdown, cmdLoadRamRun, cmdLoadEeprom, cmdLoadEepromRun][eeprom * 2 + run]
-        
-        self._write_long(command)
-        
+    def _send_code(self, data, eeprom=False, run=True, progress=do_nothing):
         if not eeprom and not run:
+            self.serial.write(data)
             return
-        
-        self._write_long(len(code) // 4)
-        progress("Sending code ({} bytes)".format(len(code)))
-        
-        i = 0
-        while i < len(code): 
-            self._write_long(code[i] | (code[i + 1] << 8) | (code[i + 2] << 16) | (code[i + 3] << 24))
-            i += 4
-        
+
+        size = (len(data) // 11 - 2) * 4
+        progress("Sending code ({} bytes)".format(size))
+
+        start = time.time()
+
+        with memoryview(data) as view:
+            for i in range(0, len(data), _write_chunk):
+                self.serial.write(view[i:i + _write_chunk])
+
+        self.serial.flush()
+        elapsed = max(time.time() - start, 1e-6)
+        progress("Sent {} bytes in {:.2f} s ({:.0f} bytes/s)".format(size, elapsed, size / elapsed))
+
         if self._read_bit(True, 8) == 1:
             raise LoaderError("RAM checksum error")
         
@@ -203,19 +272,42 @@ class Loader(object):
     def _write_long(self, value):
         self.serial.write(encode_long(value))
         
+    def _read_bytes(self, count, timeout, message):
+        deadline = time.monotonic() + timeout
+        data = bytearray()
+        try:
+            while len(data) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LoaderError(message)
+                self.serial.timeout = remaining
+                data += self.serial.read(count - len(data))
+        finally:
+            self.serial.timeout = 0
+        return bytes(data)
+
     def _read_bit(self, echo, timeout):
-        start = time.time()
-        while time.time() - start < timeout:
-            if echo:
-                self._write_byte(0xf9)
-                time.sleep(0.025)
-            c = self.serial.read(1)
-            if c:
-                if c[0] in (0xfe, 0xff):
-                    return c[0] & 0x01
-                else:
-                    raise LoaderError("Bad reply")
-        raise LoaderError("Timeout error")
+        deadline = time.monotonic() + timeout
+        probe = _probe_min
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LoaderError("Timeout error")
+                if echo:
+                    self._write_byte(0xf9)
+                    remaining = min(remaining, probe)
+                    probe = min(probe * 2, _probe_max)
+                # blocks until the reply arrives or it is time for the next probe
+                self.serial.timeout = remaining
+                c = self.serial.read(1)
+                if c:
+                    if c[0] in (0xfe, 0xff):
+                        return c[0] & 0x01
+                    else:
+                        raise LoaderError("Bad reply")
+        finally:
+            self.serial.timeout = 0
 
 def get_version(serial):
     """Get the version of the connected Propeller chip."""
@@ -230,12 +322,146 @@ def upload(serial, path, eeprom=False, run=True, progress=do_nothing):
     loader.upload(path=path, eeprom=eeprom, run=run, progress=progress)
     progress("Done")
 
+def _upload_one(port, data, eeprom, run, retries, progress):
+    # one board of upload_many(), in its own thread with its own Loader
+    result = {"port": port, "version": None, "error": None, "attempts": 0, "seconds": 0.0}
+    start = time.time()
+
+    def report(msg):
+        progress("{}: {}".format(port, msg))
+
+    while result["attempts"] <= retries:
+        result["attempts"] += 1
+        try:
+            result["version"] = Loader(port).send(data, eeprom, run, report)
+            result["error"] = None
+            break
+        except (LoaderError, serial.SerialException, OSError) as e:
+            result["error"] = str(e)
+            report("Attempt {} failed: {}".format(result["attempts"], e))
+
+    result["seconds"] = time.time() - start
+    return result
+
+def upload_many(serials, path=None, code=None, eeprom=False, run=True, retries=0, progress=do_nothing):
+    """Upload one file to the Propellers on several serial ports at once.
+
+    The image is checked and encoded once and the same bytes are sent to every
+    port, each from its own thread.  Returns (results, seconds): a dict per port,
+    in the order given, with "port", "version", "error" (None on success),
+    "attempts" and "seconds", and the total wall time."""
+
+    if path is not None:
+        progress("Uploading {}".format(path))
+        with open(path, "rb") as f:
+            code = f.read()
+
+    start = time.time()
+    data = encode_code(prepare_code(code, eeprom, Loader.eepromSize), eeprom, run)
+    lock = threading.Lock()
+
+    def report(msg):
+        with lock:
+            progress(msg)
+
+    with ThreadPoolExecutor(max_workers=max(len(serials), 1)) as pool:
+        jobs = [pool.submit(_upload_one, port, data, eeprom, run, retries, report) for port in serials]
+        results = [job.result() for job in jobs]
+
+    return (results, time.time() - start)
+
+def candidate_ports():
+    """List the serial port devices a Propeller may be connected to."""
+    if os.name == "nt":
+        from serial.tools import list_ports
+        return sorted(port[0] for port in list_ports.comports())
+
+    return sorted(glob.glob("/dev/ttyUSB*") + glob.glob("/dev/ttyACM*"))
+
+def _probe(port):
+    try:
+        return Loader(port).get_version()
+    except (LoaderError, serial.SerialException, OSError):
+        return None
+
+def _read_scan(ttl):
+    try:
+        with open(_scan_cache) as f:
+            info = os.fstat(f.fileno())
+            if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & 0o022):
+                return None
+            cached = json.load(f)
+        if 0 <= time.time() - cached["time"] <= ttl:
+            return [(port, version) for (port, version) in cached["ports"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def _write_scan(results):
+    try:
+        folder = os.path.dirname(_scan_cache)
+        os.makedirs(folder, 0o700, exist_ok=True)
+        (handle, temp) = tempfile.mkstemp(dir=folder, prefix="scan.", suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as f:
+                json.dump({"time": time.time(), "ports": results}, f)
+            os.replace(temp, _scan_cache)
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+    except OSError:
+        pass
+
+def scan(ports=None, workers=_scan_workers, ttl=_scan_ttl):
+    """Find the Propellers on serial ports, probing several ports at once.
+
+    Returns a list of (port, version), with a version of None where no Propeller
+    answered.  Without ports, the candidate_ports() are probed, and the result
+    is saved and reused for ttl seconds (0 always probes)."""
+
+    if ports is None:
+        cached = _read_scan(ttl) if ttl > 0 else None
+        if cached is not None:
+            return cached
+
+        results = scan(candidate_ports(), workers)
+        _write_scan(results)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(ports)), 1)) as pool:
+        return list(zip(ports, pool.map(_probe, ports)))
+
+def found_ports(ttl=_scan_ttl):
+    """List the ports with a Propeller, from a recent scan or a new one."""
+    return [port for (port, version) in scan(ttl=ttl) if version is not None]
+
+def _default_serial():
+    # the first Propeller of a recent scan, without probing, or the platform default
+    for (port, version) in _read_scan(_scan_ttl) or ():
+        if version is not None:
+            sys.stderr.write("Using {} (found by scan)\n".format(port))
+            return port
+    return defSerial.get(os.name, "none")
+
 def printStatus(msg):
     """Print status messages."""
     print(msg)
     
 def _action_get_version(args):
-    get_version(args.serial)
+    get_version(args.serial or _default_serial())
+
+def _action_scan(args):
+    results = scan(args.serials or None, args.jobs, 0 if args.fresh else _scan_ttl)
+
+    if not results:
+        sys.stderr.write("No serial ports found\n")
+        return 1
+
+    print("{:<20} {}".format("Port", "Version"))
+    for (port, version) in results:
+        print("{:<20} {}".format(port, "-" if version is None else version))
+
+    return 0 if any(version is not None for (port, version) in results) else 1
 
 def _action_upload(args):
     path = args.filename
@@ -246,15 +472,50 @@ def _action_upload(args):
         args.destination = args.destination.upper()
     
     try:
-        upload(args.serial, path, (args.destination == "EEPROM"), args.run, printStatus)
+        upload(args.serial or _default_serial(), path, (args.destination == "EEPROM"), args.run, printStatus)
     except (SystemExit, KeyboardInterrupt):
         return 3
     except Exception as e:
         sys.stderr.write(str(e) + "\n")
         return 1
 
+def _action_upload_many(args):
+    path = args.filename
+
+    if path.endswith(".eeprom"):
+        args.destination = "EEPROM"
+    else:
+        args.destination = args.destination.upper()
+
+    try:
+        serials = args.serials or found_ports()
+        if not serials:
+            raise LoaderError("No Propeller found")
+
+        (results, seconds) = upload_many(serials, path, eeprom=(args.destination == "EEPROM"), run=args.run,
+                                         retries=args.retries, progress=printStatus)
+    except (SystemExit, KeyboardInterrupt):
+        return 3
+    except Exception as e:
+        sys.stderr.write(str(e) + "\n")
+        return 1
+
+    failed = 0
+
+    for result in results:
+        if result["error"] is None:
+            status = "OK (version={})".format(result["version"])
+        else:
+            status = "FAILED: {}".format(result["error"])
+            failed += 1
+
+        print("{:<20} {:<40} {} attempt(s), {:.2f} s".format(result["port"], status, result["attempts"], result["seconds"]))
+
+    print("{} of {} boards programmed in {:.2f} s".format(len(results) - failed, len(results), seconds))
+
+    return 1 if failed else 0
+
 if __name__ == "__main__":
-    import sys
     import argparse
 
     parser = argparse.ArgumentParser()
@@ -266,8 +527,8 @@ if __name__ == "__main__":
 
     parser_v = subparsers.add_parser("version")
     parser_v.set_defaults(action=_action_get_version)
-    parser_v.add_argument("-s", "--serial", dest="serial", type=str, metavar="DEVICE", default=defSerial.get(os.name, "none"),
-                          help="Select the serial port device. The default is %(default)s.")
+    parser_v.add_argument("-s", "--serial", dest="serial", type=str, metavar="DEVICE",
+                          help="Select the serial port device. The default is the first Propeller of a recent scan, or {}.".format(defSerial.get(os.name, "none")))
 
     parser_u = subparsers.add_parser("upload")
     parser_u.set_defaults(action=_action_upload)
@@ -277,8 +538,30 @@ if __name__ == "__main__":
                           help="Upload to RAM or to EEPROM.  The default is %(default)s.")
     parser_u.add_argument("-n", "--no-run", action="store_false", dest="run", default=True,
                           help="Don't run the code after upload.")
-    parser_u.add_argument("-s", "--serial", dest="serial", type=str, metavar="DEVICE", default=defSerial.get(os.name, "none"),
-                          help="Select the serial port device. The default is %(default)s.")
+    parser_u.add_argument("-s", "--serial", dest="serial", type=str, metavar="DEVICE",
+                          help="Select the serial port device. The default is the first Propeller of a recent scan, or {}.".format(defSerial.get(os.name, "none")))
+
+    parser_m = subparsers.add_parser("upload-many")
+    parser_m.set_defaults(action=_action_upload_many)
+    parser_m.add_argument("filename", type=str,
+                          help="Binary file to be uploaded.")
+    parser_m.add_argument("serials", type=str, nargs="*", metavar="DEVICE",
+                          help="Serial port devices to upload to, all at once.  The default is every Propeller found by scan.")
+    parser_m.add_argument("-d", "--destination", type=str, default="RAM", choices=["RAM", "EEPROM"],
+                          help="Upload to RAM or to EEPROM.  The default is %(default)s.")
+    parser_m.add_argument("-n", "--no-run", action="store_false", dest="run", default=True,
+                          help="Don't run the code after upload.")
+    parser_m.add_argument("-r", "--retries", type=int, default=1,
+                          help="Times to retry a board that fails.  The default is %(default)s.")
+
+    parser_s = subparsers.add_parser("scan")
+    parser_s.set_defaults(action=_action_scan)
+    parser_s.add_argument("serials", type=str, nargs="*", metavar="DEVICE",
+                          help="Serial port devices to probe.  The default is every /dev/ttyUSB* and /dev/ttyACM* device (every COM port on Windows).")
+    parser_s.add_argument("-j", "--jobs", type=int, default=_scan_workers,
+                          help="Ports to probe at once.  The default is %(default)s.")
+    parser_s.add_argument("-f", "--fresh", action="store_true",
+                          help="Probe again, even if a scan from the last {:.0f} seconds is saved.".format(_scan_ttl))
 
     args = parser.parse_args()
 